@@ -1,5 +1,8 @@
 import streamlit as st
+import session_memory
 import random
+import time
+from leaderboard import Leaderboard
 
 # 設定網頁標題與風格
 st.set_page_config(
@@ -8,6 +11,16 @@ st.set_page_config(
     layout="centered"
 )
 
+# 閒置太久的 session 會被暫存到磁碟，這裡負責登記活動並自動還原
+session_memory.touch()
+
+# 全站共用的排行榜 (所有 session 共用同一份，並存到本機檔案)
+@st.cache_resource
+def get_leaderboard():
+    return Leaderboard(path="leaderboard_app.json", k=10)
+
+board = get_leaderboard()
+
 # 初始化遊戲狀態（這是確保網頁不會報錯的關鍵）
 if "target_number" not in st.session_state:
     st.session_state.target_number = random.randint(1, 100)
@@ -17,18 +30,23 @@ if "is_finished" not in st.session_state:
     st.session_state.is_finished = False
 if "msg" not in st.session_state:
     st.session_state.msg = "請在下方輸入 1~100 的數字開始遊戲！"
+if "started_at" not in st.session_state:
+    st.session_state.started_at = time.time()
 
 def reset_game():
     """重新開始遊戲的函式"""
     st.session_state.target_number = random.randint(1, 100)
     st.session_state.counter = 0
     st.session_state.is_finished = False
+    st.session_state.started_at = time.time()
     st.session_state.msg = "遊戲已重置，請開始新的一局！"
 
 # UI 介面設計
 st.title("🐍 Python 課成果展示：猜數字遊戲")
 st.info(f"💡 目前狀態：{st.session_state.msg}")
 
+player = st.text_input("你的暱稱（上榜用）", key="player_name", placeholder="匿名")
+
 if not st.session_state.is_finished:
     # 數字輸入框
     user_input = st.number_input("你覺得是多少？", min_value=1, max_value=100, key="input_box")
@@ -42,6 +60,9 @@ if not st.session_state.is_finished:
         else:
             st.session_state.msg = f"🎉 答對了！答案就是 {st.session_state.target_number}！"
             st.session_state.is_finished = True
+            used = time.time() - st.session_state.started_at
+            if board.record(player, st.session_state.counter, used, time.strftime('%Y-%m-%d %H:%M')):
+                st.session_state.msg += f" 🏆 成功上榜！(用時 {used:.1f} 秒)"
             st.balloons()
         st.rerun() # 強制刷新畫面顯示最新訊息
 else:
@@ -50,6 +71,30 @@ else:
     if st.button("再玩一局", on_click=reset_game, use_container_width=True):
         st.rerun()
 
+# 排行榜與統計
+st.divider()
+st.subheader("🏆 排行榜")
+stats = board.summary()
+if stats['games']:
+    s1, s2, s3 = st.columns(3)
+    s1.metric("完成局數", f"{stats['games']:,}")
+    s2.metric("平均猜測次數", f"{stats['avg_guesses']:.2f}")
+    s3.metric("平均用時", f"{stats['avg_seconds']:.1f} 秒")
+    rank_a, rank_b = st.columns(2)
+    with rank_a:
+        st.caption("🎯 最少次數")
+        st.dataframe([{"暱稱": e['name'], "次數": e['guesses'], "秒數": e['seconds']} for e in board.fewest_guesses()], hide_index=True, use_container_width=True)
+    with rank_b:
+        st.caption("⚡ 最快完成")
+        st.dataframe([{"暱稱": e['name'], "秒數": e['seconds'], "次數": e['guesses']} for e in board.fastest()], hide_index=True, use_container_width=True)
+    st.caption("📊 猜測次數分布")
+    st.bar_chart([{"次數": k, "局數": v} for k, v in stats['histogram'].items()], x="次數", y="局數")
+else:
+    st.write("目前還沒有人完成遊戲，快來搶頭香！")
+
 # 頁尾資訊
 st.divider()
 st.caption("這是一個由 Streamlit 驅動的 Python 網頁應用程式。")
+
+# 這次執行的狀態變動寫回 session 後端 (有設定 LEDGER_SESSION_STORE 時)
+session_memory.persist()
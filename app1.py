@@ -1,5 +1,8 @@
 import streamlit as st
+import session_memory
 import random
+import time
+from leaderboard import Leaderboard
 
 # 設定網頁標題與風格
 st.set_page_config(
@@ -8,6 +11,9 @@ st.set_page_config(
     layout="centered"
 )
 
+# 閒置太久的 session 會被暫存到磁碟，這裡負責登記活動並自動還原
+session_memory.touch()
+
 # 套用一點 CSS 讓介面更有質感
 st.markdown("""
     <style>
@@ -26,6 +32,13 @@ st.markdown("""
     </style>
     """,unsafe_allow_html=True )
 
+# 全站共用的排行榜 (所有 session 共用同一份，並存到本機檔案)
+@st.cache_resource
+def get_leaderboard():
+    return Leaderboard(path="leaderboard_app1.json", k=10)
+
+board = get_leaderboard()
+
 # 初始化遊戲狀態
 if "target" not in st.session_state:
     st.session_state.target = random.randint(1, 100)
@@ -33,11 +46,14 @@ if "history" not in st.session_state:
     st.session_state.history = []
 if "game_over" not in st.session_state:
     st.session_state.game_over = False
+if "started_at" not in st.session_state:
+    st.session_state.started_at = time.time()
 
 def restart():
     st.session_state.target = random.randint(1, 100)
     st.session_state.history = []
     st.session_state.game_over = False
+    st.session_state.started_at = time.time()
 
 # 頁面內容
 st.title("🤖 智慧型猜數字系統")
@@ -45,6 +61,7 @@ st.write(f"這是一個運行在雲端的 Python 應用。目前 AI 已經選好
 
 # 側邊欄：顯示紀錄
 with st.sidebar:
+    player = st.text_input("🏷️ 你的暱稱（上榜用）", key="player_name", placeholder="匿名")
     st.header("📊 猜測紀錄")
     if st.session_state.history:
         for i, val in enumerate(st.session_state.history):
@@ -56,6 +73,8 @@ with st.sidebar:
         restart()
         st.rerun()
 
+session_memory.render_panel()
+
 # 主要遊戲區
 if not st.session_state.game_over:
     # 使用 columns 讓排版漂亮一點
@@ -78,12 +97,39 @@ if not st.session_state.game_over:
             st.success(f"🎊 恭喜！你猜中了！答案就是 {st.session_state.target}")
             st.balloons()
             st.session_state.game_over = True
+            used = time.time() - st.session_state.started_at
+            if board.record(player, len(st.session_state.history), used, time.strftime('%Y-%m-%d %H:%M')):
+                st.info(f"🏆 成功擠進排行榜！用時 {used:.1f} 秒")
 else:
     st.info(f"遊戲結束！你總共猜了 {len(st.session_state.history)} 次。")
     if st.button("開啟下一局挑戰", use_container_width=True):
         restart()
         st.rerun()
 
+# 排行榜與統計
+st.divider()
+st.subheader("🏆 全站排行榜")
+stats = board.summary()
+if stats['games']:
+    s1, s2, s3 = st.columns(3)
+    s1.metric("完成局數", f"{stats['games']:,}")
+    s2.metric("平均猜測次數", f"{stats['avg_guesses']:.2f}", help=f"標準差 {stats['std_guesses']:.2f}")
+    s3.metric("平均用時", f"{stats['avg_seconds']:.1f} 秒")
+    rank_a, rank_b = st.columns(2)
+    with rank_a:
+        st.caption("🎯 最少次數")
+        st.dataframe([{"暱稱": e['name'], "次數": e['guesses'], "秒數": e['seconds']} for e in board.fewest_guesses()], hide_index=True, use_container_width=True)
+    with rank_b:
+        st.caption("⚡ 最快完成")
+        st.dataframe([{"暱稱": e['name'], "秒數": e['seconds'], "次數": e['guesses']} for e in board.fastest()], hide_index=True, use_container_width=True)
+    st.caption("📊 猜測次數分布")
+    st.bar_chart([{"次數": k, "局數": v} for k, v in stats['histogram'].items()], x="次數", y="局數")
+else:
+    st.write("目前還沒有人完成挑戰，快來搶頭香！")
+
 # 頁尾說明
 st.divider()
 st.caption("Developed by Python Class Student | 伺服器運行中 🚀")
+
+# 這次執行的狀態變動寫回 session 後端 (有設定 LEDGER_SESSION_STORE 時)
+session_memory.persist()
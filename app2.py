@@ -1,11 +1,20 @@
 import streamlit as st
+import session_memory
 import json
 import os
 import pandas as pd
 from datetime import datetime, date, timedelta
-import io
-import uuid
+import time
 import plotly.express as px
+from ledger_query import QUERY_HELP
+import ledger_stats
+import ledger_ids
+import ledger_bulk
+import ledger_engine
+import ledger_suggest
+import ledger_tiers
+import ledger_browser
+import ledger_budget
 
 # 1. 網頁初始設定
 st.set_page_config(
@@ -14,43 +23,29 @@ st.set_page_config(
     layout="wide"
 )
 
+# 閒置太久的 session 會被暫存到磁碟，這裡負責登記活動並自動還原
+session_memory.touch()
+
 # 2. 數據處理核心
-class WebAccounting:
+class WebAccounting(ledger_tiers.TieredSession):
+    """紀錄、操作日誌、封存月份與各種索引的維護都在 TieredSession (與其他 app 共用)"""
+
     def __init__(self):
-        if 'records' not in st.session_state:
-            st.session_state.records = []
-        
-        if 'editing_id' not in st.session_state:
-            st.session_state.editing_id = None
+        # 分類預算 (含歷史)，預設只有一個每月總預算
+        if 'budgets' not in st.session_state:
+            st.session_state.budgets = ledger_budget.default_budgets(15000)
+        super().__init__(st.session_state)
 
     def save_data(self):
-        st.toast("✅ 數據已寫入暫時載體，重新整理前請下載備份！", icon="💾")
+        if ledger_browser.is_enabled():
+            st.toast("✅ 數據已保存在這個瀏覽器", icon="💽")
+        else:
+            st.toast("✅ 數據已寫入暫時載體，重新整理前請下載備份！", icon="💾")
         return True
 
-    def add_or_update_record(self, r_date, r_type, amount, category, note):
-        if st.session_state.editing_id is not None:
-            for r in st.session_state.records:
-                if r['id'] == st.session_state.editing_id:
-                    r.update({
-                        'date': r_date.strftime('%Y-%m-%d'),
-                        'type': r_type,
-                        'amount': amount,
-                        'category': category,
-                        'note': note
-                    })
-                    break
-            st.session_state.editing_id = None
-        else:
-            new_id = str(uuid.uuid4())[:8]
-            st.session_state.records.append({
-                'id': new_id, 
-                'date': r_date.strftime('%Y-%m-%d'),
-                'type': r_type, 
-                'amount': amount, 
-                'category': category, 
-                'note': note
-            })
-        self.save_data()
+    def _persist(self, events, target=None):
+        if any(e is not None for e in events): self.save_data()
+        return events
 
 # --- 初始化應用 ---
 if 'app' not in st.session_state:
@@ -60,36 +55,68 @@ app = st.session_state.app
 # 3. 側邊欄：搜尋與隱私還原
 with st.sidebar:
     st.header("🔍 數據管理")
-    search_query = st.text_input("搜尋備註關鍵字...", placeholder="例如：加油")
+    search_query = st.text_input("搜尋紀錄...", placeholder="例如：加油 amount>500 2026-01..2026-03", help=QUERY_HELP)
+    search_everything = ledger_tiers.render_status(app.archive())
+
+    st.divider()
+    st.header("🕘 操作紀錄")
+    u1, u2 = st.columns(2)
+    if u1.button("↩️ 復原", disabled=not app.can_undo(), use_container_width=True):
+        app.undo(); st.rerun()
+    if u2.button("↪️ 重做", disabled=not app.can_redo(), use_container_width=True):
+        app.redo(); st.rerun()
     
     st.divider()
     st.header("📤 資料還原")
     uploaded_file = st.file_uploader("上傳 JSON 備份檔", type="json")
-    if uploaded_file is not None:
+    # 同一個檔案只還原一次，避免之後每次重新執行都把新資料蓋掉
+    if uploaded_file is not None and st.session_state.get('restored_file_id') != uploaded_file.file_id:
         try:
             st.session_state.records = json.load(uploaded_file)
+            # 舊版備份的 8 碼字串 ID (或合併後重複的 ID) 換成新的整數 ID
+            migrated = ledger_ids.migrate(st.session_state.records)
+            if migrated: st.info(f"🔢 已將 {migrated} 筆舊版 ID 轉換為新格式，請重新下載備份")
+            app.reset_journal()
+            st.session_state.restored_file_id = uploaded_file.file_id
             st.success("✅ 資料已成功還原！")
         except:
             st.error("❌ 讀取失敗")
 
+    st.divider()
+    st.header("💽 瀏覽器保存")
+    restored = ledger_browser.render_sync(app.journal(), st.session_state.records, app.archive())
+    if restored is not None:
+        app.load_journal(*restored); st.rerun()
+
     st.divider()
     st.header("📥 下載備份")
-    if st.session_state.records:
-        json_str = json.dumps(st.session_state.records, ensure_ascii=False, indent=4)
-        st.download_button(label="💾 下載 JSON 備份", data=json_str, file_name=f"備份_{date.today()}.json")
-        
-        df_exp = pd.DataFrame(st.session_state.records)
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df_exp.to_excel(writer, index=False)
-        st.download_button(label="📊 導出 Excel 報表", data=buffer.getvalue(), file_name=f"報表_{date.today()}.xlsx")
+    if st.session_state.records or len(app.archive()):
+        # 按下才產生檔案 (含封存月份)，平常執行不必每次整份匯出
+        hot, archive = st.session_state.records, app.archive()
+        st.download_button(label="💾 下載 JSON 備份", data=lambda: ledger_engine.export_json(archive.merge(hot)), file_name=f"備份_{date.today()}.json")
+        st.download_button(label="📊 導出 Excel 報表", data=lambda: ledger_engine.export_excel(archive.merge(hot)), file_name=f"報表_{date.today()}.xlsx")
 
-# 4. 數據處理
+session_memory.render_panel()
+
+# 4. 數據處理 (只有熱資料；封存月份在查詢碰到時才解壓)
 df = pd.DataFrame(st.session_state.records)
+archived_ids = set()
 if not df.empty:
     df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-    if search_query:
-        df = df[df['note'].str.contains(search_query, na=False, case=False)]
+if search_query:
+    t0 = time.perf_counter()
+    if not df.empty:
+        df = df.iloc[app.search(search_query)]
+    cold, opened = app.archive().search(search_query, search_everything)
+    if cold:
+        archived_ids = {r['id'] for r in cold}
+        cold_df = pd.DataFrame(cold)
+        cold_df['amount'] = pd.to_numeric(cold_df['amount'], errors='coerce')
+        df = pd.concat([df, cold_df], ignore_index=True) if not df.empty else cold_df
+    st.sidebar.caption(f"🔎 找到 {len(df):,} 筆 ({(time.perf_counter() - t0) * 1000:.1f} ms"
+                       f"{f'，解壓 {opened} 個封存月份' if opened else ''})")
+# 分析頁的合計與分類圖：沒有搜尋時加上封存月份的摘要
+view = df if search_query else ledger_tiers.with_summary(df, app.archive())
 
 # 5. UI 主介面
 st.title("💰 個人理財數據帳本 ")
@@ -108,10 +135,14 @@ tab1, tab2, tab3 = st.tabs(["➕ 數據記帳", "📊 數據趨勢分析", "📋
 
 # --- Tab 1: 記帳 (修正分類對齊功能) ---
 with tab1:
-    edit_data = next((r for r in st.session_state.records if r['id'] == st.session_state.editing_id), None) if st.session_state.editing_id else None
+    edit_data = app.editing_record()
     if edit_data: st.warning(f"🔧 正在修改數據 ID: {st.session_state.editing_id}")
 
     r_type = st.radio("收支類型", ["支出", "收入"], index=0 if not edit_data or edit_data['type'] == "支出" else 1, horizontal=True)
+    cats = ['薪水', '獎金', '投資', '其他'] if r_type == '收入' else ['飲食', '交通', '購物', '醫療', '訂閱', '其他']
+
+    # 備註放在表單外：按 Enter 就列出常用備註，並依備註預先選好分類
+    note, predicted_idx = ledger_suggest.render_note_input(app.notes, r_type, cats, value=edit_data['note'] if edit_data else "")
     
     with st.form("input_form", clear_on_submit=(not st.session_state.editing_id)):
         c_a, c_b = st.columns(2)
@@ -121,24 +152,28 @@ with tab1:
             amount = st.number_input("金額 (TWD)", min_value=0.0, step=10.0, value=float(edit_data['amount']) if edit_data else 0.0)
             
             # 💡 核心修正：計算正確的分類索引
-            cats = ['薪水', '獎金', '投資', '其他'] if r_type == '收入' else ['飲食', '交通', '購物', '醫療', '訂閱', '其他']
             default_cat_idx = 0
             if edit_data and edit_data['category'] in cats:
                 default_cat_idx = cats.index(edit_data['category'])
+            elif predicted_idx is not None:
+                default_cat_idx = predicted_idx
             
             category = st.selectbox("分類標籤", cats, index=default_cat_idx)
             
-        note = st.text_input("備註說明", value=edit_data['note'] if edit_data else "")
-        if st.form_submit_button("🚀 寫入本地載體", use_container_width=True):
+        btn_col1, btn_col2 = st.columns(2)
+        if btn_col1.form_submit_button("🚀 寫入本地載體", use_container_width=True):
             if amount > 0:
-                app.add_or_update_record(r_date, r_type, amount, category, note)
+                app.add_or_update(r_date, r_type, amount, category, note)
+                ledger_suggest.clear_note()
                 st.rerun()
+        if edit_data and btn_col2.form_submit_button("❌ 取消編輯", use_container_width=True):
+            app.cancel_edit(); st.rerun()
 
 # --- Tab 2: 分析 (預算橫向進度條) ---
 with tab2:
-    if not df.empty:
-        total_in = df[df['type'] == '收入']['amount'].sum()
-        total_ex = df[df['type'] == '支出']['amount'].sum()
+    if not view.empty:
+        total_in = view[view['type'] == '收入']['amount'].sum()
+        total_ex = view[view['type'] == '支出']['amount'].sum()
         st.subheader("💰 財務現況概覽")
         m1, m2, m3 = st.columns(3)
         m1.metric("總收入", f"${total_in:,.0f}")
@@ -146,38 +181,55 @@ with tab2:
         m3.metric("淨資產", f"${total_in - total_ex:,.0f}")
         
         st.divider()
-        st.subheader("🎯 本月預算執行進度")
-        budget = st.number_input("💸 設定本月支出預算目標", min_value=1000, value=15000, step=500)
-        percent = min(total_ex / budget, 1.0)
-        
-        col_prog, col_val = st.columns([4, 1])
-        with col_prog:
-            st.progress(percent)
-        with col_val:
-            st.write(f"**{percent*100:.1f}%**")
-        st.write(f"📊 目前進度：**${total_ex:,.0f}** / ${budget:,.0f}")
+        # 預算以全部紀錄評估 (不受搜尋篩選影響；封存月份用摘要)
+        actuals = ledger_tiers.budget_actuals(st.session_state.records, app.archive())
+        saved = ledger_budget.render_budget(actuals, st.session_state.budgets, ['飲食', '交通', '購物', '醫療', '訂閱', '其他'])
+        if saved is not None:
+            st.session_state.budgets = saved; st.rerun()
         
         st.divider()
         col_left, col_right = st.columns(2)
         with col_left:
-            in_df = df[df['type'] == '收入']
+            in_df = view[view['type'] == '收入']
             if not in_df.empty:
                 st.plotly_chart(px.bar(in_df.groupby('category')['amount'].sum().reset_index(), x='category', y='amount', title="收入來源占比", color='category'), use_container_width=True)
         with col_right:
-            ex_df = df[df['type'] == '支出']
+            ex_df = view[view['type'] == '支出']
             if not ex_df.empty:
                 st.plotly_chart(px.pie(ex_df.groupby('category')['amount'].sum().reset_index(), values='amount', names='category', title="支出類別分布", hole=0.3), use_container_width=True)
+
+        st.divider()
+        ledger_stats.render_trends(app.stats(taiwan_now.date()))
     else: st.info("📊 尚未有數據可進行分析。")
 
 # --- Tab 3: 明細 ---
 with tab3:
-    if not df.empty:
-        for _, row in df.sort_values(by='date', ascending=False).iterrows():
-            with st.expander(f"📅 {row['date']} | {row['type']} - ${row['amount']:,.0f}"):
+    grid_mode = st.toggle("🧮 表格批次編輯", key="grid_mode", help="直接在表格修改、勾選多列批次改分類或刪除，按儲存時一次寫入")
+    if len(app.archive()) and not search_query:
+        months = app.archive().months()
+        st.caption(f"🗄️ {months[0]} ~ {months[-1]} 已封存，搜尋日期範圍 (例如 {months[-1]}) 即可查看")
+    if not df.empty and grid_mode:
+        # 封存月份唯讀，只有熱資料可以批次編輯
+        change = ledger_bulk.render_editor(df[~df['id'].isin(archived_ids)], ['薪水', '獎金', '投資', '飲食', '交通', '購物', '醫療', '訂閱', '其他'])
+        if change:
+            app.apply_batch(*change); st.rerun()
+    elif not df.empty:
+        # 與同分類平常金額差太多的紀錄加上 ⚠️
+        z_scores = app.stats(taiwan_now.date()).flag(df)
+        for i, row in df.sort_values(by=['date', 'id'], ascending=False).iterrows():
+            odd = ledger_stats.is_anomaly(z_scores[i])
+            with st.expander(f"{'⚠️' if odd else '📅'} {row['date']} | {row['type']} - ${row['amount']:,.0f}"):
+                if odd: st.warning(ledger_stats.anomaly_note(z_scores[i]))
                 st.write(f"📝 備註: {row['note']}")
+                if row['id'] in archived_ids:
+                    if st.button("📤 移回近期以修改", key=f"thaw_{row['id']}", help="整個月份移回熱資料 (儲存或取消修改後，下次載入時再封存)"):
+                        app.promote(str(row['date'])[:7]); st.rerun()
+                    continue
                 ec1, ec2 = st.columns(2)
                 if ec1.button("✏️ 修改", key=f"edit_{row['id']}"):
                     st.session_state.editing_id = row['id']; st.rerun()
                 if ec2.button("🗑️ 刪除", key=f"del_{row['id']}"):
-                    st.session_state.records = [r for r in st.session_state.records if r['id'] != row['id']]
-                    app.save_data(); st.rerun()
+                    app.delete(row['id']); st.rerun()
+
+# 這次執行的狀態變動寫回 session 後端 (有設定 LEDGER_SESSION_STORE 時)
+session_memory.persist()
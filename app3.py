@@ -1,11 +1,20 @@
 import streamlit as st
+import session_memory
 import json
 import os
 import pandas as pd
 from datetime import datetime, date, timedelta
-import io
-import uuid
+import time
 import plotly.express as px
+from ledger_query import QUERY_HELP
+import ledger_stats
+import ledger_ids
+import ledger_bulk
+import ledger_engine
+import ledger_suggest
+import ledger_tiers
+import ledger_browser
+import ledger_budget
 
 # ==========================================
 # 1. 網頁初始設定
@@ -16,53 +25,36 @@ st.set_page_config(
     layout="wide"
 )
 
+# 閒置太久的 session 會被暫存到磁碟，這裡負責登記活動並自動還原
+session_memory.touch()
+
 # ==========================================
 # 2. 數據處理核心類別
 # ==========================================
-class WebAccounting:
+class WebAccounting(ledger_tiers.TieredSession):
+    """紀錄、操作日誌、封存月份與各種索引的維護都在 TieredSession (與其他 app 共用)"""
+
     def __init__(self):
-        # 確保資料儲存容器存在於 Session State
-        if 'records' not in st.session_state:
-            st.session_state.records = []
-        
-        # 確保編輯 ID 追蹤存在
-        if 'editing_id' not in st.session_state:
-            st.session_state.editing_id = None
+        # 分類預算 (含歷史)，預設只有一個每月總預算
+        if 'budgets' not in st.session_state:
+            st.session_state.budgets = ledger_budget.default_budgets(15000)
+
+        # 確保資料儲存容器、編輯 ID 追蹤與操作日誌存在於 Session State
+        super().__init__(st.session_state)
 
     def save_notice(self):
         """顯示存檔成功提示"""
-        st.toast("✅ 數據已寫入載體，請點擊左側下載備份！", icon="💾")
+        if ledger_browser.is_enabled():
+            st.toast("✅ 數據已自動保存在這個瀏覽器", icon="💽")
+        else:
+            st.toast("✅ 數據已寫入載體，請點擊左側下載備份！", icon="💾")
         return True
 
-    def add_or_update_record(self, r_date, r_type, amount, category, note):
-        """處理新增與修改邏輯"""
-        if st.session_state.editing_id is not None:
-            # --- 修改既有資料 ---
-            for r in st.session_state.records:
-                if r['id'] == st.session_state.editing_id:
-                    r.update({
-                        'date': r_date.strftime('%Y-%m-%d'),
-                        'type': r_type,
-                        'amount': amount,
-                        'category': category,
-                        'note': note
-                    })
-                    break
-            st.session_state.editing_id = None
-        else:
-            # --- 新增全新資料 ---
-            new_id = str(uuid.uuid4())[:8]
-            st.session_state.records.append({
-                'id': new_id, 
-                'date': r_date.strftime('%Y-%m-%d'),
-                'type': r_type, 
-                'amount': amount, 
-                'category': category, 
-                'note': note
-            })
-        
-        # 執行提示
-        self.save_notice()
+    def _persist(self, events, target=None):
+        """每次寫入 (含刪除、批次、復原) 後提示一次"""
+        if any(e is not None for e in events):
+            self.save_notice()
+        return events
 
 # --- 初始化應用執行個體 ---
 if 'app' not in st.session_state:
@@ -75,59 +67,104 @@ app = st.session_state.app
 # ==========================================
 with st.sidebar:
     st.header("🔍 數據管理系統")
-    search_query = st.text_input("搜尋備註關鍵字...", placeholder="例如：晚餐")
+    search_query = st.text_input("搜尋紀錄...", placeholder="例如：晚餐 amount>500 2026-01..2026-03", help=QUERY_HELP)
+    # 舊月份已封存時顯示狀態，並可選擇連封存月份一起搜尋
+    search_everything = ledger_tiers.render_status(app.archive())
     
     st.divider()
+
+    # 多步復原 / 重做 (刪錯資料不必再重新上傳備份)
+    st.header("🕘 操作紀錄")
+    u1, u2 = st.columns(2)
+    if u1.button("↩️ 復原", disabled=not app.can_undo(), use_container_width=True):
+        app.undo()
+        st.rerun()
+    if u2.button("↪️ 重做", disabled=not app.can_redo(), use_container_width=True):
+        app.redo()
+        st.rerun()
+
+    st.divider()
     
     st.header("📤 資料還原")
-    st.write("重新整理網頁後，請上傳 JSON 檔恢復數據：")
+    if not ledger_browser.is_enabled():
+        st.write("重新整理網頁後，請上傳 JSON 檔恢復數據：")
     uploaded_file = st.file_uploader("選擇備份檔案", type="json")
     
-    if uploaded_file is not None:
+    # 同一個檔案只還原一次，避免之後每次重新執行都把新資料蓋掉
+    if uploaded_file is not None and st.session_state.get('restored_file_id') != uploaded_file.file_id:
         try:
             st.session_state.records = json.load(uploaded_file)
+            # 舊版備份的 8 碼字串 ID (或合併後重複的 ID) 換成新的整數 ID
+            migrated = ledger_ids.migrate(st.session_state.records)
+            if migrated: st.info(f"🔢 已將 {migrated} 筆舊版 ID 轉換為新格式，請重新下載備份")
+            app.reset_journal()
+            st.session_state.restored_file_id = uploaded_file.file_id
             st.success("✅ 資料已成功還原！")
         except Exception as e:
             st.error(f"❌ 檔案讀取失敗: {e}")
 
     st.divider()
+
+    # 開啟後資料以壓縮差異存在瀏覽器，重新整理會自動還原
+    st.header("💽 瀏覽器保存")
+    restored = ledger_browser.render_sync(app.journal(), st.session_state.records, app.archive())
+    if restored is not None:
+        app.load_journal(*restored)
+        st.rerun()
+
+    st.divider()
     
     st.header("📥 備份與導出")
-    if st.session_state.records:
+    if st.session_state.records or len(app.archive()):
+        # 按下才產生檔案 (含封存月份)，平常執行不必每次整份匯出
+        hot, archive = st.session_state.records, app.archive()
+
         # JSON 備份 (供系統還原使用)
-        json_data = json.dumps(st.session_state.records, ensure_ascii=False, indent=4)
         st.download_button(
             label="💾 下載 JSON 備份 (防消失)",
-            data=json_data,
+            data=lambda: ledger_engine.export_json(archive.merge(hot)),
             file_name=f"理財備份_{date.today()}.json",
             mime="application/json",
             use_container_width=True
         )
         
         # Excel 導出 (供報表查看使用)
-        df_export = pd.DataFrame(st.session_state.records)
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df_export.to_excel(writer, index=False)
-        
         st.download_button(
             label="📊 導出 Excel 報表",
-            data=buffer.getvalue(),
+            data=lambda: ledger_engine.export_excel(archive.merge(hot)),
             file_name=f"財務月報_{date.today()}.xlsx",
             use_container_width=True
         )
     else:
         st.info("尚無數據可下載備份")
 
+session_memory.render_panel()
+
 # ==========================================
 # 4. 數據預處理 (過濾搜尋內容)
 # ==========================================
+# 只處理熱資料；封存月份在查詢碰到時才解壓
 df = pd.DataFrame(st.session_state.records)
+archived_ids = set()
 if not df.empty:
     df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-    if search_query:
-        # 執行備註內容搜尋
-        df = df[df['note'].str.contains(search_query, na=False, case=False)]
+if search_query:
+    # 執行查詢語法搜尋 (日期 / 金額範圍、類型、分類、備註)
+    t0 = time.perf_counter()
+    if not df.empty:
+        df = df.iloc[app.search(search_query)]
+    # 查詢的日期範圍碰到封存月份 (或選擇搜尋全部) 時才解壓那幾個月
+    cold, opened = app.archive().search(search_query, search_everything)
+    if cold:
+        archived_ids = {r['id'] for r in cold}
+        cold_df = pd.DataFrame(cold)
+        cold_df['amount'] = pd.to_numeric(cold_df['amount'], errors='coerce')
+        df = pd.concat([df, cold_df], ignore_index=True) if not df.empty else cold_df
+    st.sidebar.caption(f"🔎 找到 {len(df):,} 筆 ({(time.perf_counter() - t0) * 1000:.1f} ms"
+                       f"{f'，解壓 {opened} 個封存月份' if opened else ''})")
+
+# 分析頁的合計與圖表：沒有搜尋時加上封存月份的摘要
+view = df if search_query else ledger_tiers.with_summary(df, app.archive())
 
 # ==========================================
 # 5. UI 主介面與招呼語
@@ -157,11 +194,20 @@ with tab1:
     # 檢查是否處於編輯模式
     edit_item = None
     if st.session_state.editing_id:
-        edit_item = next((r for r in st.session_state.records if r['id'] == st.session_state.editing_id), None)
+        edit_item = app.editing_record()
         st.warning(f"🔧 正在修改數據 (ID: {st.session_state.editing_id})")
 
     # 收支類型切換
     r_type = st.radio("收支類型", ["支出", "收入"], index=0 if not edit_item or edit_item['type'] == "支出" else 1, horizontal=True)
+
+    # 分類連動選單
+    income_cats = ['薪水', '獎金', '投資', '其他']
+    expense_cats = ['飲食', '交通', '購物', '醫療', '訂閱', '其他']
+    current_cats = income_cats if r_type == '收入' else expense_cats
+
+    # 備註輸入 (放在表單外：按 Enter 就列出常用備註，並依備註預先選好分類)
+    r_note, predicted_idx = ledger_suggest.render_note_input(app.notes, r_type, current_cats,
+                                                             value=edit_item['note'] if edit_item else "")
     
     with st.form("input_form", clear_on_submit=(not st.session_state.editing_id)):
         col_a, col_b = st.columns(2)
@@ -176,33 +222,32 @@ with tab1:
             amt_val = float(edit_item['amount']) if edit_item else 0.0
             r_amount = st.number_input("金額 (TWD)", min_value=0.0, step=10.0, value=amt_val)
             
-            # 分類連動選單
-            income_cats = ['薪水', '獎金', '投資', '其他']
-            expense_cats = ['飲食', '交通', '購物', '醫療', '訂閱', '其他']
-            current_cats = income_cats if r_type == '收入' else expense_cats
-            
-            # 修正分類對齊邏輯
+            # 修正分類對齊邏輯 (新增時依備註預測)
             idx = 0
             if edit_item and edit_item['category'] in current_cats:
                 idx = current_cats.index(edit_item['category'])
+            elif predicted_idx is not None:
+                idx = predicted_idx
             
             r_category = st.selectbox("分類標籤", current_cats, index=idx)
-            
-        # 備註輸入
-        r_note = st.text_input("備註說明", value=edit_item['note'] if edit_item else "")
         
-        # 提交按鈕
-        if st.form_submit_button("🚀 寫入本地載體", use_container_width=True):
+        # 提交與取消按鈕
+        btn_col1, btn_col2 = st.columns(2)
+        if btn_col1.form_submit_button("🚀 寫入本地載體", use_container_width=True):
             if r_amount > 0:
-                app.add_or_update_record(r_date, r_type, r_amount, r_category, r_note)
+                app.add_or_update(r_date, r_type, r_amount, r_category, r_note)
+                ledger_suggest.clear_note()
                 st.rerun()
+        if edit_item and btn_col2.form_submit_button("❌ 取消編輯", use_container_width=True):
+            app.cancel_edit()
+            st.rerun()
 
 # --- Tab 2: 數據分析 (包含收入長條圖與預算進度) ---
 with tab2:
-    if not df.empty:
+    if not view.empty:
         # 計算核心指標
-        sum_in = df[df['type'] == '收入']['amount'].sum()
-        sum_ex = df[df['type'] == '支出']['amount'].sum()
+        sum_in = view[view['type'] == '收入']['amount'].sum()
+        sum_ex = view[view['type'] == '支出']['amount'].sum()
         
         st.subheader("💰 財務現況概覽")
         m1, m2, m3 = st.columns(3)
@@ -212,17 +257,12 @@ with tab2:
         
         st.divider()
         
-        # 預算執行進度 (橫向長條與數據)
-        st.subheader("🎯 本月預算執行進度")
-        user_budget = st.number_input("💸 設定本月支出預算", min_value=1000, value=15000, step=500)
-        pct = min(sum_ex / user_budget, 1.0)
-        
-        c_p, c_v = st.columns([4, 1])
-        with c_p:
-            st.progress(pct)
-        with c_v:
-            st.write(f"**{pct*100:.1f}%**")
-        st.write(f"📊 執行狀況：**${sum_ex:,.0f}** / ${user_budget:,.0f}")
+        # 分類預算：本月進度、月底預測與歷月超支熱圖 (以全部紀錄評估，不受搜尋篩選影響；封存月份用摘要)
+        actuals = ledger_tiers.budget_actuals(st.session_state.records, app.archive())
+        saved = ledger_budget.render_budget(actuals, st.session_state.budgets, ['飲食', '交通', '購物', '醫療', '訂閱', '其他'])
+        if saved is not None:
+            st.session_state.budgets = saved
+            st.rerun()
         
         st.divider()
         
@@ -230,7 +270,7 @@ with tab2:
         c_l, c_r = st.columns(2)
         with c_l:
             # 收入來源長條圖
-            in_data = df[df['type'] == '收入']
+            in_data = view[view['type'] == '收入']
             if not in_data.empty:
                 st.plotly_chart(px.bar(in_data.groupby('category')['amount'].sum().reset_index(), 
                                        x='category', y='amount', title="收入來源占比", color='category'), use_container_width=True)
@@ -239,22 +279,51 @@ with tab2:
                 
         with c_r:
             # 支出比例圓餅圖
-            ex_data = df[df['type'] == '支出']
+            ex_data = view[view['type'] == '支出']
             if not ex_data.empty:
                 st.plotly_chart(px.pie(ex_data.groupby('category')['amount'].sum().reset_index(), 
                                        values='amount', names='category', title="支出類別分布", hole=0.3), use_container_width=True)
             else:
                 st.info("尚無支出數據可分析")
+
+        st.divider()
+
+        # 近 7 / 30 / 90 天趨勢 (增量維護，不必每次重算整份帳本)
+        ledger_stats.render_trends(app.stats(tw_now.date()))
     else:
         st.info("📊 尚未有數據進行分析。")
 
 # --- Tab 3: 歷史明細清單 ---
 with tab3:
-    if not df.empty:
-        # 依日期降冪排列
-        for _, row in df.sort_values(by='date', ascending=False).iterrows():
-            with st.expander(f"📅 {row['date']} | {row['type']} - ${row['amount']:,.0f}"):
+    grid_mode = st.toggle("🧮 表格批次編輯", key="grid_mode", help="直接在表格修改、勾選多列批次改分類或刪除，按儲存時一次寫入")
+    if len(app.archive()) and not search_query:
+        months = app.archive().months()
+        st.caption(f"🗄️ {months[0]} ~ {months[-1]} 已封存，搜尋日期範圍 (例如 {months[-1]}) 即可查看")
+    if not df.empty and grid_mode:
+        # 表格模式：所有變更收集成一份差異，按儲存時一次套用 (封存月份唯讀，只編輯熱資料)
+        change = ledger_bulk.render_editor(df[~df['id'].isin(archived_ids)], income_cats + expense_cats)
+        if change:
+            app.apply_batch(*change)
+            st.rerun()
+    elif not df.empty:
+        # 與同分類平常金額差太多的紀錄加上 ⚠️
+        z_scores = app.stats(tw_now.date()).flag(df)
+
+        # 依日期降冪排列 (同一天依 ID，也就是新增順序)
+        for i, row in df.sort_values(by=['date', 'id'], ascending=False).iterrows():
+            odd = ledger_stats.is_anomaly(z_scores[i])
+            with st.expander(f"{'⚠️' if odd else '📅'} {row['date']} | {row['type']} - ${row['amount']:,.0f}"):
+                if odd:
+                    st.warning(ledger_stats.anomaly_note(z_scores[i]))
                 st.write(f"📝 備註: {row['note']}")
+
+                # 封存月份唯讀：要修改時整個月份移回熱資料
+                if row['id'] in archived_ids:
+                    if st.button("📤 移回近期以修改", key=f"thaw_{row['id']}", help="整個月份移回熱資料 (儲存或取消修改後，下次載入時再封存)"):
+                        app.promote(str(row['date'])[:7])
+                        st.rerun()
+                    continue
+
                 ec1, ec2 = st.columns(2)
                 
                 if ec1.button("✏️ 修改數據", key=f"e_{row['id']}"):
@@ -262,12 +331,14 @@ with tab3:
                     st.rerun()
                     
                 if ec2.button("🗑️ 刪除紀錄", key=f"d_{row['id']}"):
-                    st.session_state.records = [r for r in st.session_state.records if r['id'] != row['id']]
-                    st.toast("🗑️ 數據已刪除")
+                    app.delete(row['id'])
                     st.rerun()
     else:
         st.info("📋 尚無歷史紀錄。")
 
+# 這次執行的狀態變動寫回 session 後端 (有設定 LEDGER_SESSION_STORE 時)
+session_memory.persist()
+
 # ==========================================
 # 程式結束 (本版本約 284 行規格，包含排版空行)
 # ==========================================
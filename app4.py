@@ -1,66 +1,78 @@
 import streamlit as st
+import session_memory
 import pandas as pd
 import plotly.express as px
 from datetime import datetime, date, timedelta
-import uuid
-from streamlit_gsheets import GSheetsConnection
+import time
+import fake_gsheets
+from ledger_query import QUERY_HELP
+import ledger_stats
+import ledger_bulk
+import ledger_engine
+import ledger_suggest
 
 # ==========================================
 # 1. 網頁初始設定
 # ==========================================
 st.set_page_config(page_title="雲端記帳通用版", page_icon="💰", layout="wide")
 
+# 閒置太久的 session 會被暫存到磁碟，這裡負責登記活動並自動還原
+session_memory.touch()
+
 # ==========================================
 # 2. 核心邏輯：雲端載體控制器
 # ==========================================
-class CloudAccounting:
+# Sheet1 是最近一次的快照；之後的每筆異動只追加一列到 Journal 工作表
+# (讀寫工作表、操作日誌與各種索引都在 ledger_engine.SheetsLedgerSession，與 app5 共用)
+class CloudAccounting(ledger_engine.SheetsLedgerSession):
     def __init__(self):
+        conn = None
         try:
-            self.conn = st.connection("gsheets", type=GSheetsConnection)
+            conn = st.connection("gsheets", type=fake_gsheets.connection_type())
             self.is_connected = True
         except Exception as e:
             st.error(f"⚠️ 連線初始化失敗：{e}")
             self.is_connected = False
-
-        if 'records' not in st.session_state:
-            st.session_state.records = []
-        if 'editing_id' not in st.session_state:
-            st.session_state.editing_id = None
+        super().__init__(st.session_state, conn)
 
     def load_data(self, sheet_url=None):
+        """讀取快照 (Sheet1) 並重播 Journal 尾端事件"""
         if not self.is_connected or not sheet_url: return []
         try:
-            df = self.conn.read(spreadsheet=sheet_url, worksheet="Sheet1", ttl=0)
-            if df is not None and not df.empty:
-                df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
-                df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
-                st.session_state.records = df.to_dict('records')
-                return st.session_state.records
+            migrated = self.load_journal(sheet_url)
+            if migrated:
+                # 舊版 8 碼字串 ID (或重複 ID) 已換成整數 ID：立刻寫回一份完整快照
+                self.save_data(sheet_url)
+                st.toast(f"🔢 已將 {migrated} 筆舊版 ID 轉換為新格式")
+            return st.session_state.records
         except Exception as e:
             st.warning(f"⚠️ 無法讀取資料，請確認：\n1. 網址是否正確？\n2. 是否已共用給機器人？\n錯誤訊息：{e}")
         return []
 
     def save_data(self, sheet_url=None):
+        """完整快照：整份寫回 Sheet1 並清空 Journal (壓縮)"""
         if not self.is_connected or not sheet_url: return False
         try:
-            df = pd.DataFrame(st.session_state.records) if st.session_state.records else pd.DataFrame(columns=['id', 'date', 'type', 'amount', 'category', 'note'])
-            self.conn.update(spreadsheet=sheet_url, worksheet="Sheet1", data=df)
+            self._write_snapshot(sheet_url)
             st.toast("✅ 數據已安全同步至雲端！", icon="☁️")
             return True
         except Exception as e:
             st.error(f"❌ 寫入失敗：{e}")
             return False
 
-    def add_or_update(self, r_date, r_type, amount, category, note, sheet_url=None):
-        if st.session_state.editing_id:
-            for r in st.session_state.records:
-                if r['id'] == st.session_state.editing_id:
-                    r.update({'date': r_date.strftime('%Y-%m-%d'), 'type': r_type, 'amount': amount, 'category': category, 'note': note})
-                    break
-            st.session_state.editing_id = None
-        else:
-            st.session_state.records.append({'id': str(uuid.uuid4())[:8], 'date': r_date.strftime('%Y-%m-%d'), 'type': r_type, 'amount': amount, 'category': category, 'note': note})
-        self.save_data(sheet_url)
+    def _persist(self, events, sheet_url=None):
+        """平常只追加這次的事件；累積夠多時才改做完整快照"""
+        events = [e for e in events if e is not None]
+        if not events or not self.is_connected or not sheet_url: return False
+        if self.journal().needs_snapshot():
+            return self.save_data(sheet_url)
+        try:
+            self._append_events(sheet_url, events)
+            st.toast("✅ 數據已安全同步至雲端！", icon="☁️")
+            return True
+        except Exception as e:
+            st.error(f"❌ 寫入失敗：{e}")
+            return False
 
 if 'app' not in st.session_state: st.session_state.app = CloudAccounting()
 app = st.session_state.app
@@ -107,8 +119,17 @@ with st.sidebar:
 
     if st.button("🔄 讀取帳本"):
         st.rerun()
+
+    # 多步復原 / 重做 (反向操作同樣以事件追加到 Journal)
+    u1, u2 = st.columns(2)
+    if u1.button("↩️ 復原", disabled=not target_url or not app.can_undo(), use_container_width=True):
+        app.undo(target_url); st.rerun()
+    if u2.button("↪️ 重做", disabled=not target_url or not app.can_redo(), use_container_width=True):
+        app.redo(target_url); st.rerun()
     st.divider()
-    search_query = st.text_input("搜尋備註...", placeholder="例如：午餐")
+    search_query = st.text_input("搜尋紀錄...", placeholder="例如：午餐 amount>100 2026-01", help=QUERY_HELP)
+
+session_memory.render_panel()
 
 # ==========================================
 # 4. 數據載入與 UI
@@ -131,7 +152,12 @@ else:
     # 這裡開始才是原本的介面
     df = pd.DataFrame(st.session_state.records)
     if not df.empty and search_query:
-        df = df[df['note'].str.contains(search_query, na=False, case=False)]
+        t0 = time.perf_counter()
+        df = df.iloc[app.search(search_query)]
+        st.sidebar.caption(f"🔎 找到 {len(df):,} 筆 ({(time.perf_counter() - t0) * 1000:.1f} ms)")
+
+    # 滾動統計以台灣日期 (UTC+8) 判斷今天，與其他 app 一致
+    tw_today = (datetime.now() + timedelta(hours=8)).date()
 
     st.title("💰 記帳本")
     st.caption(f"使用中帳本：...{target_url[-10:] if target_url else ''}")
@@ -140,9 +166,12 @@ else:
     tab1, tab2, tab3 = st.tabs(["➕ 雲端記帳", "📊 戰力分析", "📋 歷史檔案"])
 
     with tab1:
-        edit_item = next((r for r in st.session_state.records if r['id'] == st.session_state.editing_id), None) if st.session_state.editing_id else None
+        edit_item = app.editing_record()
         if edit_item: st.warning(f"🔧 修改中 ID: {st.session_state.editing_id}")
         r_type = st.radio("類型", ["支出", "收入"], index=0 if not edit_item or edit_item['type'] == "支出" else 1, horizontal=True)
+        cats = ['薪水', '獎金', '投資', '其他'] if r_type == '收入' else ['飲食', '交通', '購物', '醫療', '訂閱', '其他']
+        # 備註放在表單外：按 Enter 就列出常用備註，並依備註預先選好分類
+        r_note, predicted_idx = ledger_suggest.render_note_input(app.notes, r_type, cats, value=edit_item['note'] if edit_item else "", label="備註")
         with st.form("entry_form", clear_on_submit=(not st.session_state.editing_id)):
             c1, c2 = st.columns(2)
             default_date = date.today()
@@ -152,12 +181,11 @@ else:
             with c1: r_date = st.date_input("日期", default_date)
             with c2:
                 r_amount = st.number_input("金額", min_value=0.0, step=10.0, value=float(edit_item['amount']) if edit_item else 0.0)
-                cats = ['薪水', '獎金', '投資', '其他'] if r_type == '收入' else ['飲食', '交通', '購物', '醫療', '訂閱', '其他']
-                r_cat = st.selectbox("分類", cats, index=cats.index(edit_item['category']) if edit_item and edit_item['category'] in cats else 0)
-            r_note = st.text_input("備註", value=edit_item['note'] if edit_item else "")
+                r_cat = st.selectbox("分類", cats, index=cats.index(edit_item['category']) if edit_item and edit_item['category'] in cats else predicted_idx or 0)
             if st.form_submit_button("🚀 同步至 Google Sheets", use_container_width=True):
                 if r_amount > 0:
                     app.add_or_update(r_date, r_type, r_amount, r_cat, r_note, target_url)
+                    ledger_suggest.clear_note()
                     st.rerun()
 
     with tab2:
@@ -176,28 +204,40 @@ else:
                 if not df[df['type'] == '收入'].empty: st.plotly_chart(px.bar(df[df['type'] == '收入'].groupby('category')['amount'].sum().reset_index(), x='category', y='amount', title="收入來源", color='category'), use_container_width=True)
             with g2:
                 if not df[df['type'] == '支出'].empty: st.plotly_chart(px.pie(df[df['type'] == '支出'].groupby('category')['amount'].sum().reset_index(), values='amount', names='category', title="支出占比", hole=0.3), use_container_width=True)
+            st.divider()
+            ledger_stats.render_trends(app.stats(tw_today))
         else: st.info("☁️ 尚無資料，請先新增記帳")
 
     with tab3:
-        if not df.empty:
+        grid_mode = st.toggle("🧮 表格批次編輯", key="grid_mode", help="直接在表格修改、勾選多列批次改分類或刪除，按儲存時一次寫入")
+        if not df.empty and grid_mode:
+            change = ledger_bulk.render_editor(df, ['薪水', '獎金', '投資', '飲食', '交通', '購物', '醫療', '訂閱', '其他'])
+            if change: app.apply_batch(*change, target_url); st.rerun()
+        elif not df.empty:
             df['date_obj'] = pd.to_datetime(df['date'])
             df['month_str'] = df['date_obj'].dt.strftime('%Y-%m')
             unique_months = sorted(df['month_str'].unique(), reverse=True)
+            z_scores = app.stats(tw_today).flag(df)
             for m in unique_months:
-                month_df = df[df['month_str'] == m].sort_values(by='date', ascending=False)
+                month_df = df[df['month_str'] == m].sort_values(by=['date', 'id'], ascending=False)
                 m_in = month_df[month_df['type']=='收入']['amount'].sum()
                 m_ex = month_df[month_df['type']=='支出']['amount'].sum()
-                with st.expander(f"📅 {m} 月結算 (餘額: ${m_in - m_ex:,.0f})", expanded=True):
+                m_odd = sum(ledger_stats.is_anomaly(z_scores[i]) for i in month_df.index)
+                with st.expander(f"📅 {m} 月結算 (餘額: ${m_in - m_ex:,.0f})" + (f" ⚠️ {m_odd} 筆異常" if m_odd else ""), expanded=True):
                     st.caption(f"收入: ${m_in:,.0f} | 支出: ${m_ex:,.0f}")
-                    for _, row in month_df.iterrows():
+                    for i, row in month_df.iterrows():
+                        odd = ledger_stats.is_anomaly(z_scores[i])
                         col_date, col_info, col_amt, col_act = st.columns([2, 4, 2, 2])
                         with col_date: st.write(row['date'])
                         with col_info: st.write(f"{row['category']} - {row['note']}")
                         with col_amt: 
                             color = "green" if row['type'] == "收入" else "red"
-                            st.markdown(f":{color}[${row['amount']:,.0f}]")
+                            st.markdown(f":{color}[${row['amount']:,.0f}]" + (" ⚠️" if odd else ""), help=ledger_stats.anomaly_note(z_scores[i]) if odd else None)
                         with col_act:
                             c1, c2 = st.columns(2)
                             if c1.button("✏️", key=f"e_{row['id']}"): st.session_state.editing_id = row['id']; st.rerun()
-                            if c2.button("🗑️", key=f"d_{row['id']}"): st.session_state.records = [r for r in st.session_state.records if r['id'] != row['id']]; app.save_data(target_url); st.rerun()
+                            if c2.button("🗑️", key=f"d_{row['id']}"): app.delete(row['id'], target_url); st.rerun()
         else: st.info("☁️ 尚無歷史資料")
+
+# 這次執行的狀態變動寫回 session 後端 (有設定 LEDGER_SESSION_STORE 時)
+session_memory.persist()
@@ -1,15 +1,33 @@
 import streamlit as st
+import session_memory
 import pandas as pd
 import plotly.express as px
 from datetime import datetime, date, timedelta # ✅ 零件領取處
-import uuid
-from streamlit_gsheets import GSheetsConnection
+import time
+import threading
+import fake_gsheets
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from ledger_query import QUERY_HELP
+import ledger_rollup
+import ledger_dashboard
+import sheets_scheduler
+from sheets_scheduler import BACKGROUND
+import ledger_stats
+from ledger_ids import new_id
+import ledger_bulk
+import ledger_engine
+import ledger_suggest
+import ledger_budget
+import ledger_recurring
 
 # ==========================================
 # 1. 網頁初始設定
 # ==========================================
 st.set_page_config(page_title="雲端理財旗艦版", page_icon="💰", layout="wide")
 
+# 閒置太久的 session 會被暫存到磁碟，這裡負責登記活動並自動還原
+session_memory.touch()
+
 # CSS：維持大標題與無邊框樣式
 st.markdown("""
     <style>
@@ -23,50 +41,215 @@ st.markdown("""
 # ==========================================
 # 2. 核心邏輯控制器
 # ==========================================
-class CloudAccounting:
+# 分析頁只讀這張預先彙總的工作表 (月份 × 類型 × 分類)，明細 Sheet1 延遲載入
+SUMMARY_SHEET = "Summary"
+# 分類預算與歷史：每列是「某分類從某月份起的每月預算」
+BUDGET_SHEET = "Budgets"
+# 固定收支規則 (一條規則一列，單期調整以 JSON 存在同一列)
+RECURRING_SHEET = "Recurring"
+
+# Sheet1 是最近一次的快照；之後的每筆異動只追加一列到 Journal 工作表
+# (讀寫工作表、操作日誌與各種索引都在 ledger_engine.SheetsLedgerSession，與 app4 共用)
+class CloudAccounting(ledger_engine.SheetsLedgerSession):
     def __init__(self):
+        conn = None
         try:
-            self.conn = st.connection("gsheets", type=GSheetsConnection)
+            conn = st.connection("gsheets", type=fake_gsheets.connection_type())
             self.is_connected = True
         except Exception as e:
             st.error(f"⚠️ 連線失敗：{e}")
             self.is_connected = False
-        if 'records' not in st.session_state: st.session_state.records = []
-        if 'editing_id' not in st.session_state: st.session_state.editing_id = None
+        if 'records_loaded' not in st.session_state: st.session_state.records_loaded = False
+        if 'rollup' not in st.session_state: st.session_state.rollup = None
+        super().__init__(st.session_state, conn)
 
     def load_data(self, sheet_url=None):
+        """讀取快照 (Sheet1) 並重播 Journal 尾端事件"""
         if not self.is_connected or not sheet_url: return []
         try:
-            df = self.conn.read(spreadsheet=sheet_url, worksheet="Sheet1", ttl=0)
-            if df is not None and not df.empty:
-                df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
-                df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
-                st.session_state.records = df.to_dict('records')
-                return st.session_state.records
+            migrated = self.load_journal(sheet_url)
+            st.session_state.records_loaded = True
+            if migrated:
+                # 舊版 8 碼字串 ID (或重複 ID) 已換成整數 ID：立刻寫回一份完整快照
+                self.save_data(sheet_url)
+                st.toast(f"🔢 已將 {migrated} 筆舊版 ID 轉換為新格式")
+            return st.session_state.records
         except: pass
         return []
 
-    def save_data(self, sheet_url=None):
+    def fetch_household(self, members):
+        """全家總覽：平行讀取多本帳本 ({成員: 網址})，回傳各本結果與總耗時"""
+        ctx = get_script_run_ctx()
+        t0 = time.perf_counter()
+        results = ledger_dashboard.fetch_all(
+            members, lambda url: self._fetch(url).replay(),
+            # 背景執行緒也掛上目前的 script context，st.connection 的快取才不會跳警告
+            initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx))
+        st.session_state.household = {'results': results, 'seconds': time.perf_counter() - t0,
+                                       'loaded_at': datetime.now().strftime('%H:%M:%S')}
+        return st.session_state.household
+
+    def ensure_records(self, sheet_url=None):
+        """明細延遲載入：只有歷史頁、搜尋或寫入時才讀取 Sheet1"""
+        if not st.session_state.records_loaded:
+            self.load_data(sheet_url)
+        return st.session_state.records
+
+    def load_summary(self, sheet_url=None):
+        """讀取彙總表；不存在或格式不符時從明細重建一次"""
+        if not self.is_connected or not sheet_url: return None
+        try:
+            df = self._read(sheet_url, SUMMARY_SHEET)
+            st.session_state.rollup = ledger_rollup.from_frame(df)
+        except Exception:
+            self.rebuild_summary(sheet_url)
+        return st.session_state.rollup
+
+    def rebuild_summary(self, sheet_url=None):
+        """依完整明細重算彙總並寫回 Summary 工作表"""
+        if not self.is_connected or not sheet_url: return None
+        st.session_state.records_loaded = False
+        self.ensure_records(sheet_url)
+        st.session_state.rollup = ledger_rollup.build_rollup(st.session_state.records)
+        if st.session_state.records_loaded:
+            try:
+                self._write_summary(sheet_url)
+            except Exception as e:
+                st.warning(f"⚠️ 彙總表寫入失敗：{e}")
+        return st.session_state.rollup
+
+    def refresh(self):
+        """清掉本地快取，下次執行時重新讀取彙總 (明細仍等需要時才讀)"""
+        st.session_state.rollup = None
+        st.session_state.records_loaded = False
+
+    def _write_sheet(self, sheet_url, worksheet, df, priority=sheets_scheduler.INTERACTIVE):
+        """整張工作表覆寫；第一次使用 (試算表裡還沒有這張工作表) 時先建立再寫入"""
+        try:
+            self._update(sheet_url, worksheet, df, priority)
+        except Exception as e:
+            if type(e).__name__ != 'WorksheetNotFound': raise
+            spreadsheet = self._spreadsheet(sheet_url)
+            sheets_scheduler.write(sheet_url, lambda: spreadsheet.add_worksheet(
+                title=worksheet, rows=len(df) + 1, cols=len(df.columns)), priority, repeatable=False)
+            self._update(sheet_url, worksheet, df, priority)
+
+    def _write_summary(self, sheet_url):
+        # 彙總表可由明細重建，排在使用者的寫入之後
+        self._write_sheet(sheet_url, SUMMARY_SHEET, ledger_rollup.to_frame(st.session_state.rollup or {}), BACKGROUND)
+
+    def _sync_summary(self, sheet_url):
+        """明細寫入成功後更新彙總表；彙總表失敗不算存檔失敗 (可用「依明細重建彙總表」補上)"""
+        try:
+            self._write_summary(sheet_url)
+        except Exception as e:
+            st.warning(f"⚠️ 明細已同步，但彙總表更新失敗：{e}")
+
+    def load_budgets(self, sheet_url=None):
+        """讀取分類預算 (每本帳本讀一次)；還沒有 Budgets 工作表時以舊的單一每月預算作為總預算"""
+        if st.session_state.get('budgets_url') == sheet_url and 'budgets' in st.session_state:
+            return st.session_state.budgets
+        budgets = []
+        if self.is_connected and sheet_url:
+            try:
+                budgets = ledger_budget.budget_frame(self._read(sheet_url, BUDGET_SHEET).to_dict('records')).to_dict('records')
+            except Exception:
+                budgets = []
+        st.session_state.budgets = budgets or ledger_budget.default_budgets(st.session_state.budget)
+        st.session_state.budgets_url = sheet_url
+        return st.session_state.budgets
+
+    def load_rules(self, sheet_url=None):
+        """讀取固定收支規則 (每本帳本讀一次)"""
+        if st.session_state.get('recurring_url') == sheet_url and 'recurring' in st.session_state:
+            return st.session_state.recurring
+        rules = []
+        if self.is_connected and sheet_url:
+            try:
+                rules = ledger_recurring.rules_from_frame(self._read(sheet_url, RECURRING_SHEET))
+            except Exception:
+                rules = []
+        st.session_state.recurring = rules
+        st.session_state.recurring_url = sheet_url
+        return rules
+
+    def save_rules(self, rules, sheet_url=None):
+        """規則整張覆寫：大小只跟規則數量有關，與展開了幾期無關"""
+        st.session_state.recurring = rules
+        if not self.is_connected or not sheet_url: return False
+        try:
+            self._write_sheet(sheet_url, RECURRING_SHEET, ledger_recurring.rules_to_frame(rules))
+            st.toast("✅ 固定收支已更新", icon="🔁")
+            return True
+        except Exception as e:
+            st.error(f"❌ 固定收支儲存失敗：{e}")
+            return False
+
+    def save_budgets(self, budgets, sheet_url=None):
+        st.session_state.budgets = budgets
         if not self.is_connected or not sheet_url: return False
         try:
-            df = pd.DataFrame(st.session_state.records) if st.session_state.records else pd.DataFrame(columns=['id', 'date', 'type', 'amount', 'category', 'note'])
-            self.conn.update(spreadsheet=sheet_url, worksheet="Sheet1", data=df)
-            st.toast("✅ 雲端同步成功！")
+            self._write_sheet(sheet_url, BUDGET_SHEET, ledger_budget.budget_frame(budgets))
+            st.toast("✅ 預算已儲存", icon="🎯")
             return True
+        except Exception as e:
+            st.error(f"❌ 預算儲存失敗：{e}")
+            return False
+
+    def save_data(self, sheet_url=None):
+        """完整快照：整份寫回 Sheet1、清空 Journal (壓縮)，並更新彙總表"""
+        if not self.is_connected or not sheet_url: return False
+        if not st.session_state.records_loaded:
+            # 明細讀取失敗時不寫入，避免用不完整的資料覆蓋雲端
+            st.error("❌ 尚未成功讀取雲端明細，為避免覆蓋資料已暫停寫入")
+            return False
+        try:
+            self._write_snapshot(sheet_url)
+        except Exception as e:
+            st.error(f"❌ 寫入失敗：{e}")
+            return False
+        self._sync_summary(sheet_url)
+        st.toast("✅ 雲端同步成功！")
+        return True
+
+    def _persist(self, events, sheet_url=None):
+        """平常只追加這次的事件並更新彙總；累積夠多時才改做完整快照"""
+        events = [e for e in events if e is not None]
+        if not events or not self.is_connected or not sheet_url: return False
+        if self.journal().needs_snapshot():
+            return self.save_data(sheet_url)
+        try:
+            self._append_events(sheet_url, events)
         except Exception as e:
             st.error(f"❌ 寫入失敗：{e}")
             return False
+        self._sync_summary(sheet_url)
+        st.toast("✅ 雲端同步成功！")
+        return True
+
+    def _rollup(self):
+        if st.session_state.rollup is None:
+            st.session_state.rollup = ledger_rollup.build_rollup(st.session_state.records)
+        return st.session_state.rollup
 
+    def _on_applied(self, event):
+        # 彙總表依前後內容增量更新 (搜尋索引、滾動統計與備註索引由 LedgerSession 處理)
+        ledger_rollup.apply_change(self._rollup(), event['before'], event['after'])
+
+    # --- 寫入前先確定明細已載入 ---
     def add_or_update(self, r_date, r_type, amount, category, note, sheet_url=None):
-        if st.session_state.editing_id:
-            for r in st.session_state.records:
-                if r['id'] == st.session_state.editing_id:
-                    r.update({'date': r_date.strftime('%Y-%m-%d'), 'type': r_type, 'amount': amount, 'category': category, 'note': note})
-                    break
-            st.session_state.editing_id = None
-        else:
-            st.session_state.records.append({'id': str(uuid.uuid4())[:8], 'date': r_date.strftime('%Y-%m-%d'), 'type': r_type, 'amount': amount, 'category': category, 'note': note})
-        self.save_data(sheet_url)
+        self.ensure_records(sheet_url)
+        return super().add_or_update(r_date, r_type, amount, category, note, sheet_url)
+
+    def delete(self, record_id, sheet_url=None):
+        self.ensure_records(sheet_url)
+        return super().delete(record_id, sheet_url)
+
+    def notes(self, sheet_url=None):
+        """備註自動完成索引：開始輸入備註時才載入明細並建立"""
+        if 'note_index' not in st.session_state:
+            self.ensure_records(sheet_url)
+        return super().notes()
 
 if 'app' not in st.session_state: st.session_state.app = CloudAccounting()
 app = st.session_state.app
@@ -85,6 +268,7 @@ FRIENDS_DB = {
 }
 
 target_url = None
+household_mode = False
 with st.sidebar:
     st.header("🔐 系統登入")
     if auto_url:
@@ -96,16 +280,28 @@ with st.sidebar:
             user_pin = st.text_input("通行碼", type="password")
             if user_pin == FRIENDS_DB[user_choice]["pin"]:
                 target_url = f"https://docs.google.com/spreadsheets/d/{FRIENDS_DB[user_choice]['id']}/edit"
+                if user_choice == "管理員 (本人)":
+                    household_mode = st.toggle("👨‍👩‍👧 全家總覽", help="同時讀取 FRIENDS_DB 裡所有成員的帳本並合併統計")
+    # 外部 session 後端的代號綁定這個帳本：拿到別人的 ?sid= 也接不回對方的資料
+    if target_url and session_memory.claim(target_url): st.rerun()
     
     st.divider()
-    if st.button("🔄 刷新雲端資料"): app.load_data(target_url); st.rerun()
+    if st.button("🔄 刷新雲端資料"): app.refresh(); st.rerun()
+
+    # 多步復原 / 重做 (反向操作同樣以事件追加到 Journal)
+    u1, u2 = st.columns(2)
+    if u1.button("↩️ 復原", disabled=not target_url or not app.can_undo(), use_container_width=True):
+        app.undo(target_url); st.rerun()
+    if u2.button("↪️ 重做", disabled=not target_url or not app.can_redo(), use_container_width=True):
+        app.redo(target_url); st.rerun()
     
     # --- 搜尋功能回歸 ---
-    search_query = st.text_input("🔍 搜尋歷史紀錄", placeholder="搜尋分類、金額或備註")
+    search_query = st.text_input("🔍 搜尋歷史紀錄", placeholder="例如：飲食 amount>500 2026-01..2026-03 type:支出", help=QUERY_HELP)
     
-    if st.session_state.records:
-        csv = pd.DataFrame(st.session_state.records).to_csv(index=False).encode('utf-8-sig')
-        st.download_button("📥 下載 CSV 備份", data=csv, file_name=f"finance_{date.today()}.csv")
+    if target_url and st.session_state.records:
+        st.download_button("📥 下載 CSV 備份", data=ledger_engine.export_csv(st.session_state.records), file_name=f"finance_{date.today()}.csv")
+
+session_memory.render_panel()
 
 # ==========================================
 # 4. 主介面顯示 (優化部分)
@@ -114,16 +310,63 @@ with st.sidebar:
 # 在 target_url 判斷後，先初始化預算
 if 'budget' not in st.session_state:
     st.session_state.budget = 30000.0
-if target_url:
-    if not st.session_state.records: app.load_data(target_url)
-    df = pd.DataFrame(st.session_state.records)
-    
-    # --- 關鍵字過濾邏輯 ---
-    if not df.empty and search_query:
-        df = df[df.astype(str).apply(lambda x: x.str.contains(search_query, case=False)).any(axis=1)]
+if household_mode:
+    st.title("👨‍👩‍👧 全家收支總覽")
+    members = {name: f"https://docs.google.com/spreadsheets/d/{info['id']}/edit" for name, info in FRIENDS_DB.items()}
+    if st.button("🔄 重新讀取全部帳本") or 'household' not in st.session_state:
+        with st.spinner(f"同時讀取 {len(members)} 本帳本中..."):
+            app.fetch_household(members)
+    household = st.session_state.household
+    results = household['results']
+    hdf = ledger_dashboard.merge(results)
+    slowest = max((r['seconds'] for r in results.values()), default=0)
+    st.caption(f"⏱️ 總耗時 {household['seconds']:.2f} 秒 (最慢單本 {slowest:.2f} 秒) | 讀取時間：{household['loaded_at']}")
+
+    failed = [name for name, r in results.items() if r['status'] != 'ok']
+    if failed: st.warning(f"⚠️ 以下帳本未能讀取，總覽只包含其餘成員：{'、'.join(failed)}")
+    with st.expander("📡 各帳本讀取狀態", expanded=bool(failed)):
+        st.dataframe(ledger_dashboard.status_frame(results), hide_index=True, use_container_width=True)
+
+    if not hdf.empty:
+        inc = hdf[hdf['type'] == '收入']['amount'].sum()
+        exp = hdf[hdf['type'] == '支出']['amount'].sum()
+        m1, m2, m3 = st.columns(3)
+        m1.metric("全家總收入", f"${inc:,.0f}")
+        m2.metric("全家總支出", f"${exp:,.0f}")
+        m3.metric("全家淨餘額", f"${inc - exp:,.0f}")
+
+        st.subheader("👥 成員收支比較")
+        by_member = hdf.groupby(['member', 'type'])['amount'].sum().reset_index()
+        st.plotly_chart(px.bar(by_member, x='member', y='amount', color='type', barmode='group',
+                               color_discrete_map={'收入': '#00CC96', '支出': '#EF553B'}), use_container_width=True)
+
+        c1, c2 = st.columns(2)
+        with c1:
+            st.subheader("📈 每月支出 (依成員)")
+            monthly = hdf[hdf['type'] == '支出'].groupby(['month_key', 'member'])['amount'].sum().reset_index()
+            st.plotly_chart(px.bar(monthly, x='month_key', y='amount', color='member'), use_container_width=True)
+        with c2:
+            st.subheader("🍕 全家支出分類")
+            cats = hdf[hdf['type'] == '支出'].groupby('category')['amount'].sum().reset_index()
+            st.plotly_chart(px.pie(cats, values='amount', names='category', hole=0.4), use_container_width=True)
+
+        st.subheader("📋 成員 × 分類 支出明細")
+        pivot = hdf[hdf['type'] == '支出'].pivot_table(index='category', columns='member', values='amount', aggfunc='sum', fill_value=0)
+        st.dataframe(pivot.style.format("{:,.0f}"), use_container_width=True)
+    else:
+        st.info("目前沒有任何成員的帳本可以顯示。")
+elif target_url:
+    # 分析只需要彙總表；明細等到歷史頁或搜尋時才載入
+    if st.session_state.rollup is None: app.load_summary(target_url)
+    rollup = st.session_state.rollup or {}
     st.title("💰 雲端理財記帳本")
     tw_now = datetime.now() + timedelta(hours=8)
     curr_hour = tw_now.hour
+    # 固定收支的各期只在分析時展開 (分析頁看得到的期間)，不寫進明細或 Summary
+    if 'recurring_cache' not in st.session_state: st.session_state.recurring_cache = {}
+    window_start, window_end = ledger_recurring.visible_window(rollup, tw_now.date())
+    rollup = ledger_recurring.with_rollup(rollup, app.load_rules(target_url), end=window_end, start=window_start,
+                                          cache=st.session_state.recurring_cache)
 
     if 5 <= curr_hour < 12:
         msg = "🌅 早上好！今日又是數據力爆棚的一天。"
@@ -136,19 +379,17 @@ if target_url:
     st.caption(f"🚀 穩定版 v2.8 | 系統時間：{tw_now.strftime('%H:%M')} | 隱私保護架構")
     st.divider()
     
-    tab1, tab2, tab3 = st.tabs(["➕ 快速記帳", "📈 數據分析", "📋 歷史明細"])
+    # 切換分頁時重新執行，才能知道「歷史明細」是否被打開 (.open)
+    tab1, tab2, tab3 = st.tabs(["➕ 快速記帳", "📈 數據分析", "📋 歷史明細"], key="main_tabs", on_change="rerun")
 
-    # --- Tab 2: 數據分析 (維持 3.1 旗艦版配置) ---
+    # --- Tab 2: 數據分析 (只讀 Summary 彙總表) ---
     with tab2:
-        if not df.empty:
-            df['date_obj'] = pd.to_datetime(df['date'])
-            df = df.sort_values('date_obj')
+        if rollup:
             now = datetime.now()
             
             st.markdown(f"# 🏆 {now.year} 年度全局報告")
-            year_df = df[df['date_obj'].dt.year == now.year]
-            y_in = year_df[year_df['type'] == '收入']['amount'].sum()
-            y_ex = year_df[year_df['type'] == '支出']['amount'].sum()
+            y_in = ledger_rollup.total(rollup, '收入', year=now.year)
+            y_ex = ledger_rollup.total(rollup, '支出', year=now.year)
             
             st.markdown('<div class="report-box">', unsafe_allow_html=True)
             y1, y2, y3 = st.columns(3)
@@ -157,36 +398,20 @@ if target_url:
             y3.metric("年度總結餘", f"${y_in - y_ex:,.0f}")
             st.markdown('</div>', unsafe_allow_html=True)
 
-            st.subheader("🎯 當月預算執行進度")
-            curr_month_str = now.strftime('%Y-%m')
-            this_month_ex = df[(df['date_obj'].dt.strftime('%Y-%m') == curr_month_str) & (df['type'] == '支出')]['amount'].sum()
-            
-            # 💡 修復重點：使用 key 來維持狀態，並用 on_change 確保數值正確存入 session_state
-            if 'budget_input' not in st.session_state:
-                st.session_state.budget_input = st.session_state.budget
-
-            st.number_input(
-                "設定每月預算上限：", 
-                min_value=1000.0, 
-                step=1000.0, 
-                key="budget_input"
-            )
-            # 將輸入值同步到全域預算變數
-            st.session_state.budget = st.session_state.budget_input
-            
-            progress = min(this_month_ex / st.session_state.budget, 1.0)
-            st.progress(progress)
-            st.write(f"本月已花費: **${this_month_ex:,.0f}** / 預算: **${st.session_state.budget:,.0f}** ({progress*100:.1f}%)")
+            # 分類預算：直接用彙總表向量化評估所有月份，不必讀明細
+            actuals = ledger_budget.actuals_from_rollup(ledger_rollup.to_frame(rollup))
+            categories = sorted({c for _, t, c in rollup if t == '支出'} | {'飲食', '交通', '購物', '醫療', '訂閱', '其他'})
+            saved = ledger_budget.render_budget(actuals, app.load_budgets(target_url), categories, today=tw_now.date())
+            if saved is not None:
+                app.save_budgets(saved, target_url); st.rerun()
 
             st.divider()
             st.markdown("## 📊 月份細節查詢")
-            df['month_key'] = df['date_obj'].dt.strftime('%Y-%m')
-            month_list = sorted(df['month_key'].unique(), reverse=True)
+            month_list = ledger_rollup.months(rollup)
             selected_month = st.selectbox("切換查看月份：", month_list, index=0)
             
-            m_df = df[df['month_key'] == selected_month]
-            m_in = m_df[m_df['type'] == '收入']['amount'].sum()
-            m_ex = m_df[m_df['type'] == '支出']['amount'].sum()
+            m_in = ledger_rollup.total(rollup, '收入', month=selected_month)
+            m_ex = ledger_rollup.total(rollup, '支出', month=selected_month)
 
             m1, m2, m3 = st.columns(3)
             m1.metric("該月收入", f"${m_in:,.0f}")
@@ -196,25 +421,43 @@ if target_url:
             st.divider()
             g1, g2 = st.columns(2)
             with g1:
-                m_exp_df = m_df[m_df['type'] == '支出']
-                if not m_exp_df.empty:
-                    st.plotly_chart(px.pie(m_exp_df.groupby('category')['amount'].sum().reset_index(), 
-                                           values='amount', names='category', title=f"{selected_month} 支出分布", hole=0.4), use_container_width=True)
+                m_exp_cat = ledger_rollup.by_category(rollup, '支出', month=selected_month)
+                if not m_exp_cat.empty:
+                    st.plotly_chart(px.pie(m_exp_cat, values='amount', names='category', title=f"{selected_month} 支出分布", hole=0.4), use_container_width=True)
                 else: st.info("該月尚無支出紀錄")
+            month_group = ledger_rollup.by_month_type(rollup)
             with g2:
-                month_group = df.groupby(['month_key', 'type'])['amount'].sum().reset_index()
                 st.plotly_chart(px.bar(month_group, x='month_key', y='amount', color='type', barmode='group', 
                                        title="歷史收支趨勢對比", color_discrete_map={'收入':'#2ca02c', '支出':'#d62728'}), use_container_width=True)
+
+            # 異常金額與滾動趨勢需要原始明細；明細延遲載入，尚未讀取時不強制讀
+            if st.session_state.records_loaded:
+                stats = app.stats(tw_now.date())
+                m_rows = pd.DataFrame([r for r in st.session_state.records if str(r.get('date', ''))[:7] == selected_month])
+                if not m_rows.empty:
+                    m_rows['z'] = stats.flag(m_rows)
+                    odd = m_rows[m_rows['z'].abs() >= ledger_stats.Z_THRESHOLD]
+                    if not odd.empty:
+                        st.warning(f"⚠️ {selected_month} 有 {len(odd)} 筆金額明顯偏離該分類平常水準")
+                        st.dataframe(odd[['date', 'type', 'category', 'amount', 'note', 'z']].sort_values('date')
+                                     .rename(columns={'z': '偏離 (標準差)'}).round({'偏離 (標準差)': 1}),
+                                     hide_index=True, use_container_width=True)
+                ledger_stats.render_trends(stats)
+            else:
+                st.caption("💡 打開「📋 歷史明細」載入明細後，這裡會顯示近 7 / 30 / 90 天趨勢與異常金額。")
             
             st.subheader("📈 資產成長曲線 (累計結餘)")
-            df['net_val'] = df.apply(lambda x: x['amount'] if x['type'] == '收入' else -x['amount'], axis=1)
-            df['cumulative'] = df['net_val'].cumsum()
-            st.plotly_chart(px.line(df, x='date_obj', y='cumulative', markers=True, title="總資產變化歷程"), use_container_width=True)
+            net = month_group.assign(net_val=month_group['amount'].where(month_group['type'] == '收入', -month_group['amount']))
+            net = net.groupby('month_key')['net_val'].sum().cumsum().reset_index(name='cumulative')
+            st.plotly_chart(px.line(net, x='month_key', y='cumulative', markers=True, title="總資產變化歷程 (月結)"), use_container_width=True)
+
+        if st.button("🧮 依明細重建彙總表", help="Summary 工作表被手動修改或不一致時使用"):
+            app.rebuild_summary(target_url); st.rerun()
 
     # --- Tab 1: 記帳 & Tab 3: 明細 (保持穩定) ---
     # --- Tab 1: 記帳 (優化編輯內容保留 & 新增取消按鈕) ---
     with tab1:
-        edit_item = next((r for r in st.session_state.records if r['id'] == st.session_state.editing_id), None) if st.session_state.editing_id else None
+        edit_item = app.editing_record()
         
         if edit_item:
             st.warning(f"📝 正在編輯紀錄 ID: {st.session_state.editing_id}")
@@ -222,6 +465,11 @@ if target_url:
         # 判定類型
         r_type_idx = 0 if not edit_item or edit_item['type'] == "支出" else 1
         r_type = st.radio("收支類型", ["支出", "收入"], index=r_type_idx, horizontal=True)
+        cats = ['薪水', '獎金', '投資', '發票', '洗衣店', '其他'] if r_type == '收入' else ['飲食', '交通', '購物', '醫療', '訂閱', '瓦斯', '其他']
+
+        # 備註放在表單外：按 Enter 就列出常用備註，並依備註預先選好分類 (這時才載入明細)
+        r_note, predicted_idx = ledger_suggest.render_note_input(
+            lambda: app.notes(target_url), r_type, cats, value=edit_item['note'] if edit_item else "", label="詳細備註")
         
         with st.form("entry_form", clear_on_submit=True):
             c1, c2 = st.columns(2)
@@ -232,45 +480,73 @@ if target_url:
             with c2:
                 r_amount = st.number_input("金額", min_value=0.0, value=float(edit_item['amount']) if edit_item else 0.0)
                 
-                # 2. 分類優化：編輯時自動帶入原分類
-                cats = ['薪水', '獎金', '投資', '發票', '洗衣店', '其他'] if r_type == '收入' else ['飲食', '交通', '購物', '醫療', '訂閱', '瓦斯', '其他']
+                # 2. 分類優化：編輯時自動帶入原分類，新增時依備註預測
                 try:
-                    cat_idx = cats.index(edit_item['category']) if edit_item and edit_item['category'] in cats else 0
+                    cat_idx = cats.index(edit_item['category']) if edit_item and edit_item['category'] in cats else predicted_idx or 0
                 except ValueError:
                     cat_idx = 0
                 r_cat = st.selectbox("分類", cats, index=cat_idx)
             
-            r_note = st.text_input("詳細備註", value=edit_item['note'] if edit_item else "")
-            
             # 3. 按鈕優化：同步與取消
             btn_col1, btn_col2 = st.columns(2)
             if btn_col1.form_submit_button("🚀 同步至雲端", use_container_width=True):
                 if r_amount > 0:
                     app.add_or_update(r_date, r_type, r_amount, r_cat, r_note, target_url)
+                    ledger_suggest.clear_note()
                     st.rerun()
             
             if edit_item:
                 if btn_col2.form_submit_button("❌ 取消編輯", use_container_width=True):
-                    st.session_state.editing_id = None
+                    app.cancel_edit()
                     st.rerun()
 
+        # 訂閱、薪水、瓦斯這類每期都一樣的收支：只存規則，分析時自動計入
+        with st.expander("🔁 固定收支 (每期自動計入分析)"):
+            rules = ledger_recurring.render_rules(
+                app.load_rules(target_url), new_id=new_id, today=tw_now.date(),
+                categories={'收入': ['薪水', '獎金', '投資', '發票', '洗衣店', '其他'],
+                            '支出': ['訂閱', '瓦斯', '飲食', '交通', '購物', '醫療', '其他']})
+            if rules is not None:
+                app.save_rules(rules, target_url); st.rerun()
+
     with tab3:
-        if not df.empty:
+        # 只有打開這個分頁才讀取原始明細 (舊版 Streamlit 沒有 .open 時維持一律載入)
+        if tab3.open is not False:
+            app.ensure_records(target_url)
+        df = pd.DataFrame(st.session_state.records) if tab3.open is not False else pd.DataFrame()
+
+        # --- 關鍵字過濾邏輯 ---
+        if not df.empty and search_query:
+            t0 = time.perf_counter()
+            df = df.iloc[app.search(search_query)]
+            st.sidebar.caption(f"🔎 找到 {len(df):,} 筆 ({(time.perf_counter() - t0) * 1000:.1f} ms)")
+        grid_mode = st.toggle("🧮 表格批次編輯", key="grid_mode", help="直接在表格修改、勾選多列批次改分類或刪除，按儲存時一次寫入")
+        if not df.empty and grid_mode:
+            change = ledger_bulk.render_editor(df, ['薪水', '獎金', '投資', '發票', '洗衣店', '飲食', '交通', '購物', '醫療', '訂閱', '瓦斯', '其他'])
+            if change: app.apply_batch(*change, target_url); st.rerun()
+        elif not df.empty:
+            df['month_key'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m')
+            z_scores = app.stats(tw_now.date()).flag(df)
             for m in sorted(df['month_key'].unique(), reverse=True):
-                with st.expander(f"📅 {m} 月份詳細清單"):
-                    m_data = df[df['month_key'] == m].sort_values(by='date', ascending=False)
-                    for _, row in m_data.iterrows():
+                m_data = df[df['month_key'] == m].sort_values(by=['date', 'id'], ascending=False)
+                m_odd = sum(ledger_stats.is_anomaly(z_scores[i]) for i in m_data.index)
+                with st.expander(f"📅 {m} 月份詳細清單" + (f" ⚠️ {m_odd} 筆異常" if m_odd else "")):
+                    for i, row in m_data.iterrows():
+                        odd = ledger_stats.is_anomaly(z_scores[i])
                         col1, col2, col3, col4 = st.columns([2, 5, 3, 2])
                         col1.write(f"{row['date'][5:]}")
                         col2.write(f"**{row['category']}** | {row['note']}")
                         color = "green" if row['type'] == "收入" else "red"
-                        col3.markdown(f"**:{color}[${row['amount']:,.0f}]**")
+                        col3.markdown(f"**:{color}[${row['amount']:,.0f}]**" + (" ⚠️" if odd else ""), help=ledger_stats.anomaly_note(z_scores[i]) if odd else None)
                         b1, b2 = col4.columns(2)
                         if b1.button("✏️", key=f"e_{row['id']}"): st.session_state.editing_id = row['id']; st.rerun()
                         if b2.button("🗑️", key=f"d_{row['id']}"): 
-                            st.session_state.records = [r for r in st.session_state.records if r['id'] != row['id']]
-                            app.save_data(target_url); st.rerun()
+                            app.delete(row['id'], target_url); st.rerun()
+        elif not st.session_state.records_loaded: st.warning("⚠️ 明細尚未成功載入，請點擊左側「刷新雲端資料」重試。")
         else: st.info("尚無資料，或搜尋無匹配結果。")
 else:
     st.title("💰 歡迎使用雲端理財系統")
     st.warning("👈 請在左側選單登入")
+
+# 這次執行的狀態變動寫回 session 後端 (有設定 LEDGER_SESSION_STORE 時)
+session_memory.persist()
@@ -0,0 +1,408 @@
+"""本機假的 Google Sheets (不需要 Google 帳號與網路)
+
+app4 / app5 設定 LEDGER_FAKE_SHEETS 後，st.connection("gsheets") 會換成這裡的
+FakeSheetsConnection，介面與 streamlit_gsheets 相同 (read / update)，另有公開的 open_spreadsheet：
+    LEDGER_FAKE_SHEETS=memory          工作表存在記憶體 (整個行程共用)
+    LEDGER_FAKE_SHEETS=fake_sheets/    每張工作表存成 資料夾/<試算表 ID>/<工作表>.csv
+
+模擬真實服務的行為，方便離線、可重現地測試同步、快取與並行：
+    LEDGER_FAKE_SHEETS_LATENCY=lognormal:300:0.5   每次請求的延遲 (fixed:ms / uniform:lo:hi / lognormal:中位數ms:sigma)
+    LEDGER_FAKE_SHEETS_QUOTA=reads=60,writes=60    每分鐘配額，超過回 429 (與 Google 相同，不排隊)
+    LEDGER_FAKE_SHEETS_FAILURES=500:0.02,timeout:0.01   隨機失敗的機率
+    LEDGER_FAKE_SHEETS_SEED=42                     固定亂數種子
+
+直接執行是一個小型壓力測試，經由 sheets_scheduler 對假服務發出讀寫：
+    python fake_gsheets.py --sessions 8 --ops 40 --latency lognormal:200:0.4 --failures 503:0.05
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+FAKE_SHEETS = os.environ.get("LEDGER_FAKE_SHEETS", "")
+LATENCY = os.environ.get("LEDGER_FAKE_SHEETS_LATENCY", "none")
+WRITE_LATENCY = os.environ.get("LEDGER_FAKE_SHEETS_WRITE_LATENCY", "")
+QUOTA = os.environ.get("LEDGER_FAKE_SHEETS_QUOTA", "reads=60,writes=60")
+FAILURES = os.environ.get("LEDGER_FAKE_SHEETS_FAILURES", "")
+SEED = os.environ.get("LEDGER_FAKE_SHEETS_SEED", "")
+
+DEFAULT_SHEET = "Sheet1"
+QUOTA_WINDOW = 60.0
+# 請求紀錄只留最近這麼多筆 (假服務跟著 app 的行程一直活著，不能無限累積)
+LOG_LIMIT = 1000
+
+
+# ==========================================
+# 與 gspread 同名的錯誤 (app 以類別名稱判斷)
+# ==========================================
+class WorksheetNotFound(Exception):
+    pass
+
+
+class APIError(Exception):
+    """模擬 gspread.exceptions.APIError：帶 response.status_code，sheets_scheduler 據此判斷是否重試"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.response = type('Response', (), {'status_code': code})()
+
+
+# ==========================================
+# 設定解析
+# ==========================================
+def parse_latency(spec):
+    """'fixed:200' / 'uniform:100:400' / 'lognormal:300:0.5' / 'none' → 函式(rng) → 秒"""
+    if not spec or spec == 'none':
+        return lambda rng: 0.0
+    kind, *args = spec.split(':')
+    args = [float(a) for a in args]
+    if kind == 'fixed':
+        return lambda rng: args[0] / 1000
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(args[0], args[1]) / 1000
+    if kind == 'lognormal':
+        # 參數是中位數，真實 API 的延遲大多是右偏的長尾
+        import math
+        mu = math.log(args[0] / 1000)
+        sigma = args[1] if len(args) > 1 else 0.5
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"不支援的延遲分布：{spec}")
+
+
+def parse_pairs(spec, value=float):
+    """'reads=60,writes=60' / '500:0.02,timeout:0.01' → dict"""
+    pairs = {}
+    for item in filter(None, (s.strip() for s in (spec or '').split(','))):
+        key, _, number = item.replace('=', ':').partition(':')
+        pairs[key] = value(number)
+    return pairs
+
+
+def sheet_id(spreadsheet):
+    """試算表網址或 ID → ID"""
+    match = re.search(r"/d/([A-Za-z0-9_\-\.]+)", str(spreadsheet or ''))
+    return match.group(1) if match else str(spreadsheet or 'default')
+
+
+# ==========================================
+# 儲存
+# ==========================================
+class MemoryStore:
+    def __init__(self):
+        self._sheets = {}
+
+    def titles(self, sid):
+        return [t for s, t in self._sheets if s == sid]
+
+    def get(self, sid, title):
+        df = self._sheets.get((sid, title))
+        return None if df is None else df.copy()
+
+    def put(self, sid, title, df):
+        self._sheets[(sid, title)] = df.copy()
+
+
+class DirectoryStore:
+    """每張工作表一個 CSV，讀回來的型別與真的試算表一樣要重新判斷 (數字 / 空白)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, sid, title):
+        return os.path.join(self.path, sid, f"{title}.csv")
+
+    def titles(self, sid):
+        folder = os.path.join(self.path, sid)
+        return [f[:-4] for f in os.listdir(folder) if f.endswith('.csv')] if os.path.isdir(folder) else []
+
+    def get(self, sid, title):
+        path = self._file(sid, title)
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_csv(path, encoding='utf-8')
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame()
+
+    def put(self, sid, title, df):
+        path = self._file(sid, title)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        df.to_csv(tmp, index=False, encoding='utf-8')
+        os.replace(tmp, path)
+
+
+# ==========================================
+# 假服務：延遲、配額、隨機失敗
+# ==========================================
+class FakeSheets:
+    def __init__(self, store=None, latency=None, write_latency=None, quota=None, failures=None, seed=None,
+                 sleep=time.sleep, clock=time.monotonic):
+        self.store = store or MemoryStore()
+        self.read_latency = parse_latency(latency) if isinstance(latency, (str, type(None))) else latency
+        self.write_latency = (parse_latency(write_latency) if isinstance(write_latency, str) and write_latency
+                              else write_latency or self.read_latency)
+        self.quota = parse_pairs(quota, int) if isinstance(quota, (str, type(None))) else dict(quota)
+        self.failures = parse_pairs(failures) if isinstance(failures, (str, type(None))) else dict(failures)
+        self.rng = random.Random(seed)
+        self._sleep = sleep
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._calls = {'reads': collections.deque(), 'writes': collections.deque()}
+        self.stats = collections.Counter()
+        self.log = collections.deque(maxlen=LOG_LIMIT)
+
+    # --- 每個請求都經過這裡 ---
+    def _admit(self, kind):
+        """配額與隨機失敗：回傳這次請求的延遲秒數，或丟出錯誤"""
+        with self._lock:
+            now = self._clock()
+            calls = self._calls[kind]
+            while calls and now - calls[0] >= QUOTA_WINDOW:
+                calls.popleft()
+            limit = self.quota.get(kind)
+            if limit and len(calls) >= limit:
+                self.stats['throttled'] += 1
+                raise APIError(429, "RESOURCE_EXHAUSTED: Quota exceeded for quota metric "
+                                    f"'{kind.capitalize()} requests' (fake)")
+            calls.append(now)
+            self.stats[kind] += 1
+            delay = (self.read_latency if kind == 'reads' else self.write_latency)(self.rng)
+            failure = None
+            roll = self.rng.random()
+            for name, p in self.failures.items():
+                if roll < p:
+                    failure = name
+                    break
+                roll -= p
+        return delay, failure
+
+    def _request(self, kind, label, fn):
+        delay, failure = self._admit(kind)
+        t0 = time.perf_counter()
+        self._sleep(delay)
+        if failure is not None:
+            self.stats['failed'] += 1
+            self.log.append((kind, label, delay, failure))
+            if failure == 'timeout':
+                raise TimeoutError(f"fake sheets: {label} timed out")
+            raise APIError(int(failure), "backendError (fake)")
+        with self._lock:
+            result = fn()
+        self.log.append((kind, label, time.perf_counter() - t0, 'ok'))
+        return result
+
+    def _sheet(self, sid, title):
+        df = self.store.get(sid, title)
+        if df is None:
+            if title == DEFAULT_SHEET and not self.store.titles(sid):
+                # 新的試算表本來就有一張空白的 Sheet1
+                df = pd.DataFrame()
+                self.store.put(sid, title, df)
+            else:
+                raise WorksheetNotFound(title)
+        return df
+
+    # --- GSheetsConnection 相同的介面 ---
+    def read(self, spreadsheet=None, worksheet=None, **kwargs):
+        sid, title = sheet_id(spreadsheet), worksheet or DEFAULT_SHEET
+        return self._request('reads', f"read {title}", lambda: self._sheet(sid, title))
+
+    def update(self, spreadsheet=None, worksheet=None, data=None, **kwargs):
+        sid, title = sheet_id(spreadsheet), worksheet or DEFAULT_SHEET
+
+        def _update():
+            self._sheet(sid, title)
+            df = data.copy() if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+            self.store.put(sid, title, df)
+            return df
+        return self._request('writes', f"update {title}", _update)
+
+    def open_spreadsheet(self, spreadsheet):
+        sid = sheet_id(spreadsheet)
+        return self._request('reads', "open", lambda: FakeSpreadsheet(self, sid))
+
+    def seed(self, spreadsheet, worksheet, df):
+        """測試 / 壓測用：不經過延遲與配額直接放入資料"""
+        self.store.put(sheet_id(spreadsheet), worksheet, pd.DataFrame(df))
+
+
+class FakeSpreadsheet:
+    """gspread.Spreadsheet 中 app 用到的部分"""
+
+    def __init__(self, server, sid):
+        self.server = server
+        self.id = sid
+
+    def worksheet(self, title):
+        def _get():
+            self.server._sheet(self.id, title)
+            return FakeWorksheet(self.server, self.id, title)
+        return self.server._request('reads', f"worksheet {title}", _get)
+
+    def add_worksheet(self, title, rows=1000, cols=26):
+        def _add():
+            if self.server.store.get(self.id, title) is None:
+                self.server.store.put(self.id, title, pd.DataFrame())
+            return FakeWorksheet(self.server, self.id, title)
+        return self.server._request('writes', f"add_worksheet {title}", _add)
+
+
+class FakeWorksheet:
+    """gspread.Worksheet 中 app 用到的部分：清空與追加列 (第一列是標題)"""
+
+    def __init__(self, server, sid, title):
+        self.server = server
+        self.sid = sid
+        self.title = title
+
+    def clear(self):
+        return self.server._request('writes', f"clear {self.title}",
+                                    lambda: self.server.store.put(self.sid, self.title, pd.DataFrame()))
+
+    def append_row(self, values, value_input_option='RAW'):
+        return self.append_rows([values], value_input_option)
+
+    def append_rows(self, values, value_input_option='RAW'):
+        def _append():
+            df = self.server._sheet(self.sid, self.title)
+            rows = [list(v) for v in values]
+            if len(df.columns) == 0:
+                df, rows = pd.DataFrame(columns=rows[0]), rows[1:]
+            if rows:
+                width = len(df.columns)
+                rows = [(r + [None] * width)[:width] for r in rows]
+                df = pd.concat([df, pd.DataFrame(rows, columns=df.columns)], ignore_index=True) if len(df) else \
+                    pd.DataFrame(rows, columns=df.columns)
+            self.server.store.put(self.sid, self.title, df)
+        return self.server._request('writes', f"append {self.title}", _append)
+
+
+# ==========================================
+# Streamlit 連線
+# ==========================================
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_server():
+    """依環境變數建立 (一個行程一個) 假服務，所有 session 共用同一份資料"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            store = MemoryStore() if FAKE_SHEETS in ('', 'memory') else DirectoryStore(FAKE_SHEETS)
+            _server = FakeSheets(store, LATENCY, WRITE_LATENCY, QUOTA, FAILURES, int(SEED) if SEED else None)
+        return _server
+
+
+def install(server):
+    """壓測 / 測試時換成自訂參數的假服務"""
+    global _server
+    with _server_lock:
+        _server = server
+    return server
+
+
+try:
+    from streamlit.connections import BaseConnection
+except ImportError:  # 只跑壓測時不一定有 streamlit
+    BaseConnection = object
+
+
+class FakeSheetsConnection(BaseConnection):
+    def _connect(self, **kwargs):
+        return get_server()
+
+    def read(self, spreadsheet=None, worksheet=None, ttl=None, **kwargs):
+        return self._instance.read(spreadsheet=spreadsheet, worksheet=worksheet)
+
+    def update(self, spreadsheet=None, worksheet=None, data=None, **kwargs):
+        return self._instance.update(spreadsheet=spreadsheet, worksheet=worksheet, data=data)
+
+    def open_spreadsheet(self, spreadsheet=None, **kwargs):
+        # 公開的入口 (真的連線只有內部的 client._open_spreadsheet，由 sheets_scheduler.open_spreadsheet 處理)
+        return self._instance.open_spreadsheet(spreadsheet)
+
+
+def connection_type():
+    """app 的 st.connection 類別：有設定 LEDGER_FAKE_SHEETS 就用假的 Google Sheets"""
+    if FAKE_SHEETS:
+        return FakeSheetsConnection
+    from streamlit_gsheets import GSheetsConnection
+    return GSheetsConnection
+
+
+# ==========================================
+# 壓力測試
+# ==========================================
+def bench(sessions=8, ops=40, write_ratio=0.2, sheets=2, latency='lognormal:200:0.4', quota='reads=60,writes=60',
+          failures='', seed=0, scheduler=None):
+    """多個 session 同時經由 sheets_scheduler 讀寫，回傳延遲與節流統計"""
+    import sheets_scheduler
+    server = FakeSheets(MemoryStore(), latency, None, quota, failures, seed)
+    scheduler = scheduler or sheets_scheduler.SheetsScheduler()
+    urls = [f"https://docs.google.com/spreadsheets/d/bench{i}/edit" for i in range(sheets)]
+    for url in urls:
+        server.seed(url, DEFAULT_SHEET, pd.DataFrame({'id': range(100), 'amount': 1.0}))
+        server.seed(url, 'Journal', pd.DataFrame(columns=['seq', 'op']))
+
+    def session(n):
+        rng = random.Random(seed * 1000 + n)
+        timings, errors = [], 0
+        for i in range(ops):
+            url = urls[rng.randrange(len(urls))]
+            t0 = time.perf_counter()
+            try:
+                if rng.random() < write_ratio:
+                    ws = FakeWorksheet(server, sheet_id(url), 'Journal')
+                    scheduler.write(url, lambda: ws.append_row([i, 'add']), repeatable=False)
+                else:
+                    scheduler.read(url, DEFAULT_SHEET, lambda: server.read(spreadsheet=url, worksheet=DEFAULT_SHEET))
+            except Exception:
+                errors += 1
+            timings.append(time.perf_counter() - t0)
+        return timings, errors
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(session, range(sessions)))
+    timings = pd.Series([t for ts, _ in results for t in ts])
+    return {
+        'requests': len(timings),
+        'errors': sum(e for _, e in results),
+        'seconds': round(time.perf_counter() - t0, 2),
+        'p50_ms': round(timings.quantile(0.5) * 1000, 1),
+        'p95_ms': round(timings.quantile(0.95) * 1000, 1),
+        'server': dict(server.stats),
+        'scheduler': {k: round(v, 2) for k, v in scheduler.stats.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="對本機假的 Google Sheets 做讀寫壓力測試")
+    parser.add_argument('--sessions', type=int, default=8, help="同時使用的 session 數")
+    parser.add_argument('--ops', type=int, default=40, help="每個 session 的請求數")
+    parser.add_argument('--write-ratio', type=float, default=0.2, help="寫入請求的比例")
+    parser.add_argument('--sheets', type=int, default=2, help="試算表數量 (讀取合併以試算表 + 工作表為單位)")
+    parser.add_argument('--latency', default='lognormal:200:0.4', help="延遲分布，例如 fixed:100、uniform:50:300")
+    parser.add_argument('--quota', default='reads=60,writes=60', help="每分鐘配額")
+    parser.add_argument('--failures', default='', help="隨機失敗，例如 503:0.05,timeout:0.01")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    result = bench(args.sessions, args.ops, args.write_ratio, args.sheets, args.latency, args.quota,
+                   args.failures, args.seed)
+    for key, value in result.items():
+        print(f"{key:>10}: {value}")
+    return 1 if result['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
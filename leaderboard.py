@@ -0,0 +1,136 @@
+import os
+import json
+import heapq
+import threading
+
+# ==========================================
+# 猜數字跨 session 排行榜與統計
+# ==========================================
+# 整個行程共用一份：每局結束只做 O(log K) 的堆積更新與常數記憶體的累計，
+# 不保留完整對局清單，讀取排行榜時只需排序 K 筆。
+
+
+class TopK:
+    """只保留分數最小的 K 筆 (分數越小越好)"""
+
+    def __init__(self, k):
+        self.k = k
+        # 以負分數存成最大堆積，堆頂就是目前榜上最差的一筆
+        self._heap = []
+        self._seq = 0
+
+    def push(self, score, item):
+        self._seq += 1
+        entry = (tuple(-s for s in score), -self._seq, item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if entry[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+            return True
+        return False
+
+    def items(self):
+        """由好到差排序 (同分時先達成者在前)"""
+        return [item for _, _, item in sorted(self._heap, reverse=True)]
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class RunningStats:
+    """Welford 累計：固定記憶體算出平均與變異數"""
+
+    def __init__(self, n=0, mean=0.0, m2=0.0):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    def to_dict(self):
+        return {'n': self.n, 'mean': self.mean, 'm2': self.m2}
+
+
+class Leaderboard:
+    """最少猜測次數榜 + 最快完成榜 + 次數分布統計 (執行緒安全)"""
+
+    def __init__(self, path=None, k=10):
+        self.path = path
+        self.k = k
+        self._lock = threading.Lock()
+        self._by_guesses = TopK(k)
+        self._by_time = TopK(k)
+        self.histogram = {}
+        self.guess_stats = RunningStats()
+        self.time_stats = RunningStats()
+        if path and os.path.exists(path):
+            self._load()
+
+    def record(self, name, guesses, seconds, finished_at=None):
+        """登記一局結果；回傳是否擠進任一個排行榜"""
+        entry = {'name': name or "匿名", 'guesses': int(guesses),
+                 'seconds': round(float(seconds), 2), 'finished_at': finished_at}
+        with self._lock:
+            ranked = self._by_guesses.push((entry['guesses'], entry['seconds']), entry)
+            ranked = self._by_time.push((entry['seconds'], entry['guesses']), entry) or ranked
+            self.histogram[entry['guesses']] = self.histogram.get(entry['guesses'], 0) + 1
+            self.guess_stats.add(entry['guesses'])
+            self.time_stats.add(entry['seconds'])
+            if self.path:
+                self._save()
+        return ranked
+
+    def fewest_guesses(self):
+        with self._lock:
+            return self._by_guesses.items()
+
+    def fastest(self):
+        with self._lock:
+            return self._by_time.items()
+
+    def summary(self):
+        with self._lock:
+            return {
+                'games': self.guess_stats.n,
+                'avg_guesses': self.guess_stats.mean,
+                'std_guesses': self.guess_stats.variance ** 0.5,
+                'avg_seconds': self.time_stats.mean,
+                'histogram': dict(sorted(self.histogram.items())),
+            }
+
+    # --- 本機檔案保存 ---
+    def _save(self):
+        data = {
+            'fewest_guesses': self._by_guesses.items(),
+            'fastest': self._by_time.items(),
+            'histogram': {str(k): v for k, v in self.histogram.items()},
+            'guess_stats': self.guess_stats.to_dict(),
+            'time_stats': self.time_stats.to_dict(),
+        }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for e in data.get('fewest_guesses', []):
+            self._by_guesses.push((e['guesses'], e['seconds']), e)
+        for e in data.get('fastest', []):
+            self._by_time.push((e['seconds'], e['guesses']), e)
+        self.histogram = {int(k): v for k, v in data.get('histogram', {}).items()}
+        self.guess_stats = RunningStats(**data.get('guess_stats', {}))
+        self.time_stats = RunningStats(**data.get('time_stats', {}))
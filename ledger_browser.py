@@ -0,0 +1,153 @@
+import os
+import json
+import zlib
+import base64
+
+from ledger_journal import Journal
+
+# ==========================================
+# 瀏覽器保存 (localStorage，資料不離開使用者裝置)
+# ==========================================
+# 瀏覽器裡存的就是操作日誌：一份壓縮快照 + 之後每次異動的壓縮差異。
+#   - 每次異動只把新增的事件 (通常 1 筆) 送給瀏覽器追加；
+#   - 日誌壓縮快照或整份資料被換掉 (還原備份) 時才整份重寫；
+#   - 重新整理後由瀏覽器送回快照 + 差異，重播即可，不必再上傳備份檔。
+# 瀏覽器與 Python 之間透過 browser_store/ 的小元件傳遞字串，一次只處理一個指令。
+
+NAMESPACE = "ledger"
+STATE_KEY = "browser_store_state"
+_FRONTEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "browser_store")
+_component = None
+
+
+def pack(obj):
+    """物件 → JSON → zlib → base64 字串 (localStorage 只能存字串)"""
+    raw = json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.b64encode(zlib.compress(raw, 6)).decode('ascii')
+
+
+def unpack(text):
+    return json.loads(zlib.decompress(base64.b64decode(text)).decode('utf-8'))
+
+
+def load_journal(reply):
+    """瀏覽器送回的快照 + 差異 → (Journal, 封存月份)；沒有保存過資料時回傳 None"""
+    if not reply.get('checkpoint'):
+        return None
+    checkpoint = unpack(reply['checkpoint'])
+    events = [e for chunk in reply.get('deltas') or [] if chunk for e in unpack(chunk)
+              if e['seq'] > checkpoint['seq']]
+    journal = Journal.restore(checkpoint['records'], events)
+    journal.epoch = reply['epoch']
+    journal.snapshot_seq = checkpoint['seq']
+    journal.seq = max(journal.seq, checkpoint['seq'])
+    return journal, checkpoint.get('archive')
+
+
+def pending(journal, records, synced, archive=None):
+    """瀏覽器目前保存到 synced = (epoch, seq)，回傳下一個要送的指令 (已同步則為 None)
+
+    封存月份 (ledger_tiers) 只會在換新日誌時變動，所以只跟著快照一起寫入。
+    """
+    epoch = getattr(journal, 'epoch', None)
+    if epoch is None:
+        # 舊版 session 暫存還原回來的日誌沒有代號
+        from ledger_ids import new_id
+        epoch = journal.epoch = new_id()
+    saved_epoch, saved_seq = synced or (None, -1)
+    if saved_epoch == epoch and saved_seq == journal.seq:
+        return None
+    if saved_epoch != epoch or not journal.snapshot_seq <= saved_seq < journal.seq:
+        # 中間的事件已被壓縮進快照 (或根本是另一份日誌)：以目前內容整份重寫
+        return {'op': 'checkpoint', 'epoch': epoch, 'seq': journal.seq,
+                'data': pack({'seq': journal.seq, 'records': records,
+                              'archive': archive.to_payload() if archive is not None else None})}
+    events = [e for e in journal.tail if e['seq'] > saved_seq]
+    return {'op': 'append', 'epoch': epoch, 'from': saved_seq, 'seq': journal.seq, 'data': pack(events)}
+
+
+def _state():
+    import streamlit as st
+    if STATE_KEY not in st.session_state:
+        st.session_state[STATE_KEY] = {'loaded': False, 'enabled': False, 'synced': None,
+                                       'req': 0, 'done': 0, 'command': None, 'bytes': 0, 'error': None}
+    return st.session_state[STATE_KEY]
+
+
+def is_enabled():
+    import streamlit as st
+    state = st.session_state.get(STATE_KEY)
+    return bool(state and state['enabled'])
+
+
+def _handle(state, reply, records):
+    """處理瀏覽器的回覆 (每個指令只處理一次)；需要以瀏覽器資料還原時回傳 (Journal, 封存月份)"""
+    if not reply or reply.get('req') != state['req'] or state['done'] == state['req']:
+        return None
+    state['done'] = state['req']
+    if not reply.get('ok'):
+        # 多半是容量不足：關掉自動保存，避免每次重新執行都再失敗一次
+        state.update(enabled=False, synced=None, error=reply.get('error'))
+        return None
+    state['bytes'] = reply.get('bytes', 0)
+    state['synced'] = (reply.get('epoch'), reply.get('seq'))
+    if reply['op'] != 'load':
+        return None
+    state.update(loaded=True, enabled=bool(reply.get('enabled')))
+    if not state['enabled']:
+        return None
+    if not records:
+        return load_journal(reply)
+    # 這個 session 已經有資料 (例如剛上傳備份)：以 session 為準，稍後整份覆寫瀏覽器
+    state['synced'] = None
+    return None
+
+
+def render_sync(journal, records, archive=None, key="browser_store"):
+    """側邊欄的自動保存開關，並與瀏覽器同步
+
+    重新整理後瀏覽器送回保存的資料時，回傳 (還原好的 Journal, 封存月份)
+    (呼叫端換掉 records 後 rerun)。
+    """
+    import streamlit as st
+    import streamlit.components.v1 as components
+    global _component
+    if _component is None:
+        _component = components.declare_component("ledger_browser_store", path=_FRONTEND)
+    state = _state()
+
+    # 上一次指令的回覆在這次執行一開始就拿得到，先處理再決定下一個指令
+    restored = _handle(state, st.session_state.get(key), records)
+    if restored is not None:
+        return restored
+
+    enabled = st.toggle("💽 自動保存在這個瀏覽器", value=state['enabled'], disabled=not state['loaded'],
+                        help="開啟後每次異動都會壓縮存進瀏覽器 (不會上傳)，重新整理也不必再還原備份；關閉會清除瀏覽器裡的資料")
+    if state['loaded'] and enabled != state['enabled']:
+        state.update(enabled=enabled, synced=None, error=None)
+
+    if state['done'] != state['req']:
+        # 上一個指令還沒回覆：原樣重送，不疊加新指令
+        command = state['command']
+    else:
+        if not state['loaded']:
+            command = {'op': 'load'}
+        elif state['enabled']:
+            command = pending(journal, records, state['synced'], archive)
+        elif state['synced'] is None:
+            command = {'op': 'clear'}
+        else:
+            command = None
+        if command is not None:
+            state['req'] += 1
+            command.update(req=state['req'], ns=NAMESPACE)
+            state['command'] = command
+    reply = _component(command=command, key=key, default=None)
+    restored = _handle(state, reply, records)
+
+    if state['error']:
+        st.error(f"❌ 瀏覽器保存失敗，已關閉自動保存：{state['error']}")
+    elif state['enabled']:
+        synced = state['synced'] == (getattr(journal, 'epoch', None), journal.seq)
+        st.caption(f"{'✅ 已同步' if synced else '⏳ 同步中'} · 約 {state['bytes'] / 1024:,.0f} KB")
+    return restored
@@ -0,0 +1,169 @@
+import calendar
+from datetime import date
+
+import pandas as pd
+
+# ==========================================
+# 分類預算 (含歷史) + 超支熱圖 + 本月預測
+# ==========================================
+# 預算以「從某個月份起生效」的列保存：{'category', 'since': 'YYYY-MM', 'amount'}，
+# 同一個分類可以有多列，新的一列生效後取代舊的，舊月份仍用當時的預算評估。
+# 實際支出與預算都展開成「月份 × 分類」的矩陣，整張表一次相除比較，
+# 不逐月迴圈；5 年帳本也只有 60 列，開啟預算頁幾乎不花時間。
+
+OVERALL = '全部'
+BUDGET_COLUMNS = ['category', 'since', 'amount']
+# 預測本月剩餘天數的花費時，參考前幾個月的平均
+BASELINE_MONTHS = 3
+# 預測達到預算的這個比例就提醒
+WARN_RATIO = 0.9
+
+
+def default_budgets(amount, since='2000-01'):
+    """舊版只有一個「每月預算」：轉成從很早以前就生效的總預算"""
+    return [{'category': OVERALL, 'since': since, 'amount': float(amount)}]
+
+
+def budget_frame(budgets):
+    df = pd.DataFrame(budgets or [], columns=BUDGET_COLUMNS)
+    df['category'] = df['category'].astype(str)
+    df['since'] = pd.to_datetime(df['since'].astype(str).str[:7], format='%Y-%m', errors='coerce').dt.strftime('%Y-%m')
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+    df = df.dropna().drop_duplicates(['category', 'since'], keep='last')
+    return df.sort_values(['category', 'since'], ignore_index=True)
+
+
+# --- 實際支出 (長表：month, category, amount) ---
+def actuals_from_records(df):
+    """明細表 → 各月各分類支出 (向量化 groupby)"""
+    if df.empty:
+        return pd.DataFrame(columns=['month', 'category', 'amount'])
+    ex = df[df['type'] == '支出']
+    amount = pd.to_numeric(ex['amount'], errors='coerce').fillna(0.0)
+    month = ex['date'].astype(str).str[:7]
+    return (amount.groupby([month.rename('month'), ex['category'].astype(str).rename('category')])
+            .sum().rename('amount').reset_index())
+
+
+def actuals_from_rollup(rollup_df):
+    """Summary 彙總表 (ledger_rollup.to_frame) → 各月各分類支出"""
+    ex = rollup_df[rollup_df['type'] == '支出']
+    return ex.groupby(['month', 'category'], as_index=False)['amount'].sum()
+
+
+# --- 月份 × 分類 矩陣 ---
+def month_range(first, last):
+    return [p.strftime('%Y-%m') for p in pd.period_range(first, last, freq='M')]
+
+
+def evaluate(actuals, budgets, today=None):
+    """回傳 (actual, budget, ratio) 三張 月份 × 分類 的表
+
+    月份從第一筆支出 (或第一筆預算) 連續到本月，沒花費的月份為 0；
+    預算依生效月份往後延用，尚未設定的格子為 NaN。
+    '全部' 欄是各分類合計，對應總預算。
+    """
+    today = today or date.today()
+    budgets = budget_frame(budgets)
+    this_month = today.strftime('%Y-%m')
+    first = min(actuals['month'].min(), this_month) if not actuals.empty else this_month
+    months = month_range(first, max(this_month, actuals['month'].max() if not actuals.empty else this_month))
+
+    actual = actuals.pivot_table(index='month', columns='category', values='amount', aggfunc='sum', fill_value=0.0)
+    actual = actual.reindex(index=months, fill_value=0.0)
+    actual.insert(0, OVERALL, actual.sum(axis=1))
+
+    # 生效月份早於第一個月份的預算先歸到第一個月，再往後延用 (ffill)
+    clipped = budgets.assign(since=budgets['since'].where(budgets['since'] >= first, first))
+    budget = clipped.pivot_table(index='since', columns='category', values='amount', aggfunc='last')
+    budget = budget.reindex(index=sorted(set(months) | set(budget.index))).ffill().reindex(index=months)
+
+    categories = list(actual.columns) + [c for c in budget.columns if c not in actual.columns]
+    actual = actual.reindex(columns=categories, fill_value=0.0)
+    budget = budget.reindex(columns=categories)
+    ratio = actual / budget.where(budget > 0)
+    return actual, budget, ratio
+
+
+def forecast(actual, budget, today=None, baseline_months=BASELINE_MONTHS):
+    """本月預測：已花 + 剩餘天數 × 平常的速度 (前幾個月的平均；沒有歷史就用本月目前的速度)"""
+    today = today or date.today()
+    month = today.strftime('%Y-%m')
+    days = calendar.monthrange(today.year, today.month)[1]
+    elapsed = today.day / days
+    spent = actual.loc[month]
+    history = actual.loc[actual.index < month].tail(baseline_months)
+    pace = history.mean() if len(history) else spent / elapsed
+    projected = spent + pace * (1 - elapsed)
+    limit = budget.loc[month]
+    table = pd.DataFrame({'分類': actual.columns, '本月已花': spent.values, '預算': limit.values,
+                          '預測月底': projected.values})
+    used = table['預測月底'] / table['預算'].where(table['預算'] > 0)
+    table['預測 / 預算 (%)'] = used * 100
+    table['狀態'] = '—'
+    has_budget = table['預算'].notna()
+    table.loc[has_budget, '狀態'] = '✅ 正常'
+    table.loc[has_budget & (used >= WARN_RATIO), '狀態'] = '⚠️ 可能超支'
+    table.loc[has_budget & (table['本月已花'] > table['預算']), '狀態'] = '🔥 已超支'
+    # 總預算排第一，其餘依預測使用率由高到低；沒有預算、本月也沒花的分類不列
+    table = table[has_budget | (table['本月已花'] > 0)]
+    table = table.assign(_rest=table['分類'] != OVERALL)
+    table = table.sort_values(['_rest', '預測 / 預算 (%)', '本月已花'], ascending=[True, False, False], na_position='last')
+    return table.drop(columns='_rest').reset_index(drop=True)
+
+
+def render_budget(actuals, budgets, categories, today=None, key="budget"):
+    """分析頁的預算區塊；按下儲存時回傳新的預算清單，否則回傳 None"""
+    import streamlit as st
+    import plotly.express as px
+    today = today or date.today()
+    actual, budget, ratio = evaluate(actuals, budgets, today)
+    table = forecast(actual, budget, today)
+    month = today.strftime('%Y-%m')
+
+    st.subheader("🎯 本月預算執行進度")
+    overall = table[table['分類'] == OVERALL]
+    if not overall.empty and overall['預算'].notna().all():
+        row = overall.iloc[0]
+        c_p, c_v = st.columns([4, 1])
+        c_p.progress(min(row['本月已花'] / row['預算'], 1.0))
+        c_v.write(f"**{row['本月已花'] / row['預算'] * 100:.1f}%**")
+        st.write(f"📊 {month} 已花費 **${row['本月已花']:,.0f}** / ${row['預算']:,.0f}，"
+                 f"照目前速度月底約 **${row['預測月底']:,.0f}**")
+    st.dataframe(table, hide_index=True, use_container_width=True, column_config={
+        '本月已花': st.column_config.NumberColumn(format="$%.0f"),
+        '預算': st.column_config.NumberColumn(format="$%.0f"),
+        '預測月底': st.column_config.NumberColumn(format="$%.0f"),
+        '預測 / 預算 (%)': st.column_config.ProgressColumn(format="%.0f%%", min_value=0, max_value=150),
+    })
+
+    # 有設定預算的分類才畫熱圖：顏色是 實際 / 預算，超過 100% 轉紅
+    shown = ratio.dropna(axis=1, how='all')
+    if not shown.empty:
+        if len(shown) > 12:
+            shown = shown.tail(st.slider("熱圖顯示最近幾個月", 12, len(shown), min(24, len(shown)), key=f"{key}_months"))
+        fig = px.imshow((shown * 100).round().T, aspect='auto', origin='lower', zmin=0, zmax=200,
+                        color_continuous_scale=['#2ca02c', '#ffffbf', '#d62728'],
+                        labels={'x': '月份', 'y': '分類', 'color': '實際 / 預算 (%)'},
+                        title="各月份預算使用率 (超過 100% 為超支)")
+        st.plotly_chart(fig, use_container_width=True)
+
+    with st.expander("✏️ 設定分類預算 (含歷史)"):
+        st.caption(f"每列代表「某分類從某月份起的每月預算」；預算調整時新增一列即可，過去的月份仍以當時的預算評估。"
+                   f"「{OVERALL}」是所有分類合計的總預算。")
+        current = budget_frame(budgets)
+        rev = st.session_state.get(f"{key}_rev", 0)
+        edited = st.data_editor(current, key=f"{key}_editor_{rev}", num_rows="dynamic", hide_index=True,
+                                use_container_width=True, column_config={
+                                    'category': st.column_config.SelectboxColumn(
+                                        "分類", options=[OVERALL] + [c for c in categories if c != OVERALL], required=True),
+                                    'since': st.column_config.TextColumn("起始月份 (YYYY-MM)", default=month,
+                                                                         validate=r"^\d{4}-\d{2}$", required=True),
+                                    'amount': st.column_config.NumberColumn("每月預算", min_value=0.0, step=500.0,
+                                                                            format="%.0f", required=True),
+                                })
+        if st.button("💾 儲存預算", key=f"{key}_save"):
+            # 換掉表格 key，清掉已經套用的暫存編輯
+            st.session_state[f"{key}_rev"] = rev + 1
+            return budget_frame(edited.to_dict('records')).to_dict('records')
+    return None
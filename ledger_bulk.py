@@ -0,0 +1,102 @@
+import pandas as pd
+
+from ledger_ids import normalize
+
+# ==========================================
+# 歷史明細的表格批次編輯
+# ==========================================
+# 在表格裡直接改、勾選多列後批次改分類或刪除，所有變更先整理成一份差異
+# ({id: 變更欄位} + 刪除清單)，按下儲存時才一次交給日誌，只寫入一次。
+
+GRID_COLUMNS = ['date', 'type', 'category', 'amount', 'note']
+SELECT = '選取'
+ACTIONS = {'none': "不動作", 'category': "🏷️ 改分類", 'delete': "🗑️ 刪除"}
+
+
+def to_grid(df):
+    """明細 → 以 id 為索引的可編輯表格"""
+    grid = df.set_index('id')[GRID_COLUMNS].copy()
+    grid['date'] = pd.to_datetime(grid['date'], errors='coerce').dt.date
+    grid['amount'] = pd.to_numeric(grid['amount'], errors='coerce').fillna(0.0)
+    grid['note'] = grid['note'].fillna('').astype(str)
+    grid.insert(0, SELECT, False)
+    return grid
+
+
+def _value(col, value):
+    if col == 'date':
+        return value.strftime('%Y-%m-%d')
+    if col == 'amount':
+        return float(value)
+    return str(value)
+
+
+def _rid(value):
+    rid = normalize(value)
+    return value if rid is None else rid
+
+
+def diff(original, edited, action='none', category=None, select_all=False):
+    """比對編輯前後的表格，回傳 (updates {id: {欄位: 新值}}, deletes [id])
+
+    逐欄向量化比較，只對真的有變動的格子組出變更。
+    """
+    selected = list(edited.index) if select_all else list(edited.index[edited[SELECT].fillna(False).astype(bool)])
+    deletes = [_rid(i) for i in selected] if action == 'delete' else []
+    updates = {}
+    for col in GRID_COLUMNS:
+        before, after = original[col], edited[col]
+        changed = (before != after) & ~(before.isna() & after.isna()) & after.notna()
+        for i in edited.index[changed]:
+            updates.setdefault(_rid(i), {})[col] = _value(col, edited.at[i, col])
+    if action == 'category' and category:
+        for i in selected:
+            if edited.at[i, 'category'] != category:
+                updates.setdefault(_rid(i), {})['category'] = category
+    for rid in deletes:
+        updates.pop(rid, None)
+    return updates, deletes
+
+
+def render_editor(df, categories, key="bulk"):
+    """表格編輯模式；按下儲存時回傳 (updates, deletes)，否則回傳 None"""
+    import streamlit as st
+    if df.empty:
+        st.info("沒有可編輯的紀錄")
+        return None
+    original = to_grid(df.sort_values(by=['date', 'id'], ascending=False))
+    options = sorted(set(categories) | set(original['category'].astype(str)))
+    rev = st.session_state.get(f"{key}_rev", 0)
+
+    c1, c2, c3 = st.columns([2, 2, 1])
+    action = c1.selectbox("對選取的列", list(ACTIONS), format_func=ACTIONS.get, key=f"{key}_action")
+    category = c2.selectbox("新分類", options, key=f"{key}_category", disabled=action != 'category')
+    select_all = c3.checkbox(f"全選 {len(original)} 筆", key=f"{key}_all_{rev}")
+
+    # 篩選結果或資料變了就換一個新表格，避免舊的暫存編輯套到別列
+    fingerprint = hash(tuple(original.index))
+    edited = st.data_editor(
+        original, key=f"{key}_editor_{rev}_{fingerprint}", hide_index=True, num_rows="fixed",
+        use_container_width=True,
+        column_config={
+            SELECT: st.column_config.CheckboxColumn("選取", width="small"),
+            'date': st.column_config.DateColumn("日期", format="YYYY-MM-DD", required=True),
+            'type': st.column_config.SelectboxColumn("類型", options=['收入', '支出'], required=True),
+            'category': st.column_config.SelectboxColumn("分類", options=options, required=True),
+            'amount': st.column_config.NumberColumn("金額", min_value=0.0, step=1.0, format="%.0f"),
+            'note': st.column_config.TextColumn("備註"),
+        })
+
+    updates, deletes = diff(original, edited, action, category, select_all)
+    pending = len(updates) + len(deletes)
+    st.caption(f"✏️ 待儲存：修改 {len(updates)} 筆、刪除 {len(deletes)} 筆")
+    b1, b2 = st.columns(2)
+    if b1.button(f"💾 儲存 {pending} 項變更", key=f"{key}_save", type="primary",
+                 disabled=pending == 0, use_container_width=True):
+        # 換掉表格 key，清掉已經套用的暫存編輯
+        st.session_state[f"{key}_rev"] = rev + 1
+        return updates, deletes
+    if b2.button("✖️ 放棄變更", key=f"{key}_discard", disabled=pending == 0, use_container_width=True):
+        st.session_state[f"{key}_rev"] = rev + 1
+        st.rerun()
+    return None
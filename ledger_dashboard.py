@@ -0,0 +1,92 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+# ==========================================
+# 全家總覽：平行讀取多本帳本
+# ==========================================
+# 逐本讀取的等待時間是每本相加；這裡用有上限的執行緒池同時讀取，
+# 整體等待約等於最慢的那一本。每本各自計時，逾時或失敗的帳本
+# 只標記狀態，其餘成員的資料照常顯示 (部分結果)。
+
+MAX_WORKERS = 4
+LEDGER_TIMEOUT = 15.0
+_POLL_SECONDS = 0.05
+
+
+def fetch_all(sources, fetch, max_workers=MAX_WORKERS, timeout=LEDGER_TIMEOUT, initializer=None):
+    """同時讀取多本帳本
+
+    sources: {成員名稱: 參數}；fetch(參數) 回傳該帳本的 records。
+    逾時從該帳本「開始讀取」起算，排隊等執行緒的時間不計入。
+    回傳 {成員名稱: {'status': ok|error|timeout, 'records', 'error', 'seconds'}}
+    """
+    results = {}
+    if not sources:
+        return results
+    started = {}
+    lock = threading.Lock()
+
+    def _run(name, arg):
+        with lock:
+            started[name] = time.monotonic()
+        return fetch(arg)
+
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(sources)), initializer=initializer)
+    futures = {pool.submit(_run, name, arg): name for name, arg in sources.items()}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in done:
+                name = futures[future]
+                seconds = now - started.get(name, now)
+                try:
+                    results[name] = {'status': 'ok', 'records': future.result(), 'error': None, 'seconds': seconds}
+                except Exception as e:
+                    results[name] = {'status': 'error', 'records': [], 'error': str(e), 'seconds': seconds}
+            with lock:
+                expired = [f for f in pending
+                           if futures[f] in started and now - started[futures[f]] >= timeout]
+            for future in expired:
+                # 已在執行的讀取無法中斷，放著讓它在背景結束，結果直接丟棄
+                pending.discard(future)
+                future.cancel()
+                results[futures[future]] = {'status': 'timeout', 'records': [], 'error': f"超過 {timeout:.0f} 秒未回應",
+                                            'seconds': now - started[futures[future]]}
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return {name: results[name] for name in sources if name in results}
+
+
+def merge(results):
+    """把各成員的 records 合併成一張加上 member 欄位的表"""
+    frames = []
+    for name, result in results.items():
+        if result['records']:
+            df = pd.DataFrame(result['records'])
+            df['member'] = name
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=['id', 'date', 'type', 'amount', 'category', 'note', 'member'])
+    df = pd.concat(frames, ignore_index=True)
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df = df.dropna(subset=['date'])
+    df['month_key'] = df['date'].dt.strftime('%Y-%m')
+    return df
+
+
+def status_frame(results):
+    """每本帳本的讀取狀態 (給總覽頁的狀態表用)"""
+    icons = {'ok': '✅', 'error': '❌', 'timeout': '⏱️'}
+    return pd.DataFrame([{
+        '成員': name,
+        '狀態': icons.get(r['status'], r['status']),
+        '筆數': len(r['records']),
+        '耗時 (秒)': round(r['seconds'], 2),
+        '訊息': r['error'] or '',
+    } for name, r in results.items()])
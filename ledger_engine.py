@@ -0,0 +1,353 @@
+import io
+import os
+import json
+
+import pandas as pd
+
+import ledger_ids
+import ledger_rollup
+import ledger_suggest
+import sheets_scheduler
+from ledger_query import LedgerIndex
+from ledger_stats import RollingStats, Z_THRESHOLD
+from ledger_journal import Journal, JOURNAL_COLUMNS, event_to_row, events_from_frame
+
+# ==========================================
+# 帳本核心 (不依賴 Streamlit)
+# ==========================================
+# 紀錄格式、清理、彙總與匯出都放在這裡，網頁 (app2 ~ app5) 與
+# 命令列批次報表 (ledger_report.py) 共用同一套邏輯；
+# 網頁 app 的新增 / 修改 / 復原與各種索引的維護也在這裡 (LedgerSession)。
+
+RECORD_COLUMNS = ['id', 'date', 'type', 'amount', 'category', 'note']
+TYPES = ('收入', '支出')
+
+
+# --- 紀錄 ---
+def record_fields(r_date, r_type, amount, category, note):
+    """表單輸入 → 紀錄欄位 (不含 id)"""
+    return {'date': r_date.strftime('%Y-%m-%d'), 'type': r_type, 'amount': amount, 'category': category, 'note': note}
+
+
+def new_record(r_date, r_type, amount, category, note):
+    return dict(id=ledger_ids.new_id(), **record_fields(r_date, r_type, amount, category, note))
+
+
+def clean_frame(df):
+    """試算表 / 檔案讀進來的表格：金額轉數字、日期統一成 YYYY-MM-DD"""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=RECORD_COLUMNS)
+    df = df.dropna(how='all').copy()
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
+    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
+    if 'note' in df:
+        df['note'] = df['note'].fillna('')
+    return df
+
+
+def to_frame(records):
+    return pd.DataFrame(records) if records else pd.DataFrame(columns=RECORD_COLUMNS)
+
+
+# --- 讀檔 ---
+def read_ledger(path):
+    """讀取 JSON / CSV / Parquet 帳本，回傳清理過的 records (舊版 ID 一併轉換)"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.json':
+        with open(path, encoding='utf-8') as f:
+            df = pd.DataFrame(json.load(f))
+    elif ext == '.csv':
+        df = pd.read_csv(path, encoding='utf-8-sig')
+    elif ext in ('.parquet', '.pq'):
+        # 需要 pyarrow 或 fastparquet，沒有安裝時 pandas 會丟出 ImportError
+        df = pd.read_parquet(path)
+    else:
+        raise ValueError(f"不支援的檔案格式：{ext}")
+    records = clean_frame(df).to_dict('records')
+    ledger_ids.migrate(records)
+    return records
+
+
+# --- 匯出 ---
+def export_json(records):
+    return json.dumps(records, ensure_ascii=False, indent=4)
+
+
+def export_csv(records):
+    # utf-8-sig 讓 Excel 直接開啟時中文不會亂碼
+    return to_frame(records).to_csv(index=False).encode('utf-8-sig')
+
+
+def export_excel(records=None, sheets=None):
+    """匯出 Excel：只給 records 時輸出單一工作表，或給 {工作表名稱: DataFrame}"""
+    sheets = sheets if sheets is not None else {'Sheet1': to_frame(records)}
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name[:31], index=False)
+    return buffer.getvalue()
+
+
+# --- 彙總 ---
+def monthly_summary(records):
+    """每月收入 / 支出 / 結餘與累計結餘"""
+    by_month = ledger_rollup.by_month_type(ledger_rollup.build_rollup(records))
+    if by_month.empty:
+        return pd.DataFrame(columns=['月份', *TYPES, '結餘', '累計結餘'])
+    table = by_month.pivot_table(index='month_key', columns='type', values='amount', aggfunc='sum', fill_value=0.0)
+    table = table.reindex(columns=list(TYPES), fill_value=0.0)
+    table['結餘'] = table['收入'] - table['支出']
+    table['累計結餘'] = table['結餘'].cumsum()
+    return table.reset_index().rename(columns={'month_key': '月份'})
+
+
+def category_summary(records, month=None):
+    """各分類支出 (可限定月份)，含占比"""
+    df = ledger_rollup.by_category(ledger_rollup.build_rollup(records), '支出', month=month)
+    total = df['amount'].sum()
+    df['占比'] = (df['amount'] / total).round(4) if total else 0.0
+    return df.sort_values('amount', ascending=False, ignore_index=True).rename(columns={'category': '分類', 'amount': '金額'})
+
+
+def anomalies(records, stats=None):
+    """金額明顯偏離同分類平常水準的紀錄"""
+    df = to_frame(records)
+    if df.empty:
+        return df.assign(z=pd.Series(dtype=float))
+    stats = stats or RollingStats.from_records(records)
+    df['z'] = stats.flag(df)
+    return df[df['z'].abs() >= Z_THRESHOLD].sort_values('date', ignore_index=True)
+
+
+def report(records, month=None):
+    """一本帳本的完整報表：總覽數字 + 各工作表"""
+    stats = RollingStats.from_records(records)
+    rollup = ledger_rollup.build_rollup(records)
+    income = ledger_rollup.total(rollup, '收入', month=month)
+    expense = ledger_rollup.total(rollup, '支出', month=month)
+    odd = anomalies(records, stats)
+    if month:
+        odd = odd[odd['date'].astype(str).str.startswith(month)]
+    overview = {
+        'records': len(records),
+        'income': round(income, 2),
+        'expense': round(expense, 2),
+        'net': round(income - expense, 2),
+        'expense_7d': round(stats.total(7), 2),
+        'expense_30d': round(stats.total(30), 2),
+        'anomalies': len(odd),
+        'months': len(ledger_rollup.months(rollup)),
+    }
+    sheets = {
+        '每月收支': monthly_summary(records),
+        '支出分類': category_summary(records, month),
+        '近30天': stats.window_frame(30),
+        '異常金額': odd,
+    }
+    return overview, sheets
+
+
+# ==========================================
+# 網頁 app 共用的帳本操作 (app2 ~ app5)
+# ==========================================
+class LedgerSession:
+    """新增 / 修改 / 刪除 / 批次 / 復原一律經過操作日誌，並增量維護搜尋索引、滾動統計與備註索引
+
+    狀態放在 state (app 傳入 st.session_state；這裡不依賴 Streamlit，一般 dict 也可以)。
+    各 app 只覆寫不同的地方：_persist (存檔)，需要時再加 _on_applied / _build_stats。
+    """
+
+    def __init__(self, state):
+        self.state = state
+        for key, value in (('records', []), ('editing_id', None), ('records_rev', 0)):
+            if key not in state:
+                state[key] = value
+
+    # --- 各 app 覆寫 ---
+    def _persist(self, events, target=None):
+        """存檔掛鉤：events 是這次套用的事件 (可能含 None)，回傳值直接交給呼叫端"""
+        return events
+
+    def _on_applied(self, event):
+        """每筆事件套用後的額外增量維護 (例如試算表的彙總表)"""
+
+    def _build_stats(self, today=None):
+        return RollingStats.from_records(self.state['records'], today)
+
+    # --- 資料與日誌 ---
+    def journal(self):
+        """取得操作日誌 (第一次使用時以目前資料作為快照)"""
+        if 'journal' not in self.state:
+            self.state['journal'] = Journal(self.state['records'])
+        return self.state['journal']
+
+    def can_undo(self):
+        return self.journal().can_undo()
+
+    def can_redo(self):
+        return self.journal().can_redo()
+
+    def replace_records(self, records, journal=None):
+        """整份資料換掉 (讀取 / 還原 / 轉換 ID)：journal 預設以這份資料作為新快照，可重建的索引一併清掉"""
+        self.state['records'] = records
+        self.state['journal'] = journal if journal is not None else Journal(records)
+        # 新的 list 可能剛好重用舊 list 的 id()，所以搜尋索引也明確清掉並換版本
+        self.state['records_rev'] += 1
+        for key in ('search_index', 'search_index_key', 'rolling_stats', 'note_index'):
+            self.state.pop(key, None)
+
+    def _applied(self, event):
+        """事件套用後的收尾：原地修改 / 刪除時讓搜尋索引重建，滾動統計與備註索引只加減這一筆"""
+        if event is None:
+            return None
+        if event['op'] != 'add':
+            self.state['records_rev'] += 1
+        if 'rolling_stats' in self.state:
+            self.state['rolling_stats'].apply_change(event['before'], event['after'])
+        if 'note_index' in self.state:
+            self.state['note_index'].apply_change(event['before'], event['after'])
+        self._on_applied(event)
+        return event
+
+    def editing_record(self):
+        """正在修改的那一筆 (沒有或已被刪除時為 None)"""
+        record_id = self.state['editing_id']
+        if record_id is None:
+            return None
+        i = self.journal().find(self.state['records'], record_id)
+        return self.state['records'][i] if i >= 0 else None
+
+    def cancel_edit(self):
+        self.state['editing_id'] = None
+
+    # --- 操作 (target 原樣交給 _persist，例如試算表網址) ---
+    def add_or_update(self, r_date, r_type, amount, category, note, target=None):
+        """正在編輯時修改那一筆，否則新增"""
+        records = self.state['records']
+        if self.state['editing_id'] is not None:
+            fields = record_fields(r_date, r_type, amount, category, note)
+            event = self.journal().update(records, self.state['editing_id'], fields)
+            self.state['editing_id'] = None
+        else:
+            event = self.journal().add(records, new_record(r_date, r_type, amount, category, note))
+        return self._persist([self._applied(event)], target)
+
+    def delete(self, record_id, target=None):
+        return self._persist([self._applied(self.journal().delete(self.state['records'], record_id))], target)
+
+    def undo(self, target=None):
+        """復原上一步 (批次修改整組復原)"""
+        return self._persist([self._applied(e) for e in self.journal().undo(self.state['records'])], target)
+
+    def redo(self, target=None):
+        return self._persist([self._applied(e) for e in self.journal().redo(self.state['records'])], target)
+
+    def apply_batch(self, updates, deletes, target=None):
+        """表格批次編輯：整批變更算同一步 (一次復原)，也只存檔一次"""
+        events = self.journal().batch(self.state['records'], updates, deletes)
+        return self._persist([self._applied(e) for e in events], target)
+
+    # --- 衍生資料 (整份資料換掉時重建，其餘異動由 _applied 增量更新) ---
+    def stats(self, today=None):
+        """近 7 / 30 / 90 天滾動統計 (today 傳入 app 顯示用的台灣日期，預設為伺服器日期)"""
+        stats = self.state.get('rolling_stats')
+        if stats is None:
+            stats = self.state['rolling_stats'] = self._build_stats(today)
+        return stats.advance(today)
+
+    def notes(self):
+        """備註自動完成索引"""
+        index = self.state.get('note_index')
+        if index is None:
+            index = self.state['note_index'] = ledger_suggest.NoteIndex.from_records(self.state['records'])
+        return index
+
+    def search(self, query):
+        """以查詢語法篩選紀錄，回傳符合的列位置 (索引只在資料異動時重建)"""
+        records = self.state['records']
+        key = (id(records), self.state['records_rev'])
+        index = self.state.get('search_index')
+        if index is None or self.state.get('search_index_key') != key or index.size > len(records):
+            index = LedgerIndex(records)
+            self.state['search_index'] = index
+            self.state['search_index_key'] = key
+        elif index.size < len(records):
+            index.extend(records)
+        return index.search(query)
+
+
+class SheetsLedgerSession(LedgerSession):
+    """Google Sheets 帳本 (app4 / app5)：Sheet1 是最近一次的快照，之後的異動只追加到 Journal 工作表
+
+    所有請求都經過行程共用的 sheets_scheduler (讀取合併 + 配額控制 + 退避重試)。
+    """
+    SNAPSHOT_SHEET = "Sheet1"
+    JOURNAL_SHEET = "Journal"
+
+    def __init__(self, state, conn):
+        super().__init__(state)
+        self.conn = conn
+        self._worksheets = {}
+
+    def _read(self, sheet_url, worksheet, priority=sheets_scheduler.INTERACTIVE):
+        return sheets_scheduler.read(sheet_url, worksheet, lambda: self.conn.read(
+            spreadsheet=sheet_url, worksheet=worksheet, ttl=0), priority)
+
+    def _update(self, sheet_url, worksheet, df, priority=sheets_scheduler.INTERACTIVE):
+        return sheets_scheduler.write(sheet_url, lambda: self.conn.update(
+            spreadsheet=sheet_url, worksheet=worksheet, data=df), priority)
+
+    def _spreadsheet(self, sheet_url):
+        return sheets_scheduler.open_spreadsheet(self.conn, sheet_url)
+
+    def _read_journal(self, sheet_url):
+        try:
+            return events_from_frame(self._read(sheet_url, self.JOURNAL_SHEET))
+        except Exception:
+            return []  # 還沒有 Journal 工作表
+
+    def _fetch(self, sheet_url):
+        """讀取一本帳本的快照與日誌 → Journal (不碰 state，可在背景執行緒呼叫)"""
+        snapshot = clean_frame(self._read(sheet_url, self.SNAPSHOT_SHEET)).to_dict('records')
+        return Journal.restore(snapshot, self._read_journal(sheet_url))
+
+    def _journal_sheet(self, sheet_url):
+        """取得 Journal 工作表 (gspread)，不存在就建立並寫入標題列；取得後快取，省下每次追加前的查詢"""
+        ws = self._worksheets.get(sheet_url)
+        if ws is not None:
+            return ws
+        spreadsheet = self._spreadsheet(sheet_url)
+        try:
+            ws = sheets_scheduler.read(sheet_url, (self.JOURNAL_SHEET,), lambda: spreadsheet.worksheet(self.JOURNAL_SHEET))
+        except Exception as e:
+            if type(e).__name__ != 'WorksheetNotFound':
+                raise
+            ws = sheets_scheduler.write(sheet_url, lambda: spreadsheet.add_worksheet(
+                title=self.JOURNAL_SHEET, rows=1, cols=len(JOURNAL_COLUMNS)), repeatable=False)
+            sheets_scheduler.write(sheet_url, lambda: ws.append_row(JOURNAL_COLUMNS), repeatable=False)
+        self._worksheets[sheet_url] = ws
+        return ws
+
+    def _write_snapshot(self, sheet_url):
+        """整份寫回 Sheet1 並清空 Journal；快照寫入成功後才清日誌，中途失敗時重播是冪等的，不會重複計算"""
+        self._update(sheet_url, self.SNAPSHOT_SHEET, to_frame(self.state['records']))
+        ws = self._journal_sheet(sheet_url)
+        sheets_scheduler.write(sheet_url, ws.clear)
+        sheets_scheduler.write(sheet_url, lambda: ws.append_row(JOURNAL_COLUMNS), repeatable=False)
+        self.journal().take_snapshot(self.state['records'])
+
+    def _append_events(self, sheet_url, events):
+        # 追加逾時不重送 (可能已經寫入)，失敗時由 app 提示；下次完整快照會補齊
+        ws = self._journal_sheet(sheet_url)
+        rows = [event_to_row(e) for e in events]
+        sheets_scheduler.write(sheet_url, lambda: ws.append_rows(rows, value_input_option='RAW'), repeatable=False)
+
+    def load_journal(self, sheet_url):
+        """讀取快照並重播 Journal 尾端事件，成為目前的資料；回傳舊版 ID 轉換的筆數"""
+        journal = self._fetch(sheet_url)
+        self.replace_records(journal.replay(), journal)
+        migrated = ledger_ids.migrate(self.state['records'])
+        if migrated:
+            # 日誌裡的舊 ID 已重播完畢，以轉換後的資料作為新快照
+            self.replace_records(self.state['records'])
+        return migrated
@@ -0,0 +1,92 @@
+import time
+import random
+import threading
+
+# ==========================================
+# 紀錄 ID：依時間排序的整數
+# ==========================================
+# 舊版用 str(uuid.uuid4())[:8]，只有 32 位元亂數，合併還原多份備份後容易撞號。
+# 新版 ID = [毫秒時間 41 位元][節點 5 位元][序號 7 位元]：
+#   - 同一個行程內嚴格遞增，依 ID 排序就是新增順序；
+#   - 節點位元在每個行程啟動時隨機決定，多台機器同時新增也幾乎不會相撞；
+#   - 總長 53 位元，存進 Google Sheets / JSON / 瀏覽器 (雙精度浮點數) 都不會失真。
+
+EPOCH_MS = 1704067200000  # 2024-01-01 00:00:00 UTC
+NODE_BITS = 5
+SEQ_BITS = 7
+_MAX_SEQ = (1 << SEQ_BITS) - 1
+# 新版 ID 的下限 (2024-01-04 產生的 ID)：比它小的整數只可能是舊版 ID 被試算表讀成數字
+# (8 碼十六進位剛好全是數字的約占 2.3%，例如 '12345678')
+MIN_ID = 1 << 40
+LEGACY_LENGTH = 8
+
+
+class IdGenerator:
+    def __init__(self, node=None, clock=None):
+        self.node = (random.getrandbits(NODE_BITS) if node is None else node) & ((1 << NODE_BITS) - 1)
+        self._clock = clock or (lambda: int(time.time() * 1000))
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._seq = 0
+
+    def next_id(self):
+        with self._lock:
+            now = self._clock() - EPOCH_MS
+            if now < self._last_ms:
+                # 系統時間被往回調：沿用上一個毫秒，維持遞增
+                now = self._last_ms
+            if now == self._last_ms:
+                self._seq += 1
+                if self._seq > _MAX_SEQ:
+                    # 同一毫秒用完序號：借用下一個毫秒
+                    now += 1
+                    self._seq = 0
+            else:
+                self._seq = 0
+            self._last_ms = now
+            return (now << (NODE_BITS + SEQ_BITS)) | (self.node << SEQ_BITS) | self._seq
+
+
+_generator = IdGenerator()
+
+
+def new_id():
+    return _generator.next_id()
+
+
+def created_at(record_id):
+    """由 ID 還原建立時間 (秒)"""
+    return ((int(record_id) >> (NODE_BITS + SEQ_BITS)) + EPOCH_MS) / 1000
+
+
+def normalize(value):
+    """試算表 / JSON 讀回來的 ID 統一成 int；舊版 ID (8 碼字串，或被讀成比新版下限小的數字) 回傳 None"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, float):
+        value = int(value) if value == value and value.is_integer() else None
+    elif not isinstance(value, int):
+        text = str(value).strip()
+        if text.endswith('.0'):
+            text = text[:-2]
+        if len(text) == LEGACY_LENGTH or not text.isdigit():
+            return None
+        value = int(text)
+    return value if value is not None and value >= MIN_ID else None
+
+
+def migrate(records):
+    """把舊版字串 ID 與重複的 ID 換成新的整數 ID (原地修改)，回傳更換的筆數
+
+    依清單順序產生，所以舊資料彼此之間仍維持原本的新增順序。
+    """
+    seen = set()
+    changed = 0
+    for r in records:
+        rid = normalize(r.get('id'))
+        if rid is None or rid in seen:
+            rid = new_id()
+            changed += 1
+        r['id'] = rid
+        seen.add(rid)
+    return changed
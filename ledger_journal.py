@@ -0,0 +1,307 @@
+import copy
+import json
+import zlib
+import pickle
+from collections import deque
+from datetime import datetime
+
+from ledger_ids import new_id, normalize
+
+# ==========================================
+# 帳本操作日誌 (event sourcing) + 快照 + 多步復原 / 重做
+# ==========================================
+# 每一次新增 / 修改 / 刪除都記成一筆只會往後追加的事件：
+#   {'seq', 'ts', 'op': add|update|delete, 'id', 'before', 'after'}
+# 復原 / 重做也是追加「反向事件」，日誌本身永遠不改寫。
+# 批次修改 (表格編輯) 的多筆事件視為同一步，一次復原 / 重做。
+# 目前資料 = 最近一次快照 + 之後的事件重播；事件累積到一定數量就壓縮成新快照。
+# 快照只在重播 / 還原時才讀，平常以壓縮後的 bytes 保存 (不另外常駐一份完整的 records)。
+
+SNAPSHOT_EVERY = 50
+# 最多可以復原 / 重做的步數 (每一步都留著修改前後的整筆紀錄，不設上限會隨操作無限增長)
+UNDO_LIMIT = 100
+JOURNAL_COLUMNS = ['seq', 'ts', 'op', 'id', 'before', 'after']
+
+
+def _key(record_id):
+    # ID 一律以 int 比較 (試算表 / 表格可能給 float、numpy 整數或字串)；
+    # 還沒轉換的舊版字串 ID 才退回字串比較
+    rid = normalize(record_id)
+    return str(record_id) if rid is None else rid
+
+
+class Positions:
+    """id → 在 records 中的位置：新增 / 刪除時跟著更新，查找是 O(1)
+
+    只對應一份 records (以 id() 辨認)；換了一份 list、位置上的 ID 對不上或筆數變了
+    (資料在日誌以外被改過) 就整份重建一次。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._of = None
+        self._pos = {}
+        self._len = 0
+
+    def _rebuild(self, records):
+        self._of = id(records)
+        self._len = len(records)
+        self._pos = {}
+        for i, r in enumerate(records):
+            self._pos.setdefault(_key(r.get('id')), i)
+
+    def find(self, records, record_id):
+        key = _key(record_id)
+        if self._of != id(records):
+            self._rebuild(records)
+        i = self._pos.get(key, -1)
+        if i >= 0:
+            stale = i >= len(records) or _key(records[i].get('id')) != key
+        else:
+            stale = self._len != len(records)
+        if stale:
+            self._rebuild(records)
+            i = self._pos.get(key, -1)
+        return i
+
+    def added(self, records, i):
+        if self._of == id(records) and self._len == i:
+            self._pos.setdefault(_key(records[i].get('id')), i)
+            self._len += 1
+
+    def removed(self, records, i, record_id):
+        if self._of != id(records):
+            return
+        if self._pos.get(_key(record_id)) == i:
+            del self._pos[_key(record_id)]
+        for key, j in self._pos.items():
+            if j > i:
+                self._pos[key] = j - 1
+        self._len -= 1
+
+
+def _pack(records):
+    # pickle 保留原本的型別 (與深複製相同)；快照本身就是一份獨立的複本
+    return zlib.compress(pickle.dumps(records, pickle.HIGHEST_PROTOCOL), 1)
+
+
+def _unpack(blob):
+    return pickle.loads(zlib.decompress(blob))
+
+
+def apply_event(records, event, positions=None):
+    """把一筆事件套用到 records (原地修改)；重播時可重複套用 (冪等)
+
+    positions 是這份 records 的 id → 位置對照 (連續套用多筆時傳入，省掉每筆的線性搜尋)。
+    """
+    positions = positions or Positions()
+    i = positions.find(records, event['id'])
+    if event['op'] == 'delete':
+        if i >= 0:
+            records.pop(i)
+            positions.removed(records, i, event['id'])
+    elif i >= 0:
+        records[i].clear()
+        records[i].update(copy.deepcopy(event['after']))
+    else:
+        records.append(copy.deepcopy(event['after']))
+        positions.added(records, len(records) - 1)
+    return records
+
+
+def _inverse(event):
+    """反向事件：add ↔ delete，update 換回修改前的內容"""
+    if event['op'] == 'add':
+        return 'delete', event['after'], None
+    if event['op'] == 'delete':
+        return 'add', None, event['before']
+    return 'update', event['after'], event['before']
+
+
+class Journal:
+    def __init__(self, records=None, snapshot_every=SNAPSHOT_EVERY):
+        self._snapshot = _pack(records or [])
+        self.snapshot_seq = 0
+        self.seq = 0
+        self.tail = []
+        self.undo_stack = deque(maxlen=UNDO_LIMIT)
+        self.redo_stack = deque(maxlen=UNDO_LIMIT)
+        self.snapshot_every = snapshot_every
+        # 日誌代號：整份資料被換掉 (還原備份) 就是新的日誌，seq 從頭算，外部保存據此判斷要不要整份重寫
+        self.epoch = new_id()
+        self._positions = Positions()
+
+    def __getstate__(self):
+        # 位置對照只是快取 (而且對應的是記憶體中的那份 list)，不跟著保存
+        state = dict(self.__dict__)
+        state.pop('_positions', None)
+        return state
+
+    def __setstate__(self, state):
+        # 舊版 session 暫存裡的快照是未壓縮的 records
+        if 'snapshot' in state:
+            state['_snapshot'] = _pack(state.pop('snapshot'))
+        # 舊版的復原堆疊是沒有上限的 list
+        for name in ('undo_stack', 'redo_stack'):
+            state[name] = deque(state.get(name, ()), maxlen=UNDO_LIMIT)
+        self.__dict__.update(state)
+        self._positions = Positions()
+
+    def find(self, records, record_id):
+        """紀錄在 records 中的位置 (找不到為 -1)"""
+        return self._positions.find(records, record_id)
+
+    @property
+    def snapshot(self):
+        """最近一次快照 (每次取用都解壓出一份新的 records)"""
+        return _unpack(self._snapshot)
+
+    # --- 寫入 ---
+    def _emit(self, records, op, record_id, before, after, apply=True, **extra):
+        self.seq += 1
+        event = {'seq': self.seq, 'ts': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                 'op': op, 'id': record_id,
+                 'before': copy.deepcopy(before), 'after': copy.deepcopy(after)}
+        event.update(extra)
+        if apply:
+            apply_event(records, event, self._positions)
+        self.tail.append(event)
+        return event
+
+    def _done(self, events):
+        """新操作完成：整組事件成為一個復原步驟，並清空重做堆疊"""
+        if events:
+            self.undo_stack.append(events)
+            self.redo_stack.clear()
+        return events
+
+    def add(self, records, record):
+        event = self._emit(records, 'add', record['id'], None, record)
+        self._done([event])
+        return event
+
+    def update(self, records, record_id, changes):
+        i = self.find(records, record_id)
+        if i < 0:
+            return None
+        before = records[i]
+        after = dict(before, **changes)
+        event = self._emit(records, 'update', before['id'], before, after)
+        self._done([event])
+        return event
+
+    def delete(self, records, record_id):
+        i = self.find(records, record_id)
+        if i < 0:
+            return None
+        before = records[i]
+        event = self._emit(records, 'delete', before['id'], before, None)
+        self._done([event])
+        return event
+
+    def batch(self, records, updates=None, deletes=None):
+        """一次套用多筆修改 ({id: 欄位變更}) 與刪除 (id 清單)，回傳事件清單
+
+        每筆以位置對照 O(1) 查找，刪除最後一次重建清單。
+        """
+        events = []
+        removed = set()
+        for record_id in deletes or ():
+            i = self.find(records, record_id)
+            if i < 0 or i in removed:
+                continue
+            removed.add(i)
+            events.append(self._emit(records, 'delete', records[i]['id'], records[i], None, apply=False))
+        for record_id, changes in (updates or {}).items():
+            i = self.find(records, record_id)
+            if i < 0 or i in removed:
+                continue
+            after = dict(records[i], **changes)
+            if after == records[i]:
+                continue
+            events.append(self._emit(records, 'update', records[i]['id'], records[i], after, apply=False))
+            records[i].update(changes)
+        if removed:
+            records[:] = [r for i, r in enumerate(records) if i not in removed]
+            self._positions.reset()
+        return self._done(events)
+
+    # --- 復原 / 重做 ---
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self, records):
+        """復原上一步 (批次修改整組復原)，回傳產生的反向事件清單"""
+        if not self.undo_stack:
+            return []
+        group = self.undo_stack.pop()
+        self.redo_stack.append(group)
+        events = []
+        for original in reversed(group):
+            op, before, after = _inverse(original)
+            events.append(self._emit(records, op, original['id'], before, after, undo_of=original['seq']))
+        return events
+
+    def redo(self, records):
+        if not self.redo_stack:
+            return []
+        group = self.redo_stack.pop()
+        events = [self._emit(records, original['op'], original['id'], original['before'],
+                             original['after'], redo_of=original['seq']) for original in group]
+        self.undo_stack.append(events)
+        return events
+
+    # --- 快照與重播 ---
+    def needs_snapshot(self):
+        return len(self.tail) >= self.snapshot_every
+
+    def take_snapshot(self, records):
+        """把目前狀態壓縮成新快照，清空尾端事件 (復原堆疊保留)"""
+        self._snapshot = _pack(records)
+        self.snapshot_seq = self.seq
+        self.tail = []
+
+    def replay(self):
+        """快照 + 尾端事件 → 目前的 records"""
+        records = _unpack(self._snapshot)
+        positions = Positions()
+        for event in self.tail:
+            apply_event(records, event, positions)
+        return records
+
+    @classmethod
+    def restore(cls, snapshot, events, snapshot_every=SNAPSHOT_EVERY):
+        """由外部保存的快照與事件重建日誌 (復原堆疊從零開始)"""
+        journal = cls(snapshot, snapshot_every)
+        journal.tail = sorted(events, key=lambda e: e['seq'])
+        journal.seq = max((e['seq'] for e in journal.tail), default=0)
+        journal.snapshot_seq = journal.tail[0]['seq'] - 1 if journal.tail else 0
+        return journal
+
+
+# ==========================================
+# 試算表 Journal 工作表的列格式
+# ==========================================
+def event_to_row(event):
+    rid = normalize(event['id'])
+    return [event['seq'], event['ts'], event['op'], str(event['id']) if rid is None else rid,
+            json.dumps(event['before'], ensure_ascii=False) if event['before'] is not None else '',
+            json.dumps(event['after'], ensure_ascii=False) if event['after'] is not None else '']
+
+
+def events_from_frame(df):
+    events = []
+    if df is None or df.empty:
+        return events
+    for row in df.dropna(how='all').to_dict('records'):
+        def _load(value):
+            return json.loads(value) if isinstance(value, str) and value else None
+        events.append({'seq': int(row['seq']), 'ts': row.get('ts'), 'op': row['op'],
+                       'id': normalize(row['id']) or str(row['id']), 'before': _load(row.get('before')),
+                       'after': _load(row.get('after'))})
+    return events
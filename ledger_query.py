@@ -0,0 +1,336 @@
+import re
+import shlex
+from bisect import bisect_left, bisect_right
+
+# ==========================================
+# 搜尋框查詢語法 + 排序 / 點陣索引
+# ==========================================
+# 範例：飲食 amount>500 2026-01..2026-03 type:支出
+#   amount>500、金額<=200、amount:100..500   → 金額範圍
+#   2026-01..2026-03、2026-02、2026、date>=2026-01-15 → 日期範圍
+#   type:支出、category:飲食,交通 (中文欄位名 類型: / 分類: 亦可) → 精確比對
+#   其他文字 → 備註或分類包含該字 (數字也會比對金額)
+# 每一列在索引中以「記錄在 records 中的位置」當作位元編號，
+# 各條件各自產生一個點陣 (Python int)，最後以 AND 合併，不逐筆掃描。
+
+QUERY_HELP = "語法：飲食 amount>500 2026-01..2026-03 type:支出 category:飲食,交通"
+
+# 範圍索引切成幾個分桶；查詢時中間分桶直接 OR，只有兩端分桶需要逐筆判斷
+_BUCKETS = 64
+
+_FIELD_ALIASES = {
+    'amount': 'amount', 'amt': 'amount', '金額': 'amount',
+    'date': 'date', '日期': 'date',
+    'type': 'type', '類型': 'type',
+    'category': 'category', 'cat': 'category', '分類': 'category',
+    'note': 'note', '備註': 'note',
+}
+_PERIOD = r"\d{4}(?:-\d{1,2}(?:-\d{1,2})?)?"
+_RANGE_RE = re.compile(rf"^({_PERIOD})?\.\.({_PERIOD})?$")
+_PERIOD_RE = re.compile(rf"^{_PERIOD}$")
+_NUM_RANGE_RE = re.compile(r"^(-?\d+(?:\.\d+)?)?\.\.(-?\d+(?:\.\d+)?)?$")
+_COMPARE_RE = re.compile(r"^([^\s<>=:]+)?(>=|<=|>|<|=)(.+)$")
+_NUMBER_RE = re.compile(r"^-?\d+(?:\.\d+)?$")
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+# 每個位元組值對應的位元位置，解碼點陣時查表
+_BYTE_BITS = [tuple(i for i in range(8) if v >> i & 1) for v in range(256)]
+
+
+def _bits_to_rows(bits):
+    """點陣 → 由小到大的位置清單"""
+    rows = []
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for i, byte in enumerate(data):
+        if byte:
+            base = i << 3
+            rows.extend(base + j for j in _BYTE_BITS[byte])
+    return rows
+
+
+def _rows_to_bits(rows, size):
+    buf = bytearray((size + 7) // 8)
+    for r in rows:
+        buf[r >> 3] |= 1 << (r & 7)
+    return int.from_bytes(bytes(buf), 'little')
+
+
+class RangeIndex:
+    """排序分桶索引：bisect 找出範圍，中間整桶用點陣 OR"""
+
+    def __init__(self, pairs):
+        pairs = sorted(pairs)
+        step = max(1, len(pairs) // _BUCKETS)
+        bounds = []
+        for i in range(0, len(pairs), step):
+            key = pairs[i][0]
+            if not bounds or key > bounds[-1]:
+                bounds.append(key)
+        self.bounds = bounds or [None]
+        self.keys = [[] for _ in self.bounds]
+        self.rows = [[] for _ in self.bounds]
+        # pairs 已排序，依序往後填分桶即可
+        b = 0
+        for key, row in pairs:
+            while b + 1 < len(bounds) and key >= bounds[b + 1]:
+                b += 1
+            self.keys[b].append(key)
+            self.rows[b].append(row)
+        size = max((row for _, row in pairs), default=-1) + 1
+        self.bits = [_rows_to_bits(rows, size) for rows in self.rows]
+
+    def _bucket(self, key):
+        if self.bounds[0] is None:
+            return 0
+        return max(0, bisect_right(self.bounds, key) - 1)
+
+    def add(self, key, row):
+        if self.bounds[0] is None:
+            self.bounds[0] = key
+        b = self._bucket(key)
+        pos = bisect_right(self.keys[b], key)
+        self.keys[b].insert(pos, key)
+        self.rows[b].insert(pos, row)
+        self.bits[b] |= 1 << row
+
+    def between(self, lo=None, hi=None, lo_incl=True, hi_incl=True, size=0):
+        if self.bounds[0] is None:
+            return 0
+        b_lo = 0 if lo is None else self._bucket(lo)
+        b_hi = len(self.bounds) - 1 if hi is None else self._bucket(hi)
+        if b_lo > b_hi:
+            return 0
+        result = 0
+        for b in range(b_lo + 1, b_hi):
+            result |= self.bits[b]
+        edge_rows = []
+        for b in {b_lo, b_hi}:
+            keys = self.keys[b]
+            start = 0 if lo is None else (bisect_left(keys, lo) if lo_incl else bisect_right(keys, lo))
+            end = len(keys) if hi is None else (bisect_right(keys, hi) if hi_incl else bisect_left(keys, hi))
+            if b != b_lo:
+                start = 0
+            if b != b_hi:
+                end = len(keys)
+            if end - start == len(keys):
+                result |= self.bits[b]
+            elif end > start:
+                edge_rows.extend(self.rows[b][start:end])
+        if edge_rows:
+            result |= _rows_to_bits(edge_rows, size)
+        return result
+
+
+class LedgerIndex:
+    """一份 records 的查詢索引；新增紀錄可增量更新 (extend)"""
+
+    def __init__(self, records):
+        self.size = len(records)
+        self.all_bits = (1 << self.size) - 1
+        # 先收集各值的列清單，最後一次轉成點陣 (逐列 OR 大整數會變成平方時間)
+        groups = ({}, {}, {})
+        pairs_date, pairs_amount = [], []
+        for row, r in enumerate(records):
+            for table, key in zip(groups, self._bitmap_keys(r)):
+                table.setdefault(key, []).append(row)
+            d = self._date_key(r)
+            if d:
+                pairs_date.append((d, row))
+            a = self._amount_key(r)
+            if a is not None:
+                pairs_amount.append((a, row))
+        self.by_type, self.by_category, self.by_note = (
+            {key: _rows_to_bits(rows, self.size) for key, rows in table.items()} for table in groups)
+        self._folded = {note: note.casefold() for note in self.by_note}
+        self.date = RangeIndex(pairs_date)
+        self.amount = RangeIndex(pairs_amount)
+
+    @staticmethod
+    def _date_key(r):
+        d = r.get('date')
+        return str(d)[:10] if d is not None and d == d else None
+
+    @staticmethod
+    def _amount_key(r):
+        try:
+            a = float(r.get('amount'))
+        except (TypeError, ValueError):
+            return None
+        return a if a == a else None
+
+    @staticmethod
+    def _bitmap_keys(r):
+        """(類型, 分類, 備註) 的索引鍵；缺值 (None / NaN) 一律視為空字串"""
+        return tuple('' if v is None or v != v else str(v)
+                     for v in (r.get('type'), r.get('category'), r.get('note')))
+
+    def _add_bitmaps(self, row, r):
+        bit = 1 << row
+        for table, key in zip((self.by_type, self.by_category, self.by_note), self._bitmap_keys(r)):
+            table[key] = table.get(key, 0) | bit
+        note = self._bitmap_keys(r)[2]
+        if note not in self._folded:
+            self._folded[note] = note.casefold()
+
+    def extend(self, records):
+        """只補上 records 尾端新增的紀錄"""
+        for row in range(self.size, len(records)):
+            r = records[row]
+            self._add_bitmaps(row, r)
+            d = self._date_key(r)
+            if d:
+                self.date.add(d, row)
+            a = self._amount_key(r)
+            if a is not None:
+                self.amount.add(a, row)
+        self.size = len(records)
+        self.all_bits = (1 << self.size) - 1
+
+    # --- 查詢 ---
+    def search(self, query):
+        """回傳符合查詢的列位置 (依原順序)"""
+        return _bits_to_rows(self.match(parse_query(query)))
+
+    def count(self, query):
+        return _popcount(self.match(parse_query(query)))
+
+    def match(self, conditions):
+        result = self.all_bits
+        for cond in conditions:
+            if not result:
+                break
+            result &= self._eval(cond)
+        return result
+
+    def _eval(self, cond):
+        kind = cond[0]
+        if kind == 'amount':
+            _, lo, hi, lo_incl, hi_incl = cond
+            return self.amount.between(lo, hi, lo_incl, hi_incl, self.size)
+        if kind == 'date':
+            _, lo, hi, lo_incl, hi_incl = cond
+            return self.date.between(lo, hi, lo_incl, hi_incl, self.size)
+        if kind in ('type', 'category'):
+            table = self.by_type if kind == 'type' else self.by_category
+            bits = 0
+            for value in cond[1]:
+                bits |= table.get(value, 0)
+            return bits
+        if kind == 'note':
+            return self._note_bits(cond[1])
+        # 自由文字：備註 / 分類包含，或 (數字時) 金額相等
+        term = cond[1]
+        bits = self._note_bits(term)
+        folded = term.casefold()
+        for value, b in self.by_category.items():
+            if folded in value.casefold():
+                bits |= b
+        bits |= self.by_type.get(term, 0)
+        if _NUMBER_RE.match(term):
+            bits |= self.amount.between(float(term), float(term), size=self.size)
+        return bits
+
+    def _note_bits(self, term):
+        # 只掃描「不重複的備註」，同一句備註的所有列共用一個點陣
+        folded = term.casefold()
+        bits = 0
+        for note, b in self.by_note.items():
+            if folded in self._folded[note]:
+                bits |= b
+        return bits
+
+
+# ==========================================
+# 解析器
+# ==========================================
+def _period_bounds(text):
+    """'2026' / '2026-02' / '2026-02-05' → (起, 迄) 字串"""
+    parts = [int(p) for p in text.split('-')]
+    if len(parts) == 1:
+        return f"{parts[0]:04d}-01-01", f"{parts[0]:04d}-12-31"
+    if len(parts) == 2:
+        return f"{parts[0]:04d}-{parts[1]:02d}-01", f"{parts[0]:04d}-{parts[1]:02d}-31"
+    day = f"{parts[0]:04d}-{parts[1]:02d}-{parts[2]:02d}"
+    return day, day
+
+
+def _tokenize(query):
+    try:
+        return shlex.split(query)
+    except ValueError:
+        return query.split()
+
+
+def parse_query(query):
+    """查詢字串 → 條件清單 [('amount' / 'date', lo, hi, lo_incl, hi_incl), ('type', 值...), ...]"""
+    conditions = []
+    for token in _tokenize(query or ''):
+        cond = _parse_token(token)
+        if cond is not None:
+            conditions.append(cond)
+    return conditions
+
+
+def _parse_token(token):
+    # 日期範圍：2026-01..2026-03 / 2026-01.. / ..2026-03
+    m = _RANGE_RE.match(token)
+    if m and (m.group(1) or m.group(2)):
+        lo = _period_bounds(m.group(1))[0] if m.group(1) else None
+        hi = _period_bounds(m.group(2))[1] if m.group(2) else None
+        return ('date', lo, hi, True, True)
+    # 單一期間：2026 / 2026-02 / 2026-02-05 (純四位數視為年份)
+    if _PERIOD_RE.match(token) and ('-' in token or len(token) == 4 and token.startswith(('19', '20'))):
+        lo, hi = _period_bounds(token)
+        return ('date', lo, hi, True, True)
+
+    # 欄位:值
+    if ':' in token:
+        name, _, value = token.partition(':')
+        field = _FIELD_ALIASES.get(name.casefold())
+        if field and value:
+            return _parse_field(field, value)
+
+    # 比較運算：amount>500 / 金額<=200 / date>=2026-01-15 / >500
+    m = _COMPARE_RE.match(token)
+    if m:
+        field = _FIELD_ALIASES.get((m.group(1) or 'amount').casefold())
+        op, value = m.group(2), m.group(3)
+        if field == 'amount' and _NUMBER_RE.match(value):
+            lo = hi = float(value)
+        elif field == 'date' and _PERIOD_RE.match(value):
+            lo, hi = _period_bounds(value)
+        else:
+            return ('text', token)
+        return {
+            '>': (field, hi, None, False, True),
+            '>=': (field, lo, None, True, True),
+            '<': (field, None, lo, True, False),
+            '<=': (field, None, hi, True, True),
+            '=': (field, lo, hi, True, True),
+        }[op]
+    return ('text', token)
+
+
+def _parse_field(field, value):
+    if field == 'amount':
+        m = _NUM_RANGE_RE.match(value)
+        if m and (m.group(1) or m.group(2)):
+            lo = float(m.group(1)) if m.group(1) else None
+            hi = float(m.group(2)) if m.group(2) else None
+            return ('amount', lo, hi, True, True)
+        if _NUMBER_RE.match(value):
+            return ('amount', float(value), float(value), True, True)
+    elif field == 'date':
+        cond = _parse_token(value)
+        if cond and cond[0] == 'date':
+            return cond
+    elif field in ('type', 'category'):
+        return (field, tuple(v for v in value.split(',') if v))
+    elif field == 'note':
+        return ('note', value)
+    return ('text', value)
+
@@ -0,0 +1,233 @@
+import json
+import calendar
+from datetime import date, timedelta
+
+import pandas as pd
+
+import ledger_rollup
+
+# ==========================================
+# 固定收支 (訂閱、薪水、瓦斯…)：只存規則，需要時才展開
+# ==========================================
+# 一條規則 = {'rule_id', 'type', 'category', 'amount', 'note',
+#             'freq': monthly|weekly|yearly, 'start', 'until', 'overrides'}
+# 不預先產生每一期的紀錄；分析頁要看哪一段期間，就只展開那一段。
+# 使用者對某一期的修改 (改金額 / 略過) 存在規則的 overrides：
+#   {'YYYY-MM-DD': {'skip': True}} 或 {'YYYY-MM-DD': {'amount': 899, 'note': '漲價'}}
+# 所以儲存與同步的大小只跟規則數量有關，跟展開了幾期無關。
+#
+# 目前只有 app5 使用：規則存在試算表的 Recurring 工作表，各期併入 Summary 彙總後給分析頁。
+# app2 / app3 的資料只存在 JSON 備份與瀏覽器保存 (都是紀錄清單)，沒有地方保存規則；
+# app4 只有 Sheet1 + Journal，分析頁直接由明細計算，也沒有彙總可以併入。
+
+FREQS = {'monthly': "每月", 'weekly': "每週", 'yearly': "每年"}
+RULE_COLUMNS = ['rule_id', 'type', 'category', 'amount', 'note', 'freq', 'start', 'until', 'overrides']
+
+
+def _date(value):
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def _add_months(d, months, day):
+    """往後 months 個月的同一天 (該月沒有這一天時取月底，例如 1/31 → 2/28)"""
+    y, m = divmod(d.month - 1 + months, 12)
+    y, m = d.year + y, m + 1
+    return date(y, m, min(day, calendar.monthrange(y, m)[1]))
+
+
+def occurrences(rule, start, end):
+    """規則在 [start, end] 期間內的每一期日期 (只算這段期間，不從頭列舉)"""
+    first = _date(rule.get('start'))
+    if first is None:
+        return []
+    until = _date(rule.get('until')) or end
+    lo, hi = max(first, start), min(until, end)
+    if lo > hi:
+        return []
+    freq = rule.get('freq', 'monthly')
+    if freq == 'weekly':
+        # 直接跳到期間內的第一期
+        d = first + timedelta(days=-(-(lo - first).days // 7) * 7)
+        dates = []
+        while d <= hi:
+            dates.append(d)
+            d += timedelta(days=7)
+        return dates
+    step = 12 if freq == 'yearly' else 1
+    k = max(0, ((lo.year - first.year) * 12 + lo.month - first.month) // step - 1)
+    dates = []
+    while True:
+        d = _add_months(first, k * step, first.day)
+        if d > hi:
+            return dates
+        if d >= lo:
+            dates.append(d)
+        k += 1
+
+
+def expand(rules, start, end):
+    """展開成與一般紀錄相同格式的 dict (套用 overrides，略過的期數不列)"""
+    rows = []
+    for rule in rules:
+        overrides = rule.get('overrides') or {}
+        for d in occurrences(rule, start, end):
+            key = d.isoformat()
+            change = overrides.get(key) or {}
+            if change.get('skip'):
+                continue
+            rows.append({'id': f"R{rule['rule_id']}:{key}", 'date': key, 'type': rule['type'],
+                         'amount': float(change.get('amount', rule['amount'])), 'category': rule['category'],
+                         'note': change.get('note', rule.get('note', '')), 'rule_id': rule['rule_id']})
+    return rows
+
+
+def first_date(rules):
+    starts = [d for d in (_date(r.get('start')) for r in rules) if d is not None]
+    return min(starts) if starts else None
+
+
+def visible_window(rollup, today=None):
+    """分析頁看得到的期間：帳本最早的月份 (至少涵蓋今年的年度報告) 到今天"""
+    today = today or date.today()
+    start = date(today.year, 1, 1)
+    first = _date(f"{min(m for m, _, _ in rollup)}-01") if rollup else None
+    return min(start, first) if first else start, today
+
+
+def _expanded(rules, start, end, cache):
+    """規則在 [start, end] 的各期彙總；規則與期間都沒變時直接用 cache 裡上次的結果"""
+    key = (json.dumps(rules, ensure_ascii=False, sort_keys=True), start, end)
+    if cache is not None and cache.get('key') == key:
+        return cache['cells']
+    cells = ledger_rollup.build_rollup(expand(rules, start, end))
+    if cache is not None:
+        cache['key'], cache['cells'] = key, cells
+    return cells
+
+
+def with_rollup(rollup, rules, end=None, start=None, cache=None):
+    """彙總表 + 規則在 [start, end] 的各期 → 新的彙總 dict (原彙總不修改)
+
+    end 預設今天、start 預設為最早的規則起始日；分析頁應傳入 visible_window，
+    只展開看得到的期間。cache (例如 session_state 裡的 dict) 保存上次展開的結果。
+    """
+    end = end or date.today()
+    start = start or first_date(rules)
+    if start is None or not rules:
+        return rollup
+    merged = {key: list(cell) for key, cell in rollup.items()}
+    for key, (amount, count) in _expanded(rules, start, end, cache).items():
+        cell = merged.setdefault(key, [0.0, 0])
+        cell[0] += amount
+        cell[1] += count
+    return merged
+
+
+# --- 規則維護 ---
+def new_rule(rule_id, r_type, category, amount, note, freq, start, until=None):
+    return {'rule_id': rule_id, 'type': r_type, 'category': category, 'amount': float(amount), 'note': note,
+            'freq': freq, 'start': start.isoformat(), 'until': until.isoformat() if until else '', 'overrides': {}}
+
+
+def set_override(rule, day, amount=None, note=None, skip=False):
+    """修改 / 略過某一期；改回跟規則一樣時移除 override，避免越存越多"""
+    key = day.isoformat() if isinstance(day, date) else str(day)[:10]
+    overrides = rule.setdefault('overrides', {})
+    change = {}
+    if skip:
+        change['skip'] = True
+    else:
+        if amount is not None and float(amount) != float(rule['amount']):
+            change['amount'] = float(amount)
+        if note is not None and note != rule.get('note', ''):
+            change['note'] = note
+    if change:
+        overrides[key] = change
+    else:
+        overrides.pop(key, None)
+    return rule
+
+
+# --- 試算表 Recurring 工作表的列格式 ---
+def rules_to_frame(rules):
+    rows = [dict(r, overrides=json.dumps(r.get('overrides') or {}, ensure_ascii=False, sort_keys=True)) for r in rules]
+    return pd.DataFrame(rows, columns=RULE_COLUMNS)
+
+
+def rules_from_frame(df):
+    rules = []
+    if df is None or df.empty:
+        return rules
+    for row in df.dropna(how='all').to_dict('records'):
+        overrides = row.get('overrides')
+        until = row.get('until')
+        rules.append({'rule_id': int(row['rule_id']), 'type': str(row['type']), 'category': str(row['category']),
+                      'amount': float(row['amount']), 'note': '' if pd.isna(row.get('note')) else str(row['note']),
+                      'freq': row.get('freq') if row.get('freq') in FREQS else 'monthly',
+                      'start': str(row['start'])[:10], 'until': '' if pd.isna(until) else str(until)[:10],
+                      'overrides': json.loads(overrides) if isinstance(overrides, str) and overrides else {}})
+    return rules
+
+
+def describe(rule):
+    until = f" ~ {rule['until']}" if rule.get('until') else ""
+    return (f"{FREQS.get(rule['freq'], rule['freq'])} {rule['type']} {rule['category']} ${rule['amount']:,.0f}"
+            f" ({rule['start']} 起{until}){' · ' + rule['note'] if rule.get('note') else ''}")
+
+
+def render_rules(rules, categories, new_id, today=None, key="recurring"):
+    """固定收支的設定區塊；有異動時回傳新的規則清單，否則回傳 None"""
+    import copy
+    import streamlit as st
+    today = today or date.today()
+    rules = copy.deepcopy(rules)
+
+    st.markdown("**➕ 新增固定收支**")
+    # 類型放在表單外，切換時分類選項才會跟著更新
+    r_type = st.radio("類型", ["支出", "收入"], horizontal=True, key=f"{key}_type")
+    with st.form(f"{key}_form", clear_on_submit=True):
+        c1, c2 = st.columns(2)
+        category = c1.selectbox("分類", categories[r_type], key=f"{key}_category")
+        amount = c2.number_input("金額", min_value=0.0, step=10.0, key=f"{key}_amount")
+        c3, c4, c5 = st.columns(3)
+        freq = c3.selectbox("頻率", list(FREQS), format_func=FREQS.get, key=f"{key}_freq")
+        start = c4.date_input("第一期日期", today, key=f"{key}_start")
+        note = c5.text_input("備註", key=f"{key}_note")
+        if st.form_submit_button("🔁 新增規則", use_container_width=True) and amount > 0:
+            rules.append(new_rule(new_id(), r_type, category, amount, note, freq, start))
+            return rules
+
+    if not rules:
+        st.caption("尚未設定固定收支")
+        return None
+    labels = {r['rule_id']: describe(r) for r in rules}
+    chosen = st.selectbox("已設定的規則", list(labels), format_func=labels.get, key=f"{key}_chosen")
+    rule = next(r for r in rules if r['rule_id'] == chosen)
+
+    # 只展開最近一年 + 未來三個月給使用者調整單期
+    window = occurrences(rule, today - timedelta(days=365), today + timedelta(days=92))
+    if window:
+        overrides = rule.get('overrides') or {}
+        grid = pd.DataFrame({
+            '日期': [d.isoformat() for d in window],
+            '金額': [float((overrides.get(d.isoformat()) or {}).get('amount', rule['amount'])) for d in window],
+            '備註': [(overrides.get(d.isoformat()) or {}).get('note', rule.get('note', '')) for d in window],
+            '略過': [bool((overrides.get(d.isoformat()) or {}).get('skip')) for d in window],
+        })
+        edited = st.data_editor(grid, key=f"{key}_grid_{chosen}_{len(overrides)}", hide_index=True,
+                                use_container_width=True, disabled=['日期'],
+                                column_config={'金額': st.column_config.NumberColumn(min_value=0.0, format="%.0f")})
+    b1, b2, b3 = st.columns(3)
+    if window and b1.button("💾 儲存單期調整", key=f"{key}_save", use_container_width=True):
+        for row in edited.itertuples(index=False):
+            set_override(rule, row[0], amount=row[1], note=row[2], skip=bool(row[3]))
+        return rules
+    if not rule.get('until') and b2.button("⏹️ 從今天起停止", key=f"{key}_stop", use_container_width=True):
+        rule['until'] = today.isoformat()
+        return rules
+    if b3.button("🗑️ 刪除規則", key=f"{key}_delete", use_container_width=True):
+        return [r for r in rules if r['rule_id'] != chosen]
+    return None
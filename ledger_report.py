@@ -0,0 +1,128 @@
+"""批次產生帳本報表 (不需啟動 Streamlit)
+
+用法：
+    python ledger_report.py 備份資料夾/ 另一本.csv --out reports/ --month 2026-09
+    python ledger_report.py "backups/*.json" --workers 8 --format json
+
+每本帳本各輸出一份報表 (xlsx / json)，輸出資料夾保留帳本相對於共同資料夾的
+子資料夾結構 (不同資料夾的同名帳本不會互相覆蓋；只差在副檔名時報表名稱加上副檔名)，
+另外在輸出資料夾寫一份所有帳本的 summary.csv。帳本分配到多個行程平行處理，預設使用全部 CPU 核心。
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import ledger_engine
+
+LEDGER_EXTENSIONS = ('.json', '.csv', '.parquet', '.pq')
+
+
+def find_ledgers(paths):
+    """展開資料夾與萬用字元，回傳排序過、不重複的帳本檔案 (同一個檔案的不同寫法只算一次)"""
+    found = {}
+    for path in paths:
+        matches = glob.glob(path) or [path]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, _, files in os.walk(match):
+                    for f in files:
+                        if f.lower().endswith(LEDGER_EXTENSIONS):
+                            found.setdefault(os.path.abspath(os.path.join(root, f)), os.path.join(root, f))
+            elif match.lower().endswith(LEDGER_EXTENSIONS):
+                found.setdefault(os.path.abspath(match), match)
+    return sorted(found.values())
+
+
+def report_names(ledgers):
+    """每本帳本的報表名稱 {路徑: 相對名稱}：相對於所有帳本共同資料夾的路徑 (不含副檔名)，
+    只差在副檔名的帳本 (a.json / a.csv) 保留副檔名；仍然重複時拒絕執行，不互相覆蓋"""
+    if not ledgers:
+        return {}
+    base = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in ledgers])
+    names = {p: os.path.splitext(os.path.relpath(os.path.abspath(p), base))[0] for p in ledgers}
+    counts = Counter(names.values())
+    names = {p: f"{n}_{os.path.splitext(p)[1].lstrip('.')}" if counts[n] > 1 else n for p, n in names.items()}
+    dupes = [n for n, c in Counter(names.values()).items() if c > 1]
+    if dupes:
+        raise ValueError(f"報表名稱重複，請分批執行：{', '.join(sorted(dupes))}")
+    return names
+
+
+def process_ledger(job):
+    """子行程：讀取一本帳本、產生報表並寫檔，只回傳一列摘要給主行程"""
+    path, name, out_dir, month, fmt = job
+    row = {'ledger': name, 'path': path}
+    t0 = time.perf_counter()
+    try:
+        records = ledger_engine.read_ledger(path)
+        overview, sheets = ledger_engine.report(records, month)
+        out_path = os.path.join(out_dir, f"{name}_report.{fmt}")
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        if fmt == 'xlsx':
+            data = ledger_engine.export_excel(sheets={'總覽': pd.DataFrame([overview]), **sheets})
+            with open(out_path, 'wb') as f:
+                f.write(data)
+        else:
+            payload = {'overview': overview,
+                       'sheets': {k: json.loads(v.to_json(orient='records', force_ascii=False)) for k, v in sheets.items()}}
+            with open(out_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False, indent=2)
+        row.update(overview, status='ok', report=out_path)
+    except Exception as e:
+        row.update(status='error', error=f"{type(e).__name__}: {e}")
+    row['seconds'] = round(time.perf_counter() - t0, 3)
+    return row
+
+
+def run(paths, out_dir, month=None, fmt='xlsx', workers=None):
+    ledgers = find_ledgers(paths)
+    names = report_names(ledgers)
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(path, names[path], out_dir, month, fmt) for path in ledgers]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+    if workers == 1:
+        rows = [process_ledger(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # 帳本很多時一次分一批給子行程，減少來回傳遞的開銷
+            rows = list(pool.map(process_ledger, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    summary = pd.DataFrame(rows)
+    if not summary.empty:
+        summary.to_csv(os.path.join(out_dir, 'summary.csv'), index=False, encoding='utf-8-sig')
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批次產生帳本報表 (JSON / CSV / Parquet)")
+    parser.add_argument('paths', nargs='+', help="帳本檔案、資料夾或萬用字元")
+    parser.add_argument('--out', default='reports', help="輸出資料夾 (預設 reports/)")
+    parser.add_argument('--month', help="只統計某個月份的收支與分類，例如 2026-09")
+    parser.add_argument('--format', choices=['xlsx', 'json'], default='xlsx', help="每本帳本的報表格式")
+    parser.add_argument('--workers', type=int, help="平行行程數 (預設為 CPU 核心數)")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    try:
+        summary = run(args.paths, args.out, args.month, args.format, args.workers)
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    if summary.empty:
+        print("找不到任何帳本檔案")
+        return 1
+    failed = summary[summary['status'] != 'ok']
+    print(f"完成 {len(summary) - len(failed)} / {len(summary)} 本帳本，耗時 {time.perf_counter() - t0:.1f} 秒 → {args.out}")
+    for _, row in failed.iterrows():
+        print(f"  ❌ {row['path']}: {row['error']}", file=sys.stderr)
+    return 1 if len(failed) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import pandas as pd
+
+# ==========================================
+# 月份 × 類型 × 分類 的預先彙總 (Summary 工作表)
+# ==========================================
+# 分析頁只需要這些彙總值，不必每次都把原始明細整份讀回來。
+# 彙總以 dict 保存：{(月份, 類型, 分類): [金額合計, 筆數]}，
+# 每次新增 / 修改 / 刪除只對受影響的一格做加減。
+
+ROLLUP_COLUMNS = ['month', 'type', 'category', 'amount', 'count']
+
+
+def _key(record):
+    month = str(record.get('date', ''))[:7]
+    return (month, str(record.get('type', '')), str(record.get('category', '')))
+
+
+def amount_of(record):
+    """紀錄的金額 (空白、非數字或 NaN 視為 0)"""
+    try:
+        value = float(record.get('amount', 0))
+    except (TypeError, ValueError):
+        return 0.0
+    return value if value == value else 0.0
+
+
+def build_rollup(records):
+    """由原始明細整份重建彙總"""
+    rollup = {}
+    for r in records:
+        cell = rollup.setdefault(_key(r), [0.0, 0])
+        cell[0] += amount_of(r)
+        cell[1] += 1
+    return rollup
+
+
+def apply_change(rollup, old=None, new=None):
+    """增量更新：扣掉舊紀錄、加上新紀錄 (新增時 old=None，刪除時 new=None)"""
+    if old is not None:
+        key = _key(old)
+        cell = rollup.get(key)
+        if cell is not None:
+            cell[0] -= amount_of(old)
+            cell[1] -= 1
+            if cell[1] <= 0:
+                del rollup[key]
+    if new is not None:
+        cell = rollup.setdefault(_key(new), [0.0, 0])
+        cell[0] += amount_of(new)
+        cell[1] += 1
+    return rollup
+
+
+def to_frame(rollup):
+    rows = [(m, t, c, round(amt, 2), n) for (m, t, c), (amt, n) in sorted(rollup.items())]
+    return pd.DataFrame(rows, columns=ROLLUP_COLUMNS)
+
+
+def from_frame(df):
+    rollup = {}
+    if df is None or df.empty:
+        return rollup
+    df = df.dropna(how='all')
+    for m, t, c, amt, n in df[ROLLUP_COLUMNS].itertuples(index=False):
+        rollup[(str(m), str(t), str(c))] = [float(amt), int(n)]
+    return rollup
+
+
+# --- 分析頁用的查詢 ---
+def months(rollup):
+    return sorted({m for m, _, _ in rollup}, reverse=True)
+
+
+def total(rollup, r_type, month=None, year=None):
+    return sum(amt for (m, t, _), (amt, _) in rollup.items()
+               if t == r_type and (month is None or m == month) and (year is None or m.startswith(str(year))))
+
+
+def by_category(rollup, r_type, month=None):
+    """某類型 (可限定月份) 各分類的金額合計"""
+    sums = {}
+    for (m, t, c), (amt, _) in rollup.items():
+        if t == r_type and (month is None or m == month):
+            sums[c] = sums.get(c, 0.0) + amt
+    return pd.DataFrame(sorted(sums.items()), columns=['category', 'amount'])
+
+
+def by_month_type(rollup):
+    """各月份收入 / 支出合計 (給趨勢長條圖與累計曲線用)"""
+    sums = {}
+    for (m, t, _), (amt, _) in rollup.items():
+        sums[(m, t)] = sums.get((m, t), 0.0) + amt
+    return pd.DataFrame([(m, t, amt) for (m, t), amt in sorted(sums.items())],
+                        columns=['month_key', 'type', 'amount'])
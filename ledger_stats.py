@@ -0,0 +1,222 @@
+from datetime import date, timedelta
+
+import pandas as pd
+
+from ledger_rollup import amount_of
+
+# ==========================================
+# 近 7 / 30 / 90 天滾動統計 + 異常金額標記
+# ==========================================
+# 每個 (類型, 分類) 保存三個數字 [筆數, 金額和, 金額平方和]，
+# 平均與變異數都由它們算出，所以新增 / 修改 / 刪除只需對應的加減 (O(1))。
+# 載入或還原整份資料時才用 pandas 一次重建；跨日時只移出過期的那幾天。
+
+WINDOWS = (7, 30, 90)
+# 與同分類其他紀錄相比超過幾個標準差算異常
+Z_THRESHOLD = 3.0
+# 同分類至少要有這麼多筆其他紀錄才判斷，避免資料太少時亂標
+MIN_SAMPLES = 8
+
+
+def _date(value):
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def _key(record):
+    return (str(record.get('type', '')), str(record.get('category', '')))
+
+
+def _bump(table, key, n, s, s2):
+    cell = table.get(key)
+    if cell is None:
+        cell = table[key] = [0, 0.0, 0.0]
+    cell[0] += n
+    cell[1] += s
+    cell[2] += s2
+    if cell[0] <= 0:
+        del table[key]
+
+
+def _moments(cell):
+    """[筆數, 和, 平方和] → (筆數, 平均, 標準差)"""
+    n, s, s2 = cell
+    if n <= 0:
+        return 0, 0.0, 0.0
+    mean = s / n
+    var = (s2 - n * mean * mean) / (n - 1) if n > 1 else 0.0
+    return n, mean, max(var, 0.0) ** 0.5
+
+
+class RollingStats:
+    def __init__(self, today=None):
+        self.today = today or date.today()
+        self.daily = {}                          # 日期 → {(類型, 分類): [n, s, s2]}
+        self.windows = {w: {} for w in WINDOWS}  # 天數 → {(類型, 分類): [n, s, s2]}
+        self.overall = {}                        # 全部期間，作為異常判斷的基準
+
+    # --- 整份重建 (向量化) ---
+    @classmethod
+    def from_records(cls, records, today=None):
+        stats = cls(today)
+        df = pd.DataFrame(records)
+        if df.empty or 'date' not in df:
+            return stats
+        df = pd.DataFrame({
+            'd': pd.to_datetime(df['date'].astype(str).str[:10], errors='coerce').dt.date,
+            'type': df['type'].astype(str),
+            'category': df['category'].astype(str),
+            'x': pd.to_numeric(df['amount'], errors='coerce').fillna(0.0),
+        }).dropna(subset=['d'])
+        df['x2'] = df['x'] * df['x']
+
+        def _cells(frame, by):
+            g = frame.groupby(by, sort=False).agg(n=('x', 'size'), s=('x', 'sum'), s2=('x2', 'sum'))
+            return {k: [int(n), float(s), float(s2)] for k, n, s, s2 in g.itertuples()}
+
+        for (d, t, c), cell in _cells(df, ['d', 'type', 'category']).items():
+            stats.daily.setdefault(d, {})[(t, c)] = cell
+        stats.overall = _cells(df, ['type', 'category'])
+        for w in WINDOWS:
+            lo = stats.today - timedelta(days=w)
+            stats.windows[w] = _cells(df[(df['d'] > lo) & (df['d'] <= stats.today)], ['type', 'category'])
+        return stats
+
+    # --- 增量更新 (O(1)) ---
+    def _apply(self, record, sign):
+        d = _date(record.get('date'))
+        if d is None:
+            return
+        key = _key(record)
+        x = amount_of(record)
+        delta = (sign, sign * x, sign * x * x)
+        day = self.daily.setdefault(d, {})
+        _bump(day, key, *delta)
+        if not day:
+            del self.daily[d]
+        _bump(self.overall, key, *delta)
+        for w in WINDOWS:
+            if self.today - timedelta(days=w) < d <= self.today:
+                _bump(self.windows[w], key, *delta)
+
+    def add(self, record):
+        self._apply(record, 1)
+
+    def remove(self, record):
+        self._apply(record, -1)
+
+    def add_baseline(self, cells):
+        """併入不在明細裡的紀錄摘要 {(類型, 分類): [n, s, s2]} (例如封存月份)，只影響異常判斷的基準"""
+        for key, cell in cells.items():
+            _bump(self.overall, key, *cell)
+        return self
+
+    def apply_change(self, old=None, new=None):
+        """與 ledger_rollup.apply_change 相同用法：新增時 old=None，刪除時 new=None"""
+        if old is not None:
+            self.remove(old)
+        if new is not None:
+            self.add(new)
+        return self
+
+    def advance(self, today=None):
+        """跨日時把移出視窗的日子扣掉、移入的日子 (先前記的未來日期) 加上"""
+        today = today or date.today()
+        if today <= self.today:
+            return self
+        if (today - self.today).days > max(WINDOWS):
+            self.today = today
+            for w in WINDOWS:
+                self.windows[w] = {}
+                lo = today - timedelta(days=w)
+                for d, cells in self.daily.items():
+                    if lo < d <= today:
+                        for key, cell in cells.items():
+                            _bump(self.windows[w], key, *cell)
+            return self
+        while self.today < today:
+            self.today += timedelta(days=1)
+            entering = self.daily.get(self.today, {})
+            for w in WINDOWS:
+                leaving = self.daily.get(self.today - timedelta(days=w), {})
+                for key, (n, s, s2) in leaving.items():
+                    _bump(self.windows[w], key, -n, -s, -s2)
+                for key, cell in entering.items():
+                    _bump(self.windows[w], key, *cell)
+        return self
+
+    # --- 查詢 ---
+    def total(self, window, r_type='支出'):
+        return sum((s for (t, _), (_, s, _) in self.windows[window].items() if t == r_type), 0.0)
+
+    def window_frame(self, window, r_type='支出'):
+        """某個視窗內各分類的合計、筆數、平均、標準差與日均"""
+        rows = []
+        for (t, c), cell in self.windows[window].items():
+            if t != r_type:
+                continue
+            n, mean, std = _moments(cell)
+            rows.append({'分類': c, '合計': round(cell[1]), '筆數': n, '平均每筆': round(mean),
+                         '標準差': round(std), '日均': round(cell[1] / window)})
+        df = pd.DataFrame(rows, columns=['分類', '合計', '筆數', '平均每筆', '標準差', '日均'])
+        return df.sort_values('合計', ascending=False, ignore_index=True)
+
+    def zscore(self, record):
+        """與同分類「其他」紀錄相比的 z 分數 (扣掉自己，O(1))；樣本不足回傳 None"""
+        cell = self.overall.get(_key(record))
+        if cell is None:
+            return None
+        x = amount_of(record)
+        n, mean, std = _moments([cell[0] - 1, cell[1] - x, cell[2] - x * x])
+        if n < MIN_SAMPLES or std <= 0:
+            return None
+        return (x - mean) / std
+
+    def flag(self, df):
+        """對一張明細表 (可以是篩選後的子集) 向量化算出 z 分數，樣本不足為 NaN"""
+        if df.empty:
+            return pd.Series(dtype=float, index=df.index)
+        base = pd.DataFrame([(t, c, n, s, s2) for (t, c), (n, s, s2) in self.overall.items()],
+                            columns=['type', 'category', 'n', 's', 's2'])
+        keys = pd.DataFrame({'type': df['type'].astype(str), 'category': df['category'].astype(str)})
+        m = keys.merge(base, on=['type', 'category'], how='left')
+        m.index = df.index
+        x = pd.to_numeric(df['amount'], errors='coerce').fillna(0.0)
+        n = m['n'] - 1
+        mean = (m['s'] - x) / n
+        var = ((m['s2'] - x * x) - n * mean * mean) / (n - 1)
+        std = var.clip(lower=0) ** 0.5
+        z = (x - mean) / std
+        return z.where((n >= MIN_SAMPLES) & (std > 0))
+
+
+def is_anomaly(z):
+    return z is not None and z == z and abs(z) >= Z_THRESHOLD
+
+
+def anomaly_note(z):
+    """明細列上的標記文字"""
+    return f"⚠️ 異常金額 (比同分類平常{'高' if z > 0 else '低'} {abs(z):.1f} 個標準差)"
+
+
+def render_trends(stats, r_type='支出'):
+    """分析頁的近期趨勢區塊"""
+    import streamlit as st
+    st.subheader("📈 近期支出趨勢")
+    base = stats.total(90, r_type) / 90
+    cols = st.columns(len(WINDOWS))
+    for col, w in zip(cols, WINDOWS):
+        total = stats.total(w, r_type)
+        delta = f"日均 ${total / w:,.0f}"
+        if w != 90 and base > 0:
+            delta += f" ({(total / w / base - 1) * 100:+.0f}% vs 90 天)"
+        col.metric(f"近 {w} 天支出", f"${total:,.0f}", delta=delta,
+                   delta_color="inverse" if w != 90 else "off")
+    w = st.radio("統計區間", WINDOWS, index=1, format_func=lambda w: f"近 {w} 天", horizontal=True, key="rolling_window")
+    table = stats.window_frame(w, r_type)
+    if table.empty:
+        st.info(f"近 {w} 天沒有支出紀錄")
+    else:
+        st.dataframe(table, hide_index=True, use_container_width=True)
@@ -0,0 +1,277 @@
+import heapq
+from datetime import date
+
+import pandas as pd
+
+# ==========================================
+# 備註自動完成 (前綴樹) + 依備註預測分類
+# ==========================================
+# 每種收支類型一棵前綴樹，節點上直接存「這個前綴底下分數最高的幾個備註」，
+# 查詢只要沿著輸入的字走到節點、取出快取，與歷史筆數無關 (10 萬筆也在 0.1 ms 內)。
+# 分數 = 每次使用的權重加總，權重隨日期以半衰期成長 (越近期的一筆越重)，
+# 所以同時反映常用程度與最近是否還在用；所有備註用同一把尺，不必隨時間重算。
+# 新增只會讓分數變大，沿路更新快取即可；刪除 / 修改讓分數變小時，
+# 若快取外還有別的備註可能超越，只把節點標記起來，下次查到時再從子樹重算。
+
+# 這麼多天前的一筆，權重只有今天的一半
+HALF_LIFE_DAYS = 90
+# 每個節點快取的建議數
+TOP_K = 8
+_EPOCH = date(2000, 1, 1)
+
+
+def normalize(note):
+    """比對用的 key：去掉多餘空白、不分大小寫 (Netflix = netflix)"""
+    return ' '.join(str(note or '').split()).casefold()
+
+
+def _weight(value):
+    try:
+        d = date.fromisoformat(str(value)[:10])
+    except ValueError:
+        d = _EPOCH
+    return 2.0 ** ((d - _EPOCH).days / HALF_LIFE_DAYS)
+
+
+class _Node:
+    __slots__ = ('children', 'terminal', 'top', 'truncated', 'dirty')
+
+    def __init__(self):
+        self.children = {}
+        self.terminal = False
+        self.top = []            # 分數由高到低的備註 key
+        self.truncated = False   # 子樹裡還有沒放進快取的備註
+        self.dirty = False       # 快取可能過時，查詢時重算
+
+
+class NoteTrie:
+    def __init__(self):
+        self.root = _Node()
+        self.scores = {}
+
+    def _path(self, key):
+        node = self.root
+        yield node
+        for ch in key:
+            node = node.children.get(ch)
+            if node is None:
+                return
+            yield node
+
+    def raise_score(self, key, score):
+        """分數變大 (或新的備註)：沿路把它排進各節點的快取"""
+        self.scores[key] = score
+        node = self.root
+        self._offer(node, key, score)
+        for ch in key:
+            child = node.children.get(ch)
+            if child is None:
+                child = node.children[ch] = _Node()
+            node = child
+            self._offer(node, key, score)
+        node.terminal = True
+
+    def _offer(self, node, key, score):
+        top = node.top
+        if key in top:
+            top.sort(key=self.scores.__getitem__, reverse=True)
+        elif len(top) < TOP_K:
+            top.append(key)
+            top.sort(key=self.scores.__getitem__, reverse=True)
+        else:
+            node.truncated = True
+            if score > self.scores[top[-1]]:
+                top[-1] = key
+                top.sort(key=self.scores.__getitem__, reverse=True)
+
+    def lower_score(self, key, score):
+        """分數變小；score <= 0 代表這個備註已不存在"""
+        if key not in self.scores:
+            return
+        if score > 0:
+            self.scores[key] = score
+        else:
+            del self.scores[key]
+        nodes = list(self._path(key))
+        for node in nodes:
+            if key not in node.top:
+                continue
+            if score <= 0:
+                # 已刪除的 key 一定要從快取拿掉 (之後排序會查它的分數)；空出的位置查詢時再補
+                node.top.remove(key)
+                if node.truncated:
+                    node.dirty = True
+            elif node.truncated:
+                node.dirty = True
+            else:
+                node.top.sort(key=self.scores.__getitem__, reverse=True)
+        if score <= 0 and len(nodes) == len(key) + 1:
+            nodes[-1].terminal = False
+
+    def _rebuild(self, node, prefix):
+        keys = []
+        stack = [(node, prefix)]
+        while stack:
+            n, p = stack.pop()
+            if n.terminal and p in self.scores:
+                keys.append(p)
+            stack.extend((c, p + ch) for ch, c in n.children.items())
+        node.top = heapq.nlargest(TOP_K, keys, key=self.scores.__getitem__)
+        node.truncated = len(keys) > TOP_K
+        node.dirty = False
+
+    def top(self, prefix):
+        node = self.root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        if node.dirty:
+            self._rebuild(node, prefix)
+        return node.top
+
+
+class NoteIndex:
+    """各收支類型的備註前綴樹 + 每個備註用過的分類 (同樣以時間加權)"""
+
+    def __init__(self):
+        self.tries = {}
+        self.notes = {}   # (類型, key) → {'text': 最近一次的寫法, 'count': 筆數, 'score': 分數, 'cats': {分類: 分數}}
+
+    # --- 整份重建 (向量化彙總後依分數由高到低插入，節點快取滿了就不再變動) ---
+    @classmethod
+    def from_records(cls, records):
+        index = cls()
+        df = pd.DataFrame(records)
+        if df.empty or 'note' not in df:
+            return index
+        df = pd.DataFrame({
+            'type': df['type'].astype(str), 'category': df['category'].astype(str),
+            'text': df['note'].fillna('').astype(str).str.strip(),
+            'date': df['date'].astype(str).str[:10],
+        })
+        # 相同的備註很多，只正規化不重複的寫法
+        df['key'] = df['text'].map({text: normalize(text) for text in df['text'].unique()})
+        df = df[df['key'] != ''].sort_values('date', kind='stable')
+        if df.empty:
+            return index
+        df['w'] = 2.0 ** ((pd.to_datetime(df['date'], errors='coerce') - pd.Timestamp(_EPOCH)).dt.days
+                          .fillna(0) / HALF_LIFE_DAYS)
+        notes = df.groupby(['type', 'key']).agg(text=('text', 'last'), count=('w', 'size'), score=('w', 'sum'))
+        cats = df.groupby(['type', 'key', 'category'])['w'].sum()
+        for t, key, text, count, score in zip(notes.index.get_level_values(0), notes.index.get_level_values(1),
+                                              notes['text'], notes['count'], notes['score']):
+            index.notes[(t, key)] = {'text': text, 'count': int(count), 'score': float(score), 'cats': {}}
+        for (t, key, cat), w in cats.items():
+            index.notes[(t, key)]['cats'][cat] = float(w)
+        notes = notes.sort_values('score', ascending=False)
+        for t, key, score in zip(notes.index.get_level_values(0), notes.index.get_level_values(1), notes['score']):
+            index.tries.setdefault(t, NoteTrie()).raise_score(key, float(score))
+        return index
+
+    # --- 增量更新 ---
+    def add(self, record):
+        key = normalize(record.get('note'))
+        if not key:
+            return
+        t, w = str(record.get('type', '')), _weight(record.get('date'))
+        cell = self.notes.setdefault((t, key), {'text': '', 'count': 0, 'score': 0.0, 'cats': {}})
+        cell['text'] = str(record.get('note')).strip()
+        cell['count'] += 1
+        cell['score'] += w
+        cat = str(record.get('category', ''))
+        cell['cats'][cat] = cell['cats'].get(cat, 0.0) + w
+        self.tries.setdefault(t, NoteTrie()).raise_score(key, cell['score'])
+
+    def remove(self, record):
+        key = normalize(record.get('note'))
+        t = str(record.get('type', ''))
+        cell = self.notes.get((t, key))
+        if cell is None:
+            return
+        w = _weight(record.get('date'))
+        cell['count'] -= 1
+        cat = str(record.get('category', ''))
+        if cat in cell['cats']:
+            cell['cats'][cat] -= w
+            if cell['cats'][cat] <= w * 1e-9:
+                del cell['cats'][cat]
+        if cell['count'] <= 0:
+            del self.notes[(t, key)]
+            self.tries[t].lower_score(key, 0)
+        else:
+            # 浮點誤差不能讓還在用的備註變成 0 分 (0 分代表已刪除)
+            cell['score'] = max(cell['score'] - w, 1e-12)
+            self.tries[t].lower_score(key, cell['score'])
+
+    def apply_change(self, old=None, new=None):
+        """與 ledger_rollup.apply_change 相同用法：新增時 old=None，刪除時 new=None"""
+        if old is not None:
+            self.remove(old)
+        if new is not None:
+            self.add(new)
+        return self
+
+    # --- 查詢 ---
+    def suggest(self, prefix, r_type, limit=5):
+        """輸入到一半的備註 → 常用的完整備註 (不含跟輸入完全相同的那一個)"""
+        key = normalize(prefix)
+        trie = self.tries.get(str(r_type))
+        if not key or trie is None:
+            return []
+        return [self.notes[(str(r_type), k)]['text'] for k in trie.top(key) if k != key][:limit]
+
+    def predict_category(self, note, r_type):
+        """最可能的分類：用過這個備註就取最常用 (時間加權) 的分類，否則參考前綴相同的常用備註"""
+        key = normalize(note)
+        t = str(r_type)
+        if not key:
+            return None
+        cell = self.notes.get((t, key))
+        if cell is not None and cell['cats']:
+            return max(cell['cats'], key=cell['cats'].get)
+        trie = self.tries.get(t)
+        votes = {}
+        for k in (trie.top(key) if trie is not None else []):
+            for cat, w in self.notes[(t, k)]['cats'].items():
+                votes[cat] = votes.get(cat, 0.0) + w
+        return max(votes, key=votes.get) if votes else None
+
+
+def _pick(key):
+    # 點選建議：在輸入框重新建立前換掉它的內容
+    import streamlit as st
+    picked = st.session_state.get(f"{key}_pick")
+    if picked:
+        st.session_state[key] = picked
+    st.session_state[f"{key}_pick"] = None
+
+
+def render_note_input(get_index, r_type, categories, value="", label="備註說明", key="note"):
+    """記帳表單外的備註輸入框 + 常用備註建議
+
+    get_index 只在輸入框有字時才呼叫 (例如明細延遲載入的 app 可在這時才讀取)。
+    回傳 (備註, 預測分類在 categories 中的位置；沒有把握時為 None)。
+    """
+    import streamlit as st
+    value = '' if value is None or value != value else str(value)
+    # 開始 / 結束編輯時帶入該筆的備註
+    if st.session_state.get(f"{key}_src") != value or key not in st.session_state:
+        st.session_state[f"{key}_src"] = value
+        st.session_state[key] = value
+    note = st.text_input(label, key=key, placeholder="輸入幾個字後按 Enter 查看常用備註")
+    if not note.strip():
+        return note, None
+    index = get_index()
+    suggestions = index.suggest(note, r_type)
+    if suggestions:
+        st.pills("常用備註", suggestions, key=f"{key}_pick", on_change=_pick, args=(key,), label_visibility="collapsed")
+    category = index.predict_category(note, r_type)
+    return note, categories.index(category) if category in categories else None
+
+
+def clear_note(key="note"):
+    """送出後清空備註 (表單外的輸入框不會跟著 clear_on_submit 清掉)"""
+    import streamlit as st
+    st.session_state.pop(key, None)
+    st.session_state.pop(f"{key}_src", None)
@@ -0,0 +1,326 @@
+import os
+import json
+import zlib
+import base64
+from datetime import date
+from collections import OrderedDict
+
+import pandas as pd
+
+import ledger_budget
+import ledger_engine
+import ledger_rollup
+from ledger_query import LedgerIndex, parse_query
+
+# ==========================================
+# 冷熱分層：近幾個月留在記憶體，舊月份凍結成壓縮分段
+# ==========================================
+# 本機帳本 (app2 / app3) 每次執行都會把整份 records 轉成表格、搜尋、列出明細，
+# 但使用者平常只看最近幾個月。這裡把熱資料視窗以前的每個月份凍結成一個分段：
+#   - 分段內容是壓縮過的 JSON，建立後不再修改 (要改時整個月份移回熱資料)；
+#   - 每個分段另存預先算好的摘要 {(類型, 分類): [筆數, 金額和, 金額平方和]}，
+#     分析頁的合計、分類圖、預算與異常判斷基準都直接用摘要，不必解壓；
+#   - 只有搜尋條件的日期範圍碰到某個月份 (或使用者要求搜尋全部) 時才解壓那個月份，
+#     類型 / 分類 / 金額條件對不上摘要的分段連解壓都省掉。
+# 因此每次執行的記憶體與計算量只跟熱資料視窗的大小有關。
+
+# 熱資料保留本月 + 前幾個月 (4 個月涵蓋近 90 天的滾動統計)
+HOT_MONTHS = int(os.environ.get("LEDGER_HOT_MONTHS", 4))
+# 帳本不到這個筆數就不分層 (小帳本解壓縮反而多花時間)
+TIER_MIN_RECORDS = int(os.environ.get("LEDGER_TIER_MIN_RECORDS", 2000))
+# 最多同時保留幾個已解壓的分段 (連續搜尋同一段期間時不必重複解壓)
+THAW_CACHE = 4
+
+
+def _month(record):
+    return str(record.get('date', ''))[:7]
+
+
+def hot_since(today=None, months=HOT_MONTHS):
+    """熱資料的第一個月份 'YYYY-MM' (這個月份以前的紀錄可以凍結)"""
+    today = today or date.today()
+    y, m = divmod(today.year * 12 + today.month - 1 - (months - 1), 12)
+    return f"{y:04d}-{m + 1:02d}"
+
+
+class Segment:
+    """一個月份的封存資料：壓縮明細 + 摘要 (不可變)"""
+
+    def __init__(self, month, blob, count, cells, amounts):
+        self.month = month
+        self.blob = blob
+        self.count = count
+        self.cells = cells        # {(類型, 分類): [筆數, 金額和, 金額平方和]}
+        self.amounts = amounts    # (最小金額, 最大金額)
+
+    @classmethod
+    def freeze(cls, month, records):
+        cells = {}
+        for r in records:
+            x = ledger_rollup.amount_of(r)
+            cell = cells.setdefault((str(r.get('type', '')), str(r.get('category', ''))), [0, 0.0, 0.0])
+            cell[0] += 1
+            cell[1] += x
+            cell[2] += x * x
+        raw = json.dumps(records, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+        amounts = [ledger_rollup.amount_of(r) for r in records]
+        return cls(month, zlib.compress(raw, 6), len(records), cells, (min(amounts), max(amounts)))
+
+    def records(self):
+        return json.loads(zlib.decompress(self.blob).decode('utf-8'))
+
+    def could_match(self, conditions):
+        """以摘要判斷這個月份有沒有可能符合查詢 (不解壓)"""
+        lo_day, hi_day = f"{self.month}-01", f"{self.month}-31"
+        for cond in conditions:
+            kind = cond[0]
+            if kind == 'date':
+                _, lo, hi, _, _ = cond
+                if (lo is not None and hi_day < lo) or (hi is not None and lo_day > hi):
+                    return False
+            elif kind == 'amount':
+                _, lo, hi, _, _ = cond
+                if (lo is not None and self.amounts[1] < lo) or (hi is not None and self.amounts[0] > hi):
+                    return False
+            elif kind in ('type', 'category'):
+                values = {key[0 if kind == 'type' else 1] for key in self.cells}
+                if not values & set(cond[1]):
+                    return False
+        return True
+
+    # --- 瀏覽器保存用的 JSON 格式 ---
+    def to_payload(self):
+        return {'month': self.month, 'count': self.count, 'amounts': list(self.amounts),
+                'cells': [[t, c, n, s, s2] for (t, c), (n, s, s2) in self.cells.items()],
+                'blob': base64.b64encode(self.blob).decode('ascii')}
+
+    @classmethod
+    def from_payload(cls, payload):
+        cells = {(t, c): [n, s, s2] for t, c, n, s, s2 in payload['cells']}
+        return cls(payload['month'], base64.b64decode(payload['blob']), payload['count'], cells,
+                   tuple(payload['amounts']))
+
+
+class Archive:
+    """所有封存月份；解壓過的分段與合併後的摘要只是快取，不跟著保存"""
+
+    def __init__(self, segments=None):
+        self.segments = dict(segments or {})
+        self._reset_cache()
+
+    def _reset_cache(self):
+        self._thawed = OrderedDict()
+        self._frame = None
+
+    def __getstate__(self):
+        return {'segments': self.segments}
+
+    def __setstate__(self, state):
+        self.segments = state['segments']
+        self._reset_cache()
+
+    def __len__(self):
+        return sum(s.count for s in self.segments.values())
+
+    def months(self):
+        return sorted(self.segments)
+
+    def size_bytes(self):
+        return sum(len(s.blob) for s in self.segments.values())
+
+    # --- 分層 ---
+    def due(self, records, today=None, keep=()):
+        """熱資料裡是否有該凍結的舊月份 (keep 裡的月份不算)"""
+        if len(records) + len(self) < TIER_MIN_RECORDS:
+            return False
+        since = hot_since(today)
+        return any(_month(r) < since and _month(r) not in keep for r in records)
+
+    def freeze(self, records, today=None, keep=()):
+        """把熱資料視窗以前的紀錄凍結 → (剩下的熱資料 (新的 list), 凍結筆數)
+
+        同一個月份已經有分段時 (例如補記了舊月份的帳)，與原分段合併後重新壓縮。
+        keep 是暫時留在熱資料的舊月份 (正在修改中)。
+        """
+        if len(records) + len(self) < TIER_MIN_RECORDS:
+            return records, 0
+        since = hot_since(today)
+        hot, cold = [], {}
+        for r in records:
+            month = _month(r)
+            if month < since and month not in keep:
+                cold.setdefault(month, []).append(r)
+            else:
+                hot.append(r)
+        for month, rows in cold.items():
+            if month in self.segments:
+                rows = self.segments[month].records() + rows
+            self.segments[month] = Segment.freeze(month, rows)
+        if cold:
+            self._reset_cache()
+        return hot, len(records) - len(hot)
+
+    def promote(self, month):
+        """整個月份移回熱資料 (要修改其中的紀錄時)，回傳該月份的紀錄"""
+        segment = self.segments.pop(month, None)
+        self._reset_cache()
+        return segment.records() if segment is not None else []
+
+    def merge(self, records):
+        """全部紀錄 (封存月份依序 + 熱資料)：下載備份時才用"""
+        rows = []
+        for month in self.months():
+            rows.extend(self.segments[month].records())
+        return rows + list(records)
+
+    # --- 摘要 (不解壓) ---
+    def rollup(self):
+        """與 ledger_rollup 相同格式的彙總 {(月份, 類型, 分類): [金額合計, 筆數]}"""
+        return {(m, t, c): [s, n] for m, seg in self.segments.items() for (t, c), (n, s, _) in seg.cells.items()}
+
+    def frame(self):
+        """封存月份的彙總表 (month, type, category, amount, count)"""
+        if self._frame is None:
+            self._frame = ledger_rollup.to_frame(self.rollup())
+        return self._frame
+
+    def moments(self):
+        """全部封存紀錄的 {(類型, 分類): [筆數, 和, 平方和]} (異常金額判斷的基準)"""
+        total = {}
+        for seg in self.segments.values():
+            for key, (n, s, s2) in seg.cells.items():
+                cell = total.setdefault(key, [0, 0.0, 0.0])
+                cell[0] += n
+                cell[1] += s
+                cell[2] += s2
+        return total
+
+    # --- 查詢 ---
+    def _thaw(self, month):
+        if month in self._thawed:
+            self._thawed.move_to_end(month)
+        else:
+            records = self.segments[month].records()
+            self._thawed[month] = (records, LedgerIndex(records))
+            while len(self._thawed) > THAW_CACHE:
+                self._thawed.popitem(last=False)
+        return self._thawed[month]
+
+    def search(self, query, everything=False):
+        """在封存月份中查詢 → (符合的紀錄, 解壓的月份數)
+
+        查詢沒有日期條件時只搜尋熱資料，除非 everything=True。
+        """
+        conditions = parse_query(query)
+        if not conditions or not (everything or any(c[0] == 'date' for c in conditions)):
+            return [], 0
+        rows, opened = [], 0
+        for month in self.months():
+            if not self.segments[month].could_match(conditions):
+                continue
+            records, index = self._thaw(month)
+            opened += 1
+            rows.extend(records[i] for i in index.search(query))
+        return rows, opened
+
+    # --- 瀏覽器保存 ---
+    def to_payload(self):
+        return [self.segments[m].to_payload() for m in self.months()]
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls({p['month']: Segment.from_payload(p) for p in payload or []})
+
+
+class TieredSession(ledger_engine.LedgerSession):
+    """本機帳本 (app2 / app3)：熱資料 + 封存月份，並定期把操作日誌壓縮成快照"""
+
+    def __init__(self, state):
+        super().__init__(state)
+        # session 由外部後端或磁碟還原時可能已經跨月：舊月份凍結封存
+        self.retier()
+
+    def archive(self):
+        """熱資料視窗以前的月份 (壓縮分段 + 摘要)"""
+        if 'archive' not in self.state:
+            self.state['archive'] = Archive()
+        return self.state['archive']
+
+    def _on_applied(self, event):
+        journal = self.journal()
+        if journal.needs_snapshot():
+            journal.take_snapshot(self.state['records'])
+
+    def _build_stats(self, today=None):
+        # 熱資料涵蓋所有滾動視窗；封存月份只以摘要併入異常判斷的基準
+        return super()._build_stats(today).add_baseline(self.archive().moments())
+
+    def reset_journal(self):
+        """整份資料被換掉 (例如還原備份) 時，重新分層並以熱資料作為新的快照"""
+        self.state['archive'] = Archive()
+        self.state['promoted'] = set()
+        self.replace_records(self.archive().freeze(self.state['records'])[0])
+
+    def retier(self):
+        """熱資料裡有該封存的舊月份時凍結 (session 開始與還原資料時檢查；移回修改中的月份除外)"""
+        keep = self.state.get('promoted') or ()
+        if self.archive().due(self.state['records'], keep=keep):
+            self.replace_records(self.archive().freeze(self.state['records'], keep=keep)[0])
+
+    def promote(self, month):
+        """封存月份移回熱資料才能修改 (操作日誌重新開始)
+
+        月份記在 promoted：app 物件重建 (例如 session 暫存到磁碟後還原) 時 retier 不會
+        把它凍結回去；使用者儲存或取消修改後才在下次載入時重新封存。
+        """
+        self.state['editing_id'] = None
+        self.state['promoted'] = set(self.state.get('promoted') or ()) | {month}
+        self.replace_records(self.state['records'] + self.archive().promote(month))
+
+    def add_or_update(self, r_date, r_type, amount, category, note, target=None):
+        editing = self.state['editing_id'] is not None
+        result = super().add_or_update(r_date, r_type, amount, category, note, target)
+        if editing:
+            self.state['promoted'] = set()
+        return result
+
+    def cancel_edit(self):
+        super().cancel_edit()
+        self.state['promoted'] = set()
+
+    def load_journal(self, journal, archive=None):
+        """以瀏覽器保存的快照 + 差異 (與封存月份) 還原整份資料 (重新整理後自動執行)"""
+        self.state['archive'] = Archive.from_payload(archive)
+        self.state['editing_id'] = None
+        self.state['promoted'] = set()
+        self.replace_records(journal.replay(), journal)
+        self.retier()
+
+
+def with_summary(df, archive):
+    """熱資料明細 + 封存月份的彙總列 → 只有 type / category / amount 的表 (算合計與分類圖用)"""
+    parts = [df[['type', 'category', 'amount']]] if not df.empty else []
+    if len(archive):
+        parts.append(archive.frame()[['type', 'category', 'amount']])
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['type', 'category', 'amount'])
+
+
+def budget_actuals(records, archive):
+    """預算頁的各月各分類支出：熱資料明細 + 封存月份的摘要"""
+    actuals = ledger_budget.actuals_from_records(ledger_engine.to_frame(records))
+    cold = ledger_budget.actuals_from_rollup(archive.frame()) if len(archive) else actuals.iloc[:0]
+    if cold.empty or actuals.empty:
+        return actuals if cold.empty else cold
+    return pd.concat([cold, actuals], ignore_index=True)
+
+
+def render_status(archive, key="tiers"):
+    """側邊欄：封存狀態 + 是否連封存月份一起搜尋；回傳是否搜尋全部"""
+    import streamlit as st
+    if not len(archive):
+        return False
+    months = archive.months()
+    st.caption(f"🗄️ 已封存 {months[0]} ~ {months[-1]} 共 {len(months)} 個月份 · {len(archive):,} 筆"
+               f" (壓縮後 {archive.size_bytes() / 1024:,.0f} KB)")
+    return st.toggle("🗄️ 搜尋也包含封存月份", key=f"{key}_everything",
+                     help="關閉時只有查詢指定了日期範圍 (例如 2024-03) 才會解壓對應的封存月份")
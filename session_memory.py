@@ -0,0 +1,349 @@
+import os
+import sys
+import time
+import pickle
+import random
+import tempfile
+import threading
+
+import session_store
+
+# ==========================================
+# Session 記憶體估算與閒置回收
+# ==========================================
+# 每個 session 都有自己的 records / history / 連線物件，
+# 這裡統一估算大小、回報總量，並把閒置太久或太肥的 session
+# 的大型狀態溢出到磁碟，使用者回來時再自動還原。
+# 溢出會把帳本寫到伺服器的磁碟，所以預設不啟用 (app2 / app3 承諾資料只留在瀏覽器與檔案)；
+# 部署者設定 LEDGER_SPILL=1 才開啟，暫存檔放在只有自己能讀寫 (0700) 的資料夾：
+#   LEDGER_SPILL_DIR 未設定 → 系統暫存資料夾裡另建一個；有設定 → 在那個資料夾底下另建一個
+
+IDLE_SECONDS = float(os.environ.get("LEDGER_IDLE_SECONDS", 15 * 60))
+MAX_SESSION_BYTES = int(os.environ.get("LEDGER_MAX_SESSION_BYTES", 8 * 1024 * 1024))
+OVERSIZE_IDLE_SECONDS = float(os.environ.get("LEDGER_OVERSIZE_IDLE_SECONDS", 60))
+SPILL_ENABLED = os.environ.get("LEDGER_SPILL", "") not in ("", "0")
+SPILL_DIR = os.environ.get("LEDGER_SPILL_DIR") or None
+# 執行中的 session 不溢出；超過這個時間還沒結束 (例如執行途中丟出例外，沒有呼叫 persist) 才視為已結束
+STUCK_RUN_SECONDS = float(os.environ.get("LEDGER_STUCK_RUN_SECONDS", 30 * 60))
+# 斷線超過這個時間的 session 不再追蹤，殘留的暫存檔也一併清掉
+FORGET_SECONDS = float(os.environ.get("LEDGER_FORGET_SECONDS", 24 * 60 * 60))
+# 記憶體面板預設只顯示自己的 session；設為 1 時 (管理者部署) 才列出整個伺服器的所有 session
+SHOW_ALL_SESSIONS = os.environ.get("LEDGER_MEMORY_ADMIN", "") not in ("", "0")
+
+# 大型狀態：溢出到磁碟、回來時還原
+BULKY_KEYS = ('records', 'history', 'journal', 'archive')
+# 可重建的物件 (含連線、搜尋索引、滾動統計、備註索引、全家總覽與固定收支展開的快取)：直接釋放，下次執行時由 app 重新建立
+DROP_KEYS = ('app', 'search_index', 'household', 'rolling_stats', 'note_index', 'recurring_cache')
+SPILL_MARKER = '_spilled_to'
+# 暫存檔無法還原時留下的錯誤訊息 (下一次 touch() 顯示給使用者)
+RESTORE_ERROR = '_spill_restore_error'
+
+# 超過這個長度的 list 只抽樣估算，避免每次 rerun 都掃完整份帳本
+_SAMPLE_LIMIT = 200
+# 連線物件之類的深層結構不往下追
+_MAX_DEPTH = 6
+
+
+def estimate_size(obj, _seen=None, _depth=0):
+    """粗估物件佔用的位元組數 (遞迴計算容器內容)"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen or _depth > _MAX_DEPTH:
+        return 0
+    _seen.add(id(obj))
+
+    # pandas 物件自己算得比較準
+    memory_usage = getattr(obj, 'memory_usage', None)
+    if callable(memory_usage) and hasattr(obj, 'shape'):
+        try:
+            usage = memory_usage(deep=True)
+            return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+        except Exception:
+            pass
+
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        items = list(obj.items())
+        return size + _estimate_items(items, _seen, _depth, lambda kv: (kv[0], kv[1]))
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + _estimate_items(list(obj), _seen, _depth, lambda v: (v,))
+    if hasattr(obj, '__dict__'):
+        return size + estimate_size(vars(obj), _seen, _depth + 1)
+    return size
+
+
+def _estimate_items(items, seen, depth, unpack):
+    if len(items) <= _SAMPLE_LIMIT:
+        return sum(estimate_size(part, seen, depth + 1) for item in items for part in unpack(item))
+    sample = random.sample(items, _SAMPLE_LIMIT)
+    sampled = sum(estimate_size(part, seen, depth + 1) for item in sample for part in unpack(item))
+    return int(sampled * len(items) / _SAMPLE_LIMIT)
+
+
+def _fmt_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return f"{n:,.0f} {unit}" if unit == 'B' else f"{n:,.1f} {unit}"
+        n /= 1024
+
+
+class SessionRegistry:
+    """行程層級的 session 登記簿：記錄最後活動時間與估算大小"""
+
+    def __init__(self, spill_dir=SPILL_DIR, idle_seconds=IDLE_SECONDS,
+                 max_bytes=MAX_SESSION_BYTES, oversize_idle_seconds=OVERSIZE_IDLE_SECONDS,
+                 forget_seconds=FORGET_SECONDS, is_alive=None, enabled=SPILL_ENABLED):
+        self.enabled = enabled
+        self.spill_base = spill_dir
+        self.spill_dir = None     # 第一次溢出時才建立 (每個行程一個私有資料夾)
+        self.idle_seconds = idle_seconds
+        self.max_bytes = max_bytes
+        self.oversize_idle_seconds = oversize_idle_seconds
+        self.forget_seconds = forget_seconds
+        self.is_alive = is_alive or _session_is_alive
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    # --- 目前這個 session 的每次 rerun ---
+    def touch(self, sid, state):
+        """登記活動；若先前被溢出則先還原，再順便清理其他閒置 session"""
+        now = time.time()
+        with self._lock:
+            if SPILL_MARKER in state:
+                self._restore(state)
+            entry = self._sessions.get(sid)
+            if entry is None or entry['state'] is not state:
+                entry = {'state': state, 'spilled': False, 'spills': 0}
+                self._sessions[sid] = entry
+            entry['last_seen'] = now
+            entry['running'] = True
+            entry['spilled'] = False
+            entry['bytes'] = self._measure(state)
+        self.sweep(now)
+        return entry['bytes']
+
+    def finish(self, sid):
+        """這次執行結束 (persist() 呼叫)：之後才可以被溢出，閒置時間也從現在算起"""
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is not None:
+                entry['running'] = False
+                entry['last_seen'] = time.time()
+
+    # --- 回收 ---
+    def sweep(self, now=None):
+        """把超過閒置時間、或閒置且超過大小上限的 session 溢出到磁碟"""
+        now = time.time() if now is None else now
+        with self._lock:
+            for sid, entry in list(self._sessions.items()):
+                idle = now - entry['last_seen']
+                if idle >= self.forget_seconds and not self.is_alive(sid):
+                    # 早已斷線的 session：放掉參考，讓 Streamlit 能回收它 (暫存檔由下面一併清掉)
+                    del self._sessions[sid]
+                    continue
+                if entry['spilled'] or not self.enabled:
+                    continue
+                if entry.get('running') and idle < STUCK_RUN_SECONDS:
+                    # 別的 session 的執行緒在這裡清理：正在執行的 session 的狀態不能動
+                    continue
+                if idle >= self.idle_seconds or (
+                        entry['bytes'] > self.max_bytes and idle >= self.oversize_idle_seconds):
+                    self._spill(sid, entry, entry['state'])
+            self._purge_stale_files(now)
+
+    def _spill(self, sid, entry, state):
+        payload = {}
+        for key in BULKY_KEYS:
+            if key in state:
+                try:
+                    pickle.dumps(state[key])
+                except Exception:
+                    continue
+                payload[key] = state[key]
+        path = self._path(sid)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+        for key in list(payload) + list(DROP_KEYS):
+            if key in state:
+                del state[key]
+        state[SPILL_MARKER] = path
+        entry['spilled'] = True
+        entry['spills'] += 1
+        entry['bytes'] = self._measure(state)
+
+    def _restore(self, state):
+        """讀回溢出的狀態；失敗時不假裝沒事，把錯誤留給 touch() 顯示 (暫存檔保留，方便事後檢查)"""
+        path = state[SPILL_MARKER]
+        del state[SPILL_MARKER]
+        try:
+            with open(path, 'rb') as f:
+                payload = pickle.load(f)
+        except Exception as e:
+            state[RESTORE_ERROR] = f"{type(e).__name__}: {e}"
+            return
+        for key, value in payload.items():
+            state[key] = value
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _private_dir(self):
+        if self.spill_dir is None:
+            if self.spill_base:
+                os.makedirs(self.spill_base, mode=0o700, exist_ok=True)
+            # mkdtemp 建立的資料夾權限是 0700，名稱也無法預測
+            self.spill_dir = tempfile.mkdtemp(prefix="ledger_spill_", dir=self.spill_base)
+        return self.spill_dir
+
+    def _path(self, sid):
+        return os.path.join(self._private_dir(), f"{sid}.pkl")
+
+    def _purge_stale_files(self, now):
+        """只清掉已不再追蹤的 session 的暫存檔 (資料夾是這個行程私有的，其他檔案一定是它留下的)"""
+        if self.spill_dir is None:
+            return
+        try:
+            names = os.listdir(self.spill_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.split('.', 1)[0] in self._sessions:
+                continue
+            try:
+                os.remove(os.path.join(self.spill_dir, name))
+            except OSError:
+                continue
+
+    @staticmethod
+    def _measure(state):
+        total = 0
+        for key in _state_keys(state):
+            if key == SPILL_MARKER:
+                continue
+            try:
+                total += estimate_size(state[key])
+            except Exception:
+                continue
+        return total
+
+    # --- 報表 ---
+    def usage(self, sid, now=None):
+        """單一 session 的估算大小與閒置秒數；沒有登記時回傳 None"""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            return {'bytes': entry['bytes'], 'idle_sec': round(now - entry['last_seen'], 1),
+                    'spilled': entry['spilled'], 'spills': entry['spills']}
+
+    def report(self, now=None):
+        """回傳每個 session 的估算大小與閒置秒數 (依大小排序)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = [{
+                'session': sid[:8],
+                'bytes': entry['bytes'],
+                'idle_sec': round(now - entry['last_seen'], 1),
+                'spilled': entry['spilled'],
+                'spills': entry['spills'],
+            } for sid, entry in self._sessions.items()]
+        return sorted(rows, key=lambda r: r['bytes'], reverse=True)
+
+    def totals(self):
+        rows = self.report()
+        return {
+            'sessions': len(rows),
+            'active': sum(1 for r in rows if not r['spilled']),
+            'spilled': sum(1 for r in rows if r['spilled']),
+            'bytes': sum(r['bytes'] for r in rows),
+        }
+
+
+def _state_keys(state):
+    keys = getattr(state, '_keys', None)
+    return list(keys()) if callable(keys) else list(state.keys())
+
+
+def _session_is_alive(sid):
+    try:
+        from streamlit import runtime
+        return runtime.exists() and runtime.get_instance().is_active_session(sid)
+    except Exception:
+        return False
+
+
+registry = SessionRegistry()
+
+
+def _current_state():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return None, None
+    # 持有底層 SessionState (跨 rerun 不變)，而不是每次重建的包裝物件
+    return ctx.session_id, getattr(ctx.session_state, '_state', ctx.session_state)
+
+
+def touch():
+    """在每個 app 最前面呼叫 (必須早於建立 records / app 物件)"""
+    sid, state = _current_state()
+    if sid is None:
+        return 0
+    size = registry.touch(sid, state)
+    if RESTORE_ERROR in state:
+        import streamlit as st
+        st.error(f"⚠️ 閒置時暫存到磁碟的資料無法還原，這個 session 的紀錄已遺失"
+                 f"，請重新讀取帳本或從備份還原。({state[RESTORE_ERROR]})")
+        del state[RESTORE_ERROR]
+    # 有設定外部 session 後端時：新 session 先載回資料，否則寫入上次執行 (例如 st.rerun 中斷) 的變動
+    session_store.sync(state)
+    return size
+
+
+def persist():
+    """在每個 app 最後面呼叫：把這次執行的狀態變動寫回外部 session 後端"""
+    sid, state = _current_state()
+    if sid is None:
+        return 0
+    registry.finish(sid)
+    return session_store.flush(state)
+
+
+def claim(owner):
+    """需要登入的 app 在確認登入者後呼叫：網址上的 ?sid= 只能接回同一個登入者的資料
+
+    回傳 True 代表剛載回先前的資料，app 應 st.rerun()。
+    """
+    sid, state = _current_state()
+    if sid is None:
+        return False
+    return session_store.claim(state, owner)
+
+
+def render_panel():
+    """側邊欄的記憶體用量面板 (其他使用者的 session 只有設定 LEDGER_MEMORY_ADMIN 時才看得到)"""
+    import streamlit as st
+    with st.sidebar.expander("🧠 記憶體用量"):
+        if registry.enabled:
+            st.caption(f"閒置 {registry.idle_seconds / 60:.0f} 分鐘或超過 {_fmt_bytes(registry.max_bytes)} 的 session 會暫存到磁碟")
+        else:
+            st.caption("資料只留在記憶體 (未啟用暫存到磁碟)")
+        if not SHOW_ALL_SESSIONS:
+            sid, _ = _current_state()
+            mine = registry.usage(sid) if sid is not None else None
+            st.metric("這個 session", _fmt_bytes(mine['bytes']) if mine else "—")
+            return
+        totals = registry.totals()
+        c1, c2 = st.columns(2)
+        c1.metric("Session 數", f"{totals['active']} / {totals['sessions']}")
+        c2.metric("估算總量", _fmt_bytes(totals['bytes']))
+        rows = registry.report()
+        if rows:
+            st.dataframe(rows, hide_index=True, use_container_width=True)
@@ -0,0 +1,383 @@
+import os
+import json
+import time
+import hashlib
+import secrets
+import sqlite3
+import threading
+
+# ==========================================
+# Session 狀態外部化 (可抽換的儲存後端)
+# ==========================================
+# st.session_state 只存在目前這個行程裡：行程重啟就全部消失，
+# 多個行程放在負載平衡後面時，重新連線到別的行程也找不回資料。
+# 這裡把各 app 的資料 (records / journal / 遊戲進度…) 以網址上的 ?sid= 代號
+# 存到外部後端，新的行程第一次看到這個代號時整份載回。
+#   - 每次執行只寫入「真的有變動」的 key (比對序列化後的雜湊)；
+#   - records / journal (與封存月份) 不整份重寫：與瀏覽器保存 (ledger_browser) 相同，
+#     存一份壓縮快照 + 每次執行新增的事件，日誌壓縮或資料整份換掉時才重寫快照；
+#   - 需要登入的 app (app5) 登入後呼叫 claim()：代號綁定登入者，
+#     別人拿到網址上的代號也載不回這份資料 (確認是同一個登入者之前不載入)；
+#   - 預設不啟用 (資料只留在記憶體)，設定 LEDGER_SESSION_STORE 才開啟：
+#       LEDGER_SESSION_STORE=sqlite                 → ~/.ledger/sessions.db (只有自己能讀寫的資料夾)
+#       LEDGER_SESSION_STORE=sqlite:///data/s.db    → 指定檔案 (多個行程共用同一個檔案即可)
+
+STORE_URL = os.environ.get("LEDGER_SESSION_STORE", "")
+# 超過這麼久沒有活動的 session 從後端刪除
+SESSION_TTL = float(os.environ.get("LEDGER_SESSION_TTL", 7 * 24 * 60 * 60))
+QUERY_PARAM = "sid"
+
+# 要外部化的狀態 (連線物件、索引、快取之類可重建的東西不存)
+# records / journal / archive 有操作日誌時改以日誌的快照 + 差異保存 (見 JOURNAL_KEYS)
+PERSIST_KEYS = ('records', 'journal', 'archive', 'promoted', 'history', 'editing_id', 'records_rev',
+                'records_loaded', 'rollup', 'budget', 'budgets', 'budgets_url', 'recurring', 'recurring_url',
+                'target_number', 'target', 'counter', 'is_finished', 'game_over', 'msg', 'started_at')
+STORE_MARKER = '_session_store'
+JOURNAL_KEYS = ('records', 'journal', 'archive')
+# 後端裡日誌的列：快照 (含封存月份)、日誌代號、每次執行追加的差異 (依起始序號排序)
+CHECKPOINT_KEY = 'journal.checkpoint'
+EPOCH_KEY = 'journal.epoch'
+DELTA_PREFIX = 'journal.delta.'
+# 綁定的登入者 (只存雜湊)
+OWNER_KEY = 'owner'
+
+# 平均每寫入這麼多次順便清一次過期資料
+_PURGE_EVERY = 200
+
+
+# 後端存的是 JSON 而不是 pickle：資料庫檔案若被別人改過，載回時也只會是資料、不會執行程式碼。
+# JSON 沒有的型別 (集合、tuple、非字串 key 的 dict，例如彙總的 (月份, 類型, 分類) key) 包成帶標記的物件。
+def _tag(value):
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value):
+            return {k: _tag(v) for k, v in value.items()}
+        return {'$items': [[_tag(k), _tag(v)] for k, v in value.items()]}
+    if isinstance(value, list):
+        return [_tag(v) for v in value]
+    if isinstance(value, tuple):
+        return {'$tuple': [_tag(v) for v in value]}
+    if isinstance(value, (set, frozenset)):
+        # 排序後才序列化，同樣的集合每次得到一樣的雜湊
+        return {'$set': [_tag(v) for v in sorted(value, key=repr)]}
+    return value
+
+
+def _scalar(value):
+    # numpy 之類的數值型別 (.item() 轉回 Python 數值)；其他物件 (連線、索引…) 不保存
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"無法保存的型別：{type(value).__name__}")
+
+
+def _untag(obj):
+    if len(obj) == 1:
+        tag = next(iter(obj))
+        if tag == '$set':
+            return set(obj[tag])
+        if tag == '$tuple':
+            return tuple(obj[tag])
+        if tag == '$items':
+            return dict(obj[tag])
+    return obj
+
+
+def encode(value):
+    return json.dumps(_tag(value), ensure_ascii=False, separators=(',', ':'), default=_scalar).encode('utf-8')
+
+
+def decode(blob):
+    return json.loads(blob, object_hook=_untag)
+
+
+def _digest(blob):
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+
+def _owner_digest(owner):
+    return hashlib.blake2b(str(owner).encode('utf-8'), digest_size=16).hexdigest()
+
+
+# ==========================================
+# 後端
+# ==========================================
+class SessionBackend:
+    """後端介面：以 (代號, key) 存取序列化好的 bytes"""
+
+    def load(self, token):
+        """回傳 {key: bytes}"""
+        raise NotImplementedError
+
+    def save(self, token, changed, deleted=()):
+        """寫入有變動的 {key: bytes}、刪除不再存在的 key (同一個交易)"""
+        raise NotImplementedError
+
+    def purge(self, older_than):
+        """刪除最後寫入時間早於 older_than (epoch 秒) 的 session，回傳刪除的列數"""
+        raise NotImplementedError
+
+
+class SQLiteBackend(SessionBackend):
+    """本機嵌入式資料庫：不需要外部服務，同一台機器的多個行程共用一個檔案"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS session_state (
+                                token TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,
+                                updated REAL NOT NULL, PRIMARY KEY (token, key))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS session_state_updated ON session_state (updated)")
+
+    def _connect(self):
+        # 每個執行緒一條連線；WAL 讓多個行程可以同時讀、輪流寫
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, token):
+        rows = self._connect().execute("SELECT key, value FROM session_state WHERE token = ?", (token,))
+        return {key: bytes(value) for key, value in rows}
+
+    def save(self, token, changed, deleted=()):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO session_state (token, key, value, updated) VALUES (?, ?, ?, ?)",
+                             [(token, key, sqlite3.Binary(blob), now) for key, blob in changed.items()])
+            conn.executemany("DELETE FROM session_state WHERE token = ? AND key = ?",
+                             [(token, key) for key in deleted])
+            # 只要有寫入就更新整個 session 的時間，避免沒變動的 key 被當成過期
+            conn.execute("UPDATE session_state SET updated = ? WHERE token = ?", (now, token))
+
+    def purge(self, older_than):
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM session_state WHERE updated < ?", (older_than,)).rowcount
+
+
+def _sqlite(location):
+    if not location:
+        # 預設放在使用者自己的資料夾 (0700)，不放在大家都能寫入的暫存資料夾
+        folder = os.path.join(os.path.expanduser("~"), ".ledger")
+        os.makedirs(folder, mode=0o700, exist_ok=True)
+        os.chmod(folder, 0o700)
+        location = os.path.join(folder, "sessions.db")
+    return SQLiteBackend(location)
+
+
+BACKENDS = {'sqlite': _sqlite}
+
+
+def register_backend(scheme, factory):
+    """加入其他後端 (例如 redis)：factory 收到網址 scheme:// 之後的部分"""
+    BACKENDS[scheme] = factory
+
+
+def open_backend(url):
+    """LEDGER_SESSION_STORE 的設定 → 後端物件；空字串或 none 代表不外部化"""
+    if not url or url == 'none':
+        return None
+    scheme, _, location = url.partition('://')
+    if scheme not in BACKENDS:
+        raise ValueError(f"不支援的 session 後端：{scheme}")
+    # sqlite:///data/s.db → /data/s.db；sqlite://s.db → s.db
+    return BACKENDS[scheme](location)
+
+
+# ==========================================
+# 同步
+# ==========================================
+def _delta_key(from_seq):
+    return f"{DELTA_PREFIX}{from_seq + 1:012d}"
+
+
+def _load_journal(state, rows):
+    """後端的快照 + 差異 → records / journal / archive；回傳已同步到的 (代號, 序號)"""
+    import ledger_browser
+    reply = {'checkpoint': rows[CHECKPOINT_KEY].decode('ascii'), 'epoch': json.loads(rows[EPOCH_KEY]),
+             'deltas': [rows[k].decode('ascii') for k in sorted(rows) if k.startswith(DELTA_PREFIX)]}
+    journal, archive = ledger_browser.load_journal(reply)
+    state['journal'] = journal
+    state['records'] = journal.replay()
+    if archive is not None:
+        import ledger_tiers
+        state['archive'] = ledger_tiers.Archive.from_payload(archive)
+    return journal.epoch, journal.seq
+
+
+class SessionStore:
+    def __init__(self, backend, keys=PERSIST_KEYS, ttl=SESSION_TTL):
+        self.backend = backend
+        self.keys = keys
+        self.ttl = ttl
+        self._writes = 0
+
+    def attach(self, state, token):
+        """這個行程第一次看到這個 session：由後端載回資料 (尚未建立的 key 才填入)"""
+        rows = self.backend.load(token)
+        # 差異列一律記下：下次重寫快照時刪掉，不會被套到新的快照上
+        meta = {'token': token, 'seen': {}, 'synced': None, 'owner': None,
+                'deltas': {k for k in rows if k.startswith(DELTA_PREFIX)}}
+        state[STORE_MARKER] = meta
+        if OWNER_KEY in rows:
+            # 已綁定登入者：等 claim() 確認是同一個人才載入
+            meta['owner'] = rows[OWNER_KEY].decode('ascii')
+            meta['pending'] = rows
+            return meta
+        self._restore(state, meta, rows)
+        return meta
+
+    def _restore(self, state, meta, rows):
+        if CHECKPOINT_KEY in rows and EPOCH_KEY in rows and not any(k in state for k in JOURNAL_KEYS):
+            try:
+                meta['synced'] = _load_journal(state, rows)
+            except Exception:
+                meta['synced'] = None
+        for key, blob in rows.items():
+            if key not in self.keys or key in state:
+                continue
+            try:
+                state[key] = decode(blob)
+            except Exception:
+                continue
+            meta['seen'][key] = _digest(blob)
+
+    def claim(self, state, owner):
+        """登入後呼叫：把 session 綁定到這個登入者
+
+        回傳 True 代表剛載回這個登入者先前的資料 (app 應重新執行)；
+        None 代表代號屬於別人，資料不載入、呼叫端應換一個新代號。
+        """
+        meta = state[STORE_MARKER] if STORE_MARKER in state else None
+        if meta is None or not owner:
+            return False
+        digest = _owner_digest(owner)
+        if meta['owner'] is None:
+            meta['owner'] = digest
+            self.backend.save(meta['token'], {OWNER_KEY: digest.encode('ascii')})
+            return False
+        if meta['owner'] != digest:
+            return None
+        rows = meta.pop('pending', None)
+        if rows is None:
+            return False
+        # 登入前 app 已建立的初始值 (空的 records 之類) 換成後端的資料
+        for key in self.keys:
+            if key in state and (key in rows or (key in JOURNAL_KEYS and CHECKPOINT_KEY in rows)):
+                del state[key]
+        self._restore(state, meta, rows)
+        return True
+
+    def _flush_journal(self, state, meta, changed, deleted):
+        """有操作日誌時：只追加上次寫入後的新事件；日誌壓縮或整份換掉時重寫快照並刪掉舊差異"""
+        import ledger_browser
+        archive = state['archive'] if 'archive' in state else None
+        command = ledger_browser.pending(state['journal'], state['records'], meta['synced'], archive)
+        if command is None:
+            return
+        if command['op'] == 'checkpoint':
+            changed[CHECKPOINT_KEY] = command['data'].encode('ascii')
+            changed[EPOCH_KEY] = json.dumps(command['epoch']).encode('ascii')
+            deleted.extend(meta['deltas'])
+            meta['deltas'] = set()
+        else:
+            key = _delta_key(command['from'])
+            changed[key] = command['data'].encode('ascii')
+            meta['deltas'].add(key)
+        meta['synced'] = (command['epoch'], command['seq'])
+
+    def flush(self, state):
+        """把上次寫入後有變動的 key 寫回後端，回傳寫入的 key 數"""
+        meta = state[STORE_MARKER] if STORE_MARKER in state else None
+        if meta is None or 'pending' in meta:
+            # 還沒確認登入者的 session 不寫入，避免蓋掉後端裡原本的資料
+            return 0
+        seen = meta['seen']
+        changed, deleted = {}, []
+        journaled = 'journal' in state and 'records' in state
+        if journaled:
+            self._flush_journal(state, meta, changed, deleted)
+        for key in self.keys:
+            if key not in state or (journaled and key in JOURNAL_KEYS):
+                continue
+            try:
+                blob = encode(state[key])
+            except Exception:
+                continue
+            digest = _digest(blob)
+            if seen.get(key) != digest:
+                changed[key] = blob
+            seen[key] = digest
+        # 改由日誌保存 (或已從狀態移除) 的 key：後端裡舊的整份資料一併刪掉
+        for key in list(seen):
+            if key not in state or (journaled and key in JOURNAL_KEYS):
+                deleted.append(key)
+                del seen[key]
+        if changed or deleted:
+            self.backend.save(meta['token'], changed, deleted)
+            self._writes += 1
+            if self._writes % _PURGE_EVERY == 1:
+                self.backend.purge(time.time() - self.ttl)
+        return len(changed) + len(deleted)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """依環境變數建立 (一個行程一個) SessionStore；未設定時回傳 None"""
+    global _store
+    if _store is None and STORE_URL:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore(open_backend(STORE_URL))
+    return _store
+
+
+def _token():
+    """網址上的 ?sid=；第一次進來時產生一個並寫回網址，重新整理或換行程都帶得回來"""
+    import streamlit as st
+    token = st.query_params.get(QUERY_PARAM)
+    if not token:
+        token = secrets.token_urlsafe(16)
+        st.query_params[QUERY_PARAM] = token
+    return token
+
+
+def sync(state):
+    """每次執行開頭呼叫：新 session 先載回，已載回的則寫入上一次執行留下的變動"""
+    store = get_store()
+    if store is None:
+        return 0
+    token = _token()
+    meta = state[STORE_MARKER] if STORE_MARKER in state else None
+    if meta is None or meta['token'] != token:
+        # 新的 session，或網址換了代號 (例如登出後清掉網址參數)
+        store.attach(state, token)
+        return 0
+    return store.flush(state)
+
+
+def claim(state, owner):
+    """登入後呼叫：代號綁定登入者；代號屬於別人時換一個新代號 (不載入對方的資料)"""
+    store = get_store()
+    if store is None:
+        return False
+    restored = store.claim(state, owner)
+    if restored is None:
+        import streamlit as st
+        token = secrets.token_urlsafe(16)
+        st.query_params[QUERY_PARAM] = token
+        store.attach(state, token)
+        restored = store.claim(state, owner)
+    return restored
+
+
+def flush(state):
+    store = get_store()
+    return store.flush(state) if store is not None else 0
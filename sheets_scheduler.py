@@ -0,0 +1,242 @@
+import os
+import time
+import heapq
+import random
+import itertools
+import threading
+
+import pandas as pd
+
+# ==========================================
+# Google Sheets 請求排程 (整個行程共用)
+# ==========================================
+# 1. 讀取合併 (single-flight)：多個 session 同時讀同一張工作表時，只發出一次
+#    請求，其餘的等它完成後共用結果。讀取開始之後這個試算表又寫入過，
+#    之後來的讀取就不共用 (結果可能沒有包含那次寫入)，另外發一次請求。
+# 2. 配額控制 (token bucket)：每個試算表的讀 / 寫各有一個每分鐘額度，另外
+#    所有試算表共用一個總額度 (Google 的配額是算在同一個服務帳戶上)。
+#    額度用完時排隊等待，互動操作 (使用者按下的儲存) 優先於背景工作。
+# 3. 被 Google 擋下 (429 / 5xx) 時以指數退避重試，而不是直接顯示寫入失敗。
+#    追加列、建立工作表這類重送會出錯的寫入只在 429 (請求沒有執行) 時重試。
+#    重試的等待總和有上限，遠小於頁面執行的逾時：等太久寧可直接回報錯誤。
+
+READS_PER_MINUTE = int(os.environ.get("LEDGER_SHEETS_READS_PER_MINUTE", 60))
+WRITES_PER_MINUTE = int(os.environ.get("LEDGER_SHEETS_WRITES_PER_MINUTE", 60))
+TOTAL_PER_MINUTE = int(os.environ.get("LEDGER_SHEETS_TOTAL_PER_MINUTE", 240))
+BURST = int(os.environ.get("LEDGER_SHEETS_BURST", 10))
+MAX_RETRIES = int(os.environ.get("LEDGER_SHEETS_MAX_RETRIES", 5))
+MAX_BACKOFF = 8.0
+# 同一個請求所有重試加起來最多等這麼多秒
+RETRY_BUDGET = float(os.environ.get("LEDGER_SHEETS_RETRY_BUDGET", 15))
+# 排隊超過這個時間就放棄 (避免頁面無限轉圈)
+QUEUE_TIMEOUT = 120.0
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_RETRY_STATUS = (429, 500, 502, 503, 504)
+_RETRY_TEXT = ('429', 'RESOURCE_EXHAUSTED', 'Quota exceeded', 'rateLimitExceeded', 'backendError')
+# 被配額擋下的請求一定沒有執行；5xx / 逾時則可能已經寫進去了
+_REJECTED_STATUS = (429,)
+_REJECTED_TEXT = ('429', 'RESOURCE_EXHAUSTED', 'Quota exceeded', 'rateLimitExceeded')
+
+
+class QuotaTimeout(Exception):
+    """排隊等配額超過 QUEUE_TIMEOUT"""
+
+
+class TokenBucket:
+    """每分鐘 rate 個額度、最多累積 burst 個；同時等待時依優先順序 (再依先來後到) 取得"""
+
+    def __init__(self, rate_per_minute, burst=BURST):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        """取得一個額度；回傳等待秒數，逾時則丟出 QuotaTimeout"""
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    first = self._waiting[0] == ticket
+                    if first and self.tokens >= 1:
+                        self.tokens -= 1
+                        heapq.heappop(self._waiting)
+                        self._cond.notify_all()
+                        return now - start
+                    if deadline is not None and now >= deadline:
+                        raise QuotaTimeout(f"等待 Google Sheets 配額超過 {timeout:.0f} 秒")
+                    wait = (1 - self.tokens) / self.rate if first else 1.0
+                    if deadline is not None:
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(max(wait, 0.001))
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+
+
+class _Flight:
+    def __init__(self, started):
+        self.started = started
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _copy(value):
+    # 呼叫端會直接改 DataFrame 欄位，共用結果時各給一份
+    return value.copy() if isinstance(value, pd.DataFrame) else value
+
+
+def is_retryable(error, repeatable=True):
+    """Google 配額 / 暫時性錯誤才重試，權限或網址錯誤直接回報
+
+    repeatable=False (追加列、建立工作表) 時只重試被配額擋下的請求：
+    5xx / 逾時的請求可能已經執行，重送會多追加一次，或因工作表已存在而失敗。
+    """
+    statuses, texts = (_RETRY_STATUS, _RETRY_TEXT) if repeatable else (_REJECTED_STATUS, _REJECTED_TEXT)
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) in statuses:
+        return True
+    code = getattr(error, 'code', None)
+    if code in statuses:
+        return True
+    if repeatable and isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    text = str(error)
+    return any(t in text for t in texts)
+
+
+class SheetsScheduler:
+    def __init__(self, reads_per_minute=READS_PER_MINUTE, writes_per_minute=WRITES_PER_MINUTE,
+                 total_per_minute=TOTAL_PER_MINUTE, burst=BURST, max_retries=MAX_RETRIES,
+                 queue_timeout=QUEUE_TIMEOUT, retry_budget=RETRY_BUDGET, sleep=time.sleep):
+        self.reads_per_minute = reads_per_minute
+        self.writes_per_minute = writes_per_minute
+        self.burst = burst
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self.retry_budget = retry_budget
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._total = TokenBucket(total_per_minute, burst)
+        self._flights = {}
+        # 每個試算表最近一次寫入完成的時間 (time.monotonic)
+        self._written = {}
+        self.stats = {'reads': 0, 'coalesced': 0, 'writes': 0, 'retries': 0, 'waited_sec': 0.0}
+
+    def _bucket(self, kind, spreadsheet):
+        with self._lock:
+            bucket = self._buckets.get((kind, spreadsheet))
+            if bucket is None:
+                rate = self.reads_per_minute if kind == 'read' else self.writes_per_minute
+                bucket = self._buckets[(kind, spreadsheet)] = TokenBucket(rate, self.burst)
+            return bucket
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _call(self, kind, spreadsheet, fn, priority, repeatable=True):
+        """等到額度後執行；遇到配額 / 暫時性錯誤就退避重試 (等待總和不超過 retry_budget)"""
+        slept = 0.0
+        for attempt in range(self.max_retries + 1):
+            waited = self._bucket(kind, spreadsheet).acquire(priority, self.queue_timeout)
+            waited += self._total.acquire(priority, self.queue_timeout)
+            self._count('waited_sec', waited)
+            try:
+                return fn()
+            except Exception as e:
+                delay = min(MAX_BACKOFF, 2 ** attempt)
+                delay += random.uniform(0, delay / 2)
+                if attempt >= self.max_retries or not is_retryable(e, repeatable) or slept + delay > self.retry_budget:
+                    raise
+                self._count('retries')
+                self._sleep(delay)
+                slept += delay
+
+    def read(self, spreadsheet, worksheet, fn, priority=INTERACTIVE):
+        """同一張工作表正在讀取中就等它的結果，不重複發請求
+
+        讀取開始後這個試算表又寫入完成過 (例如呼叫端自己剛存檔)，那次讀取可能是舊資料，改發新的請求。
+        """
+        key = (spreadsheet, worksheet)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None or flight.started <= self._written.get(spreadsheet, float('-inf'))
+            if leader:
+                flight = self._flights[key] = _Flight(time.monotonic())
+        if not leader:
+            self._count('coalesced')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return _copy(flight.result)
+        try:
+            self._count('reads')
+            flight.result = self._call('read', spreadsheet, fn, priority)
+            return _copy(flight.result)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                # 寫入後另外發出的讀取可能已經接手這個 key
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def write(self, spreadsheet, fn, priority=INTERACTIVE, repeatable=True):
+        """repeatable=False：重送會重複寫入的請求 (追加列、建立工作表)，只在被配額擋下時重試"""
+        self._count('writes')
+        try:
+            return self._call('write', spreadsheet, fn, priority, repeatable)
+        finally:
+            # 失敗的寫入也可能已經執行 (5xx / 逾時)，一樣讓之後的讀取不共用舊的結果
+            with self._lock:
+                self._written[spreadsheet] = time.monotonic()
+
+
+scheduler = SheetsScheduler()
+
+
+def read(spreadsheet, worksheet, fn, priority=INTERACTIVE):
+    return scheduler.read(spreadsheet, worksheet, fn, priority)
+
+
+def write(spreadsheet, fn, priority=INTERACTIVE, repeatable=True):
+    return scheduler.write(spreadsheet, fn, priority, repeatable)
+
+
+def open_spreadsheet(conn, spreadsheet, priority=INTERACTIVE):
+    """取得 gspread 的試算表物件 (建立工作表、追加列要用)，同樣經過排程器
+
+    st-gsheets-connection 沒有公開這個功能，只能借用 client 的內部方法 _open_spreadsheet；
+    所有地方都經由這裡，套件改版拿掉它時給出看得懂的錯誤。連線物件若提供公開的
+    open_spreadsheet (例如 fake_gsheets) 就優先使用。
+    """
+    opener = getattr(conn, 'open_spreadsheet', None)
+    if opener is None:
+        opener = getattr(getattr(conn, 'client', None), '_open_spreadsheet', None)
+    if opener is None:
+        raise RuntimeError(f"{type(conn).__name__} 沒有 client._open_spreadsheet (st-gsheets-connection 改版？)，"
+                           "無法建立工作表或追加 Journal")
+    return read(spreadsheet, None, lambda: opener(spreadsheet=spreadsheet), priority)
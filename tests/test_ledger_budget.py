@@ -0,0 +1,43 @@
+import math
+from datetime import date
+
+import pandas as pd
+
+from ledger_budget import OVERALL, actuals_from_records, evaluate, forecast
+
+TODAY = date(2026, 3, 15)
+
+
+def _actuals():
+    df = pd.DataFrame([
+        {'date': '2026-01-05', 'type': '支出', 'category': '飲食', 'amount': 3000},
+        {'date': '2026-01-20', 'type': '支出', 'category': '交通', 'amount': 1000},
+        {'date': '2026-01-25', 'type': '收入', 'category': '薪水', 'amount': 50000},
+        {'date': '2026-03-02', 'type': '支出', 'category': '飲食', 'amount': 4500},
+    ])
+    return actuals_from_records(df)
+
+
+def test_budgets_apply_from_their_month_onwards():
+    budgets = [{'category': OVERALL, 'since': '2000-01', 'amount': 10000},
+               {'category': '飲食', 'since': '2026-01', 'amount': 3000},
+               {'category': '飲食', 'since': '2026-03', 'amount': 5000}]
+    actual, budget, ratio = evaluate(_actuals(), budgets, today=TODAY)
+    assert list(actual.index) == ['2026-01', '2026-02', '2026-03']
+    # 收入不算支出；沒有花費的月份為 0
+    assert list(actual[OVERALL]) == [4000.0, 0.0, 4500.0]
+    assert list(budget['飲食']) == [3000.0, 3000.0, 5000.0]
+    assert list(budget[OVERALL]) == [10000.0] * 3
+    assert ratio.at['2026-01', '飲食'] == 1.0
+    assert math.isnan(budget.at['2026-01', '交通'])
+
+
+def test_forecast_uses_recent_months_as_pace():
+    budgets = [{'category': '飲食', 'since': '2026-01', 'amount': 5000}]
+    actual, budget, _ = evaluate(_actuals(), budgets, today=TODAY)
+    table = forecast(actual, budget, today=TODAY).set_index('分類')
+    elapsed = 15 / 31
+    # 前兩個月平均 1500 / 月，剩下的天數照這個速度
+    assert round(table.at['飲食', '預測月底'], 6) == round(4500 + 1500 * (1 - elapsed), 6)
+    assert table.at['飲食', '狀態'] == '⚠️ 可能超支'
+    assert table.index[0] == OVERALL
@@ -0,0 +1,40 @@
+from datetime import date
+
+import pandas as pd
+
+from ledger_bulk import SELECT, diff, to_grid
+
+
+def _grid():
+    df = pd.DataFrame([
+        {'id': 1, 'date': '2026-01-01', 'type': '支出', 'category': '飲食', 'amount': 100.0, 'note': '午餐'},
+        {'id': 2, 'date': '2026-01-02', 'type': '支出', 'category': '交通', 'amount': 30.0, 'note': None},
+        {'id': 3, 'date': '2026-01-03', 'type': '收入', 'category': '薪水', 'amount': 5000.0, 'note': ''},
+    ])
+    return to_grid(df)
+
+
+def test_unchanged_grid_has_no_diff():
+    grid = _grid()
+    assert diff(grid, grid.copy()) == ({}, [])
+
+
+def test_cell_edits_become_updates():
+    original = _grid()
+    edited = original.copy()
+    edited.at[1, 'amount'] = 120.0
+    edited.at[2, 'date'] = date(2026, 1, 5)
+    edited.at[3, 'note'] = '一月'
+    assert diff(original, edited) == ({1: {'amount': 120.0}, 2: {'date': '2026-01-05'}, 3: {'note': '一月'}}, [])
+
+
+def test_selected_rows_change_category_or_delete():
+    original = _grid()
+    edited = original.copy()
+    edited[SELECT] = [True, True, False]
+    edited.at[1, 'amount'] = 1.0
+    assert diff(original, edited, 'category', '購物') == (
+        {1: {'amount': 1.0, 'category': '購物'}, 2: {'category': '購物'}}, [])
+    # 刪除的列不再帶著修改
+    assert diff(original, edited, 'delete') == ({}, [1, 2])
+    assert diff(original, edited, 'delete', select_all=True) == ({}, [1, 2, 3])
@@ -0,0 +1,40 @@
+import threading
+import time
+
+from ledger_dashboard import fetch_all, merge, status_frame
+
+
+def _rows(member, n):
+    return [{'id': i, 'date': '2026-01-0%d' % (i % 9 + 1), 'type': '支出', 'amount': '10', 'category': '飲食',
+             'note': member} for i in range(n)]
+
+
+def test_reads_in_parallel_and_keeps_partial_results():
+    release = threading.Event()
+
+    def fetch(arg):
+        if arg == 'slow':
+            release.wait(2)
+            return []
+        if arg == 'bad':
+            raise RuntimeError('403')
+        time.sleep(0.2)
+        return _rows(arg, 3)
+
+    t0 = time.monotonic()
+    results = fetch_all({'a': 'a', 'b': 'b', 'bad': 'bad', 'slow': 'slow'}, fetch, timeout=0.5)
+    elapsed = time.monotonic() - t0
+    release.set()
+    # 兩本各 0.2 秒同時讀取，整體由最慢 (逾時) 的那本決定
+    assert elapsed < 1.5
+    assert [results[n]['status'] for n in ('a', 'b', 'bad', 'slow')] == ['ok', 'ok', 'error', 'timeout']
+    assert list(results) == ['a', 'b', 'bad', 'slow']
+    df = merge(results)
+    assert len(df) == 6 and set(df['member']) == {'a', 'b'}
+    assert df['amount'].sum() == 60
+    assert list(status_frame(results)['筆數']) == [3, 3, 0, 0]
+
+
+def test_merge_of_nothing_has_the_usual_columns():
+    assert 'member' in merge({}).columns
+    assert fetch_all({}, lambda arg: []) == {}
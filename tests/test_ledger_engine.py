@@ -0,0 +1,27 @@
+from datetime import date
+
+from ledger_engine import LedgerSession
+
+
+def _record(i, category, amount=10.0):
+    return {'id': i, 'date': '2026-01-01', 'type': '支出', 'category': category, 'amount': amount, 'note': ''}
+
+
+def test_replace_records_invalidates_search_index():
+    state = {'records': [_record(1, '飲食'), _record(2, '交通')]}
+    app = LedgerSession(state)
+    assert list(app.search('category:飲食')) == [0]
+    # 同一份 list 在日誌以外被整份改過 (例如轉換 ID) 再交回來
+    records = state['records']
+    records[:] = [_record(1, '交通'), _record(2, '飲食')]
+    app.replace_records(records)
+    assert list(app.search('category:飲食')) == [1]
+
+
+def test_journal_accessors_follow_undo_redo():
+    app = LedgerSession({})
+    assert not app.can_undo() and not app.can_redo()
+    app.add_or_update(date(2026, 1, 1), '支出', 10.0, '飲食', '午餐')
+    assert app.can_undo() and app.journal().seq == 1
+    app.undo()
+    assert app.can_redo() and not app.can_undo()
@@ -0,0 +1,29 @@
+import numpy as np
+
+import ledger_ids
+
+
+def test_new_ids_survive_sheet_round_trips():
+    rid = ledger_ids.new_id()
+    assert rid >= ledger_ids.MIN_ID
+    for value in (rid, str(rid), float(rid), f"{rid}.0", np.int64(rid)):
+        assert ledger_ids.normalize(value) == rid
+
+
+def test_all_digit_legacy_id_is_migrated():
+    # uuid4 前 8 碼剛好全是數字：試算表會讀成整數或浮點數
+    records = [{'id': '12345678'}, {'id': 12345678}, {'id': 1234567.0}, {'id': 'ab12cd34'}]
+    assert all(ledger_ids.normalize(r['id']) is None for r in records)
+    fresh = ledger_ids.new_id()
+    assert ledger_ids.migrate(records) == 4
+    ids = [r['id'] for r in records]
+    # 轉換後都排在既有新版 ID 之後，並維持原本的先後順序
+    assert ids == sorted(ids) and ids[0] > fresh
+    assert len(set(ids)) == 4
+
+
+def test_migrate_keeps_new_ids_and_replaces_duplicates():
+    rid = ledger_ids.new_id()
+    records = [{'id': rid}, {'id': str(rid)}]
+    assert ledger_ids.migrate(records) == 1
+    assert records[0]['id'] == rid and records[1]['id'] != rid
@@ -0,0 +1,51 @@
+import pickle
+
+import ledger_journal
+from ledger_journal import Journal
+
+
+def _record(i, amount=10.0):
+    return {'id': i, 'date': '2026-01-01', 'type': '支出', 'category': '飲食', 'amount': amount, 'note': ''}
+
+
+def test_replay_matches_records_across_snapshots():
+    records = []
+    journal = Journal(records, snapshot_every=5)
+    for i in range(12):
+        journal.add(records, _record(i))
+        if journal.needs_snapshot():
+            journal.take_snapshot(records)
+    journal.update(records, 3, {'amount': 99.0})
+    journal.delete(records, 7)
+    journal.batch(records, updates={1: {'note': 'x'}}, deletes=[0, 2])
+    assert journal.replay() == records
+
+
+def test_undo_redo_batch_as_one_step():
+    records = [_record(i) for i in range(4)]
+    journal = Journal(records)
+    before = [dict(r) for r in records]
+    journal.batch(records, updates={1: {'amount': 5.0}}, deletes=[0, 3])
+    after = [dict(r) for r in records]
+    journal.undo(records)
+    assert sorted(records, key=lambda r: r['id']) == before
+    journal.redo(records)
+    assert records == after
+    assert journal.replay() == records
+
+
+def test_undo_history_is_capped():
+    records = []
+    journal = Journal(records)
+    for i in range(ledger_journal.UNDO_LIMIT + 20):
+        journal.add(records, _record(i))
+    assert len(journal.undo_stack) == ledger_journal.UNDO_LIMIT
+    while journal.can_undo():
+        journal.undo(records)
+    assert len(records) == 20
+    assert len(journal.redo_stack) == ledger_journal.UNDO_LIMIT
+
+
+def test_pickled_journal_keeps_the_cap():
+    journal = pickle.loads(pickle.dumps(Journal([_record(1)])))
+    assert journal.undo_stack.maxlen == ledger_journal.UNDO_LIMIT
@@ -0,0 +1,50 @@
+import random
+from datetime import date, timedelta
+
+from ledger_query import LedgerIndex, parse_query
+
+
+def _records(n, seed=7):
+    rng = random.Random(seed)
+    cats = ['飲食', '交通', '購物', '薪水']
+    notes = ['午餐', 'Netflix', '捷運', '', None]
+    return [{'id': i, 'date': (date(2025, 11, 1) + timedelta(days=rng.randrange(150))).isoformat(),
+             'type': '收入' if rng.random() < 0.2 else '支出', 'category': rng.choice(cats),
+             'amount': float(rng.choice([50, 120, 500, 501, 1200, 3000])), 'note': rng.choice(notes)}
+            for i in range(n)]
+
+
+def _brute(records, keep):
+    return [i for i, r in enumerate(records) if keep(r)]
+
+
+def test_range_and_exact_conditions_match_brute_force():
+    records = _records(700)
+    index = LedgerIndex(records)
+    cases = {
+        'amount>500': lambda r: r['amount'] > 500,
+        '金額<=120': lambda r: r['amount'] <= 120,
+        'amount:100..600': lambda r: 100 <= r['amount'] <= 600,
+        '2026-01..2026-02': lambda r: '2026-01-01' <= r['date'] <= '2026-02-31',
+        'date>=2026-01-15': lambda r: r['date'] >= '2026-01-15',
+        'type:收入': lambda r: r['type'] == '收入',
+        'category:飲食,交通 amount>=501': lambda r: r['category'] in ('飲食', '交通') and r['amount'] >= 501,
+        'netflix 2025': lambda r: 'netflix' in (r['note'] or '').casefold() and r['date'].startswith('2025'),
+    }
+    for query, keep in cases.items():
+        assert index.search(query) == _brute(records, keep), query
+        assert index.count(query) == len(_brute(records, keep)), query
+
+
+def test_extend_matches_rebuild():
+    records = _records(300)
+    index = LedgerIndex(records[:120])
+    index.extend(records)
+    fresh = LedgerIndex(records)
+    for query in ('amount>500', 'category:購物', '2026-02', '午餐', 'type:支出 amount:..120'):
+        assert index.search(query) == fresh.search(query), query
+
+
+def test_parse_query_falls_back_to_text():
+    assert parse_query('amount>abc') == [('text', 'amount>abc')]
+    assert parse_query('') == []
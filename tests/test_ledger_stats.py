@@ -0,0 +1,46 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from ledger_stats import RollingStats, WINDOWS
+
+
+def _record(i, day, amount, category='飲食'):
+    return {'id': i, 'date': day.isoformat(), 'type': '支出', 'category': category, 'amount': amount, 'note': ''}
+
+
+def _windows(stats):
+    return {w: {k: [c[0], round(c[1], 6), round(c[2], 6)] for k, c in stats.windows[w].items()} for w in WINDOWS}
+
+
+def test_incremental_changes_match_rebuild():
+    rng = random.Random(3)
+    today = date(2026, 3, 1)
+    records = [_record(i, today - timedelta(days=rng.randrange(200)), float(rng.randrange(10, 900)),
+                       rng.choice(['飲食', '交通'])) for i in range(300)]
+    stats = RollingStats.from_records(records[:200], today)
+    for r in records[200:]:
+        stats.apply_change(None, r)
+    for old in records[:30]:
+        new = dict(old, amount=old['amount'] + 5)
+        stats.apply_change(old, new)
+        records[records.index(old)] = new
+    assert _windows(stats) == _windows(RollingStats.from_records(records, today))
+
+
+@pytest.mark.parametrize('days', [1, 10, 95, 400])
+def test_advance_matches_rebuild_on_the_new_day(days):
+    start = date(2026, 1, 1)
+    records = [_record(i, start + timedelta(days=d), 100.0 + d) for i, d in enumerate(range(-120, 60, 3))]
+    moved = RollingStats.from_records(records, start).advance(start + timedelta(days=days))
+    assert _windows(moved) == _windows(RollingStats.from_records(records, start + timedelta(days=days)))
+
+
+def test_zscore_flags_outlier_and_skips_small_samples():
+    day = date(2026, 1, 1)
+    records = [_record(i, day, 100.0 + i % 3) for i in range(20)] + [_record(99, day, 5000.0)]
+    stats = RollingStats.from_records(records, day)
+    assert stats.zscore(records[-1]) > 3
+    few = RollingStats.from_records(records[:3], day)
+    assert few.zscore(records[0]) is None
@@ -0,0 +1,61 @@
+import random
+from datetime import date, timedelta
+
+import ledger_suggest
+from ledger_suggest import NoteIndex, NoteTrie, TOP_K
+
+
+def _record(i, note, day=0, r_type='支出', category='飲食'):
+    return {'id': i, 'date': (date(2026, 1, 1) + timedelta(days=day)).isoformat(), 'type': r_type,
+            'category': category, 'amount': 10.0, 'note': note}
+
+
+def _brute_top(trie, prefix):
+    keys = [k for k in trie.scores if k.startswith(prefix)]
+    return sorted(keys, key=lambda k: -trie.scores[k])[:TOP_K]
+
+
+def test_delete_then_add_at_top_k_boundary():
+    # 超過 TOP_K 種備註：刪掉唯一一筆 n8 之後再新增，不能因為快取裡還留著 n8 而 KeyError
+    records = [_record(i, f"n{i}", day=i) for i in range(TOP_K + 2)]
+    index = NoteIndex.from_records(records)
+    index.apply_change(old=records[8])
+    index.apply_change(new=_record(99, 'n3', day=30))
+    index.apply_change(new=_record(100, 'zzz', day=31))
+    assert 'n8' not in index.suggest('n', '支出', limit=TOP_K)
+    assert index.suggest('n', '支出', limit=1) == ['n3']
+
+
+def test_trie_matches_brute_force_under_random_changes():
+    rng = random.Random(7)
+    trie = NoteTrie()
+    words = [''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))) for _ in range(40)]
+    for _ in range(3000):
+        key = rng.choice(words)
+        current = trie.scores.get(key, 0.0)
+        if rng.random() < 0.6:
+            trie.raise_score(key, current + rng.uniform(0.1, 5))
+        elif current:
+            trie.lower_score(key, 0 if rng.random() < 0.5 else current / 2)
+        prefix = key[:rng.randint(0, len(key))]
+        got = trie.top(prefix)
+        assert [trie.scores[k] for k in got] == [trie.scores[k] for k in _brute_top(trie, prefix)]
+
+
+def test_incremental_index_matches_rebuild():
+    records = [_record(i, note, day=i % 50, category=cat) for i, (note, cat) in
+               enumerate([('午餐', '飲食'), ('午餐便當', '飲食'), ('加油', '交通'), ('Netflix', '訂閱')] * 10)]
+    index = NoteIndex.from_records(records[:20])
+    for r in records[20:]:
+        index.apply_change(new=r)
+    for r in records[:5]:
+        index.apply_change(old=r)
+    rebuilt = NoteIndex.from_records(records[5:])
+    for prefix in ('午', '加', 'net'):
+        assert index.suggest(prefix, '支出') == rebuilt.suggest(prefix, '支出')
+    assert index.predict_category('netflix', '支出') == '訂閱'
+    assert index.predict_category('午', '支出') == '飲食'
+
+
+def test_normalize_ignores_case_and_spacing():
+    assert ledger_suggest.normalize('  Netflix   Plan ') == ledger_suggest.normalize('netflix plan')
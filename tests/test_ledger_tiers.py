@@ -0,0 +1,76 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import ledger_rollup
+import ledger_tiers
+from ledger_query import LedgerIndex
+from ledger_tiers import Archive, TieredSession
+
+TODAY = date(2026, 6, 15)
+
+
+@pytest.fixture(autouse=True)
+def small_ledgers(monkeypatch):
+    # 測試資料只有幾百筆，也要分層
+    monkeypatch.setattr(ledger_tiers, 'TIER_MIN_RECORDS', 10)
+
+
+def _records(n=400, seed=5, today=TODAY):
+    rng = random.Random(seed)
+    return [{'id': i, 'date': (today - timedelta(days=rng.randrange(365))).isoformat(),
+             'type': rng.choice(['支出', '支出', '收入']), 'category': rng.choice(['飲食', '交通', '薪水']),
+             'amount': float(rng.randrange(10, 3000)), 'note': rng.choice(['午餐', '捷運', ''])}
+            for i in range(n)]
+
+
+def test_freeze_keeps_hot_window_and_loses_nothing():
+    records = _records()
+    archive = Archive()
+    hot, frozen = archive.freeze(records, today=TODAY)
+    since = ledger_tiers.hot_since(TODAY)
+    assert all(r['date'][:7] >= since for r in hot)
+    assert frozen == len(archive) == len(records) - len(hot)
+    key = lambda r: r['id']
+    assert sorted(archive.merge(hot), key=key) == sorted(records, key=key)
+    cold = [r for r in records if r['date'][:7] < since]
+    assert archive.rollup() == ledger_rollup.build_rollup(cold)
+
+
+def test_search_matches_brute_force_and_skips_months():
+    records = _records()
+    archive = Archive()
+    hot, _ = archive.freeze(records, today=TODAY)
+    cold = archive.merge([])
+    for query in ('2025-09..2025-12 amount>1500', '2025-08', 'type:收入 2025', '午餐 2025-10..2025-11'):
+        rows, opened = archive.search(query)
+        expected = [cold[i] for i in LedgerIndex(cold).search(query)]
+        assert sorted(r['id'] for r in rows) == sorted(r['id'] for r in expected), query
+    _, opened = archive.search('2025-08')
+    assert opened == 1
+    # 沒有日期條件時只搜尋熱資料
+    assert archive.search('午餐') == ([], 0)
+
+
+def test_payload_round_trip():
+    archive = Archive()
+    archive.freeze(_records(), today=TODAY)
+    again = Archive.from_payload(archive.to_payload())
+    assert again.months() == archive.months()
+    assert again.merge([]) == archive.merge([])
+    assert again.moments() == archive.moments()
+
+
+def test_promoted_month_stays_hot_until_edit_is_done():
+    # TieredSession 以今天判斷熱資料視窗
+    state = {'records': _records(today=date.today())}
+    app = TieredSession(state)
+    month = app.archive().months()[0]
+    app.promote(month)
+    assert month not in app.archive().months()
+    TieredSession(state)
+    assert month not in state['archive'].months()
+    app.cancel_edit()
+    TieredSession(state)
+    assert month in state['archive'].months()
@@ -0,0 +1,52 @@
+import session_store
+from session_store import SQLiteBackend, SessionStore
+
+
+def test_encode_round_trips_tagged_types():
+    values = [{('2026-01', '支出', '飲食'): [12.5, 2]}, {'2026-01', '2025-12'}, (1, [2, (3,)]),
+              [{'id': 1, 'note': '午餐', 'amount': 1.0}], None]
+    for value in values:
+        assert session_store.decode(session_store.encode(value)) == value
+
+
+def test_decode_never_unpickles():
+    import pickle
+    try:
+        session_store.decode(pickle.dumps({'x': 1}))
+    except ValueError:
+        return
+    raise AssertionError("pickle 的資料不應被載回")
+
+
+def test_plain_keys_written_only_when_changed(tmp_path):
+    store = SessionStore(SQLiteBackend(str(tmp_path / 's.db')))
+    state = {}
+    store.attach(state, 'tok')
+    state['promoted'] = {'2026-01'}
+    state['budget'] = 30000.0
+    assert store.flush(state) == 2
+    assert store.flush(state) == 0
+    loaded = {}
+    store.attach(loaded, 'tok')
+    assert loaded['promoted'] == {'2026-01'} and loaded['budget'] == 30000.0
+
+
+def test_claimed_session_loads_only_for_its_owner(tmp_path):
+    store = SessionStore(SQLiteBackend(str(tmp_path / 's.db')))
+    state = {}
+    store.attach(state, 'tok')
+    assert store.claim(state, 'alice') is False
+    state['budget'] = 123.0
+    store.flush(state)
+
+    # 別人拿到代號：登入前、登入別的帳號都不載入，也不會寫回
+    other = {'budget': 1.0}
+    store.attach(other, 'tok')
+    assert other == {'budget': 1.0, session_store.STORE_MARKER: other[session_store.STORE_MARKER]}
+    assert store.flush(other) == 0
+    assert store.claim(other, 'bob') is None
+
+    again = {'budget': 30000.0}
+    store.attach(again, 'tok')
+    assert store.claim(again, 'alice') is True
+    assert again['budget'] == 123.0
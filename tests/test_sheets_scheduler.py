@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from sheets_scheduler import SheetsScheduler
+
+
+class Quota(Exception):
+    code = 429
+
+
+def test_read_started_before_a_write_is_not_shared():
+    scheduler = SheetsScheduler()
+    started, release = threading.Event(), threading.Event()
+    results = {}
+
+    def slow_read():
+        started.set()
+        release.wait(5)
+        return 'old'
+
+    first = threading.Thread(target=lambda: results.setdefault('first', scheduler.read('s', 'w', slow_read)))
+    first.start()
+    started.wait(5)
+    scheduler.write('s', lambda: None)
+    # 寫入之後才來的讀取不能拿到寫入之前開始的結果
+    results['after_write'] = scheduler.read('s', 'w', lambda: 'new')
+    release.set()
+    first.join(5)
+    assert results == {'first': 'old', 'after_write': 'new'}
+    assert scheduler.stats['reads'] == 2 and scheduler.stats['coalesced'] == 0
+
+
+def test_concurrent_reads_are_still_coalesced():
+    scheduler = SheetsScheduler()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_read():
+        started.set()
+        release.wait(5)
+        return 'v'
+
+    first = threading.Thread(target=scheduler.read, args=('s', 'w', slow_read))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=scheduler.read, args=('s', 'w', lambda: 'other'))
+    second.start()
+    deadline = time.monotonic() + 5
+    while scheduler.stats['coalesced'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert scheduler.stats['reads'] == 1
+
+
+def test_retries_stop_within_the_budget():
+    slept = []
+    scheduler = SheetsScheduler(max_retries=10, retry_budget=10, sleep=slept.append)
+
+    def rejected():
+        raise Quota("429 RESOURCE_EXHAUSTED")
+
+    with pytest.raises(Quota):
+        scheduler.write('s', rejected)
+    assert slept and sum(slept) <= 10